@@ -158,6 +158,134 @@ SPOTIFY_SCOPES = ' '.join([
     'user-read-playback-state'  # Added for device access
 ])
 
+# Outbound Spotify HTTP client (one pooled session per process)
+SPOTIFY_HTTP_POOL_CONNECTIONS = int(os.getenv('SPOTIFY_HTTP_POOL_CONNECTIONS', '4'))
+SPOTIFY_HTTP_POOL_SIZE = int(os.getenv('SPOTIFY_HTTP_POOL_SIZE', '20'))
+SPOTIFY_HTTP_TIMEOUT = float(os.getenv('SPOTIFY_HTTP_TIMEOUT', '5'))
+SPOTIFY_HTTP_RETRIES = int(os.getenv('SPOTIFY_HTTP_RETRIES', '3'))
+# Threads for independent Spotify calls made concurrently within a request
+SPOTIFY_HTTP_CONCURRENCY = int(os.getenv('SPOTIFY_HTTP_CONCURRENCY', '16'))
+# Tighter timeouts (seconds) for endpoints behind page loads, by longest
+# matching path prefix under /v1/; anything else uses SPOTIFY_HTTP_TIMEOUT
+SPOTIFY_HTTP_ENDPOINT_TIMEOUTS = {
+    'me': 2,
+    'me/player': 2,
+    'me/top': 3,
+    'search': 3,
+}
+
+# Stop calling Spotify for SPOTIFY_BREAKER_COOLDOWN seconds after this many
+# consecutive timeouts, connection errors or 5xx responses
+SPOTIFY_BREAKER_FAILURE_THRESHOLD = int(os.getenv('SPOTIFY_BREAKER_FAILURE_THRESHOLD', '5'))
+SPOTIFY_BREAKER_COOLDOWN = float(os.getenv('SPOTIFY_BREAKER_COOLDOWN', '30'))
+
+# Outbound Spotify rate limit, per worker process: token buckets for the app
+# and for each user (requests per second and burst size), the share of the app
+# bucket kept back from low priority calls, and how long a normal call may
+# wait for budget (or for Spotify's Retry-After) before giving up
+SPOTIFY_RATE_LIMIT_APP_RATE = float(os.getenv('SPOTIFY_RATE_LIMIT_APP_RATE', '10'))
+SPOTIFY_RATE_LIMIT_APP_BURST = int(os.getenv('SPOTIFY_RATE_LIMIT_APP_BURST', '50'))
+SPOTIFY_RATE_LIMIT_USER_RATE = float(os.getenv('SPOTIFY_RATE_LIMIT_USER_RATE', '2'))
+SPOTIFY_RATE_LIMIT_USER_BURST = int(os.getenv('SPOTIFY_RATE_LIMIT_USER_BURST', '10'))
+SPOTIFY_RATE_LIMIT_LOW_RESERVE = float(os.getenv('SPOTIFY_RATE_LIMIT_LOW_RESERVE', '0.25'))
+SPOTIFY_RATE_LIMIT_MAX_WAIT = float(os.getenv('SPOTIFY_RATE_LIMIT_MAX_WAIT', '2'))
+
+# Caching
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# The 'spotify' cache holds catalog data fetched from Spotify. Local memory
+# (LRU-culled at MAX_ENTRIES) by default; point SPOTIFY_CACHE_BACKEND and
+# SPOTIFY_CACHE_LOCATION at a shared store such as Redis in production.
+SPOTIFY_CACHE_BACKEND = os.getenv('SPOTIFY_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'spotify': {
+        'BACKEND': SPOTIFY_CACHE_BACKEND,
+        'LOCATION': os.getenv('SPOTIFY_CACHE_LOCATION', 'spotify'),
+        'TIMEOUT': 600,
+    },
+}
+if SPOTIFY_CACHE_BACKEND.endswith('LocMemCache'):
+    CACHES['spotify']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv('SPOTIFY_CACHE_MAX_ENTRIES', '5000')),
+    }
+
+# Seconds a search result stays cached
+SPOTIFY_SEARCH_CACHE_TTL = int(os.getenv('SPOTIFY_SEARCH_CACHE_TTL', '600'))
+# Answer searches from the local catalog when it has at least this many
+# matches for every requested type, and only call Spotify otherwise
+SPOTIFY_SEARCH_LOCAL_FIRST = os.getenv('SPOTIFY_SEARCH_LOCAL_FIRST', 'True') == 'True'
+SPOTIFY_SEARCH_LOCAL_MIN_RESULTS = int(os.getenv('SPOTIFY_SEARCH_LOCAL_MIN_RESULTS', '5'))
+# Profile data (account, top artists/tracks) is served from the cache for up
+# to STALE_TTL seconds, and refreshed in the background once older than
+# FRESH_TTL (TOP_FRESH_TTL for top items, which Spotify updates about daily)
+SPOTIFY_PROFILE_FRESH_TTL = int(os.getenv('SPOTIFY_PROFILE_FRESH_TTL', '300'))
+SPOTIFY_PROFILE_TOP_FRESH_TTL = int(os.getenv('SPOTIFY_PROFILE_TOP_FRESH_TTL', '3600'))
+SPOTIFY_PROFILE_STALE_TTL = int(os.getenv('SPOTIFY_PROFILE_STALE_TTL', '604800'))
+# The profile page polls what is playing every POLL_INTERVAL seconds; answers
+# are shared between a user's tabs for TTL seconds
+SPOTIFY_CURRENTLY_PLAYING_POLL_INTERVAL = int(os.getenv('SPOTIFY_CURRENTLY_PLAYING_POLL_INTERVAL', '30'))
+SPOTIFY_CURRENTLY_PLAYING_TTL = int(os.getenv('SPOTIFY_CURRENTLY_PLAYING_TTL', '10'))
+# Seconds to remember the device a user's queued tracks go to; forgotten
+# early when Spotify says it is no longer active
+SPOTIFY_ACTIVE_DEVICE_TTL = int(os.getenv('SPOTIFY_ACTIVE_DEVICE_TTL', '120'))
+# Album track listings are shared between users for TTL seconds; each process
+# also keeps the LOCAL_MAX most recently opened albums in memory
+SPOTIFY_ALBUM_TRACKS_TTL = int(os.getenv('SPOTIFY_ALBUM_TRACKS_TTL', '604800'))
+SPOTIFY_ALBUM_TRACKS_LOCAL_MAX = int(os.getenv('SPOTIFY_ALBUM_TRACKS_LOCAL_MAX', '256'))
+# Check each listen later mirror against Spotify's snapshot_id at most this
+# often (seconds) when the page is viewed; run reconcile_listen_later for all users
+SPOTIFY_LISTEN_LATER_RECONCILE_INTERVAL = int(os.getenv('SPOTIFY_LISTEN_LATER_RECONCILE_INTERVAL', '900'))
+# Playlist pages of 100 fetched at once when re-reading a playlist, and
+# tracks per page on the listen later page
+SPOTIFY_LISTEN_LATER_FETCH_CONCURRENCY = int(os.getenv('SPOTIFY_LISTEN_LATER_FETCH_CONCURRENCY', '4'))
+SPOTIFY_LISTEN_LATER_PAGE_SIZE = int(os.getenv('SPOTIFY_LISTEN_LATER_PAGE_SIZE', '50'))
+# Most track URIs accepted by one bulk add/remove/queue request
+SPOTIFY_BULK_MAX_TRACKS = int(os.getenv('SPOTIFY_BULK_MAX_TRACKS', '500'))
+
+# Posts per page in the feed and on profiles (clients may ask for up to the max)
+SOCIAL_POSTS_PAGE_SIZE = int(os.getenv('SOCIAL_POSTS_PAGE_SIZE', '20'))
+SOCIAL_POSTS_MAX_PAGE_SIZE = 100
+
+# Top-level comments per page, and how many replies each one shows before
+# "load more replies"
+SOCIAL_COMMENTS_PAGE_SIZE = int(os.getenv('SOCIAL_COMMENTS_PAGE_SIZE', '20'))
+SOCIAL_COMMENT_REPLIES_PREVIEW = int(os.getenv('SOCIAL_COMMENT_REPLIES_PREVIEW', '3'))
+
+# Home timelines: posts are copied to followers' timelines on write, except
+# for authors with more followers than this, whose posts are merged on read
+SOCIAL_FANOUT_MAX_FOLLOWERS = int(os.getenv('SOCIAL_FANOUT_MAX_FOLLOWERS', '1000'))
+# How many of a user's recent posts land in your timeline when you follow them
+SOCIAL_TIMELINE_BACKFILL = int(os.getenv('SOCIAL_TIMELINE_BACKFILL', '200'))
+
+# "Who to follow": how many ranked suggestions are stored per user, how many
+# seconds old they may get before a page view recomputes them (the
+# refresh_suggestions command keeps them fresher) and how many per page
+SOCIAL_SUGGESTIONS_LIMIT = int(os.getenv('SOCIAL_SUGGESTIONS_LIMIT', '200'))
+SOCIAL_SUGGESTIONS_MAX_AGE = int(os.getenv('SOCIAL_SUGGESTIONS_MAX_AGE', '3600'))
+SOCIAL_SUGGESTIONS_PAGE_SIZE = int(os.getenv('SOCIAL_SUGGESTIONS_PAGE_SIZE', '20'))
+
+# Most users a user search returns (it is ranked, so the rest are poor matches)
+USER_SEARCH_MAX_RESULTS = int(os.getenv('USER_SEARCH_MAX_RESULTS', '50'))
+
+# Background jobs (run with `python manage.py run_jobs`): attempts before a
+# job is marked failed, retry backoff in seconds (doubling from the base up
+# to the max), and how long a running job may go silent before another
+# worker takes it over
+JOBS_MAX_ATTEMPTS = int(os.getenv('JOBS_MAX_ATTEMPTS', '5'))
+JOBS_RETRY_BASE_DELAY = float(os.getenv('JOBS_RETRY_BASE_DELAY', '5'))
+JOBS_RETRY_MAX_DELAY = float(os.getenv('JOBS_RETRY_MAX_DELAY', '600'))
+JOBS_LOCK_TIMEOUT = int(os.getenv('JOBS_LOCK_TIMEOUT', '300'))
+JOBS_POLL_INTERVAL = float(os.getenv('JOBS_POLL_INTERVAL', '1'))
+# Workers check in every HEARTBEAT_INTERVAL seconds. With no check-in for
+# WORKER_TIMEOUT seconds, jobs are run inline in the web process instead
+# (unless INLINE_FALLBACK is off); see core.jobs
+JOBS_HEARTBEAT_INTERVAL = int(os.getenv('JOBS_HEARTBEAT_INTERVAL', '15'))
+JOBS_WORKER_TIMEOUT = int(os.getenv('JOBS_WORKER_TIMEOUT', '60'))
+JOBS_INLINE_FALLBACK = os.getenv('JOBS_INLINE_FALLBACK', 'True') == 'True'
+
 # Logging configuration
 LOGGING = {
     'version': 1,
@@ -34,4 +34,5 @@ urlpatterns = [
     path('spotify/', include('spotify.urls')),
     path('social/', include('social.urls')),
     path('listen-later/', core_views.listen_later, name='listen_later'),
+    path('jobs/<int:job_id>/', core_views.job_status, name='job_status'),
 ]
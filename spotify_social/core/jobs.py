@@ -0,0 +1,278 @@
+"""
+Database-backed background jobs.
+
+Views enqueue slow work (mostly Spotify side effects) with enqueue() and
+return straight away; the run_jobs management command claims due jobs and
+runs the registered handler for each. Failed jobs are retried with
+exponential backoff up to max_attempts, and clients can poll a job's status
+through the job_status view.
+
+A run_jobs worker records a heartbeat while it runs. When none has been
+seen for JOBS_WORKER_TIMEOUT seconds (no worker deployed, or it died), jobs
+are run inline instead: a new job right after it is enqueued, and a due
+retry when its status is polled. Requests get slower, but nothing is left
+queued forever.
+
+Handlers live in each app's jobs.py and are registered with @handler:
+
+    @handler('spotify.add_to_listen_later')
+    def add_to_listen_later(job):
+        ...
+        return {'message': 'Added'}
+
+The return value is stored as the job's result. Raise PermanentJobError for
+failures that retrying won't fix. An exception with a retry_after attribute
+(such as spotify.ratelimit.SpotifyRateLimited) reschedules the job for then
+without using up an attempt.
+"""
+
+import logging
+import os
+import random
+import socket
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job, WorkerHeartbeat
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+# When this process last wrote its worker heartbeat (monotonic seconds)
+_last_heartbeat = None
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when the job can never succeed, so it is not retried"""
+
+
+def handler(name):
+    """Register a function as the handler for jobs called ``name``"""
+    def register(func):
+        _handlers[name] = func
+        return func
+    return register
+
+
+def get_handler(name):
+    return _handlers.get(name)
+
+
+def enqueue(name, payload=None, user=None, idempotency_key=None, delay=0, max_attempts=None):
+    """
+    Queue a job and return it.
+
+    If a job with the same idempotency key is still queued or running, that
+    job is returned instead. A finished one is queued again, so repeating a
+    request after it completed (or failed) runs it once more.
+    """
+    fields = {
+        'name': name,
+        'payload': payload or {},
+        'user': user,
+        'status': Job.QUEUED,
+        'attempts': 0,
+        'max_attempts': max_attempts or settings.JOBS_MAX_ATTEMPTS,
+        'run_at': timezone.now() + timedelta(seconds=delay),
+        'locked_at': None,
+        'locked_by': '',
+        'result': None,
+        'last_error': '',
+        'finished_at': None,
+    }
+    if not idempotency_key:
+        job = Job.objects.create(**fields)
+    else:
+        job = _enqueue_once(idempotency_key, fields)
+
+    # Once the job is committed, so the inline run sees it
+    transaction.on_commit(lambda: run_inline_if_no_worker(job.pk))
+    return job
+
+
+def _enqueue_once(idempotency_key, fields):
+    with transaction.atomic():
+        job = Job.objects.select_for_update().filter(idempotency_key=idempotency_key).first()
+        if job is None:
+            try:
+                with transaction.atomic():
+                    return Job.objects.create(idempotency_key=idempotency_key, **fields)
+            except IntegrityError:
+                # Someone else enqueued it first
+                return Job.objects.get(idempotency_key=idempotency_key)
+        if not job.is_finished:
+            return job
+        for field, value in fields.items():
+            setattr(job, field, value)
+        job.save()
+    return job
+
+
+def request_idempotency_key(request, default=None):
+    """The client's Idempotency-Key header, scoped to the user, or ``default``"""
+    key = request.headers.get('Idempotency-Key')
+    if key:
+        return f'{request.user.pk}:{key[:200]}'
+    return default
+
+
+def default_worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def record_heartbeat(worker_id, force=False):
+    """Note that this worker is alive; writes at most every JOBS_HEARTBEAT_INTERVAL seconds"""
+    global _last_heartbeat
+    now = time.monotonic()
+    if not force and _last_heartbeat is not None and now - _last_heartbeat < settings.JOBS_HEARTBEAT_INTERVAL:
+        return
+    WorkerHeartbeat.objects.update_or_create(worker_id=worker_id, defaults={'last_seen': timezone.now()})
+    _last_heartbeat = now
+
+
+def forget_heartbeat(worker_id):
+    """Remove a stopping worker's heartbeat, and any left by workers that died long ago"""
+    global _last_heartbeat
+    WorkerHeartbeat.objects.filter(
+        Q(worker_id=worker_id) | Q(last_seen__lt=timezone.now() - timedelta(days=1))
+    ).delete()
+    _last_heartbeat = None
+
+
+def worker_alive():
+    """Whether any run_jobs worker has checked in within JOBS_WORKER_TIMEOUT seconds"""
+    cutoff = timezone.now() - timedelta(seconds=settings.JOBS_WORKER_TIMEOUT)
+    return WorkerHeartbeat.objects.filter(last_seen__gte=cutoff).exists()
+
+
+def run_inline_if_no_worker(job_id):
+    """
+    Run a queued, due job in this process if no worker is alive to run it.
+
+    Returns the job as it is afterwards, or None if it doesn't exist.
+    """
+    job = Job.objects.filter(pk=job_id).first()
+    if job is None or not settings.JOBS_INLINE_FALLBACK:
+        return job
+    if job.status != Job.QUEUED or job.run_at > timezone.now() or worker_alive():
+        return job
+
+    worker_id = f'inline:{default_worker_id()}'
+    if not _claim(job, worker_id, timezone.now()):
+        return Job.objects.get(pk=job_id)
+    logger.warning(f"No job worker seen in {settings.JOBS_WORKER_TIMEOUT}s, running job {job} inline")
+    return run_job(Job.objects.get(pk=job_id))
+
+
+def _claim(job, worker_id, now):
+    """Mark a job as running for worker_id unless someone else claimed it first"""
+    stale = now - timedelta(seconds=settings.JOBS_LOCK_TIMEOUT)
+    return Job.objects.filter(pk=job.pk, status=job.status).filter(
+        Q(status=Job.QUEUED) | Q(locked_at__lt=stale)
+    ).update(
+        status=Job.RUNNING,
+        locked_at=now,
+        locked_by=worker_id,
+        attempts=F('attempts') + 1
+    ) == 1
+
+
+def claim_next(worker_id):
+    """
+    Claim the next due job for this worker, or return None if there is none.
+
+    Claiming is a conditional UPDATE on the job's status, so two workers
+    racing for the same job can't both get it. Jobs left running by a worker
+    that died are picked up again after JOBS_LOCK_TIMEOUT.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.JOBS_LOCK_TIMEOUT)
+    due = Job.objects.filter(
+        Q(status=Job.QUEUED, run_at__lte=now) | Q(status=Job.RUNNING, locked_at__lt=stale)
+    ).order_by('run_at', 'id')
+
+    for job in due.only('id', 'status')[:10]:
+        if _claim(job, worker_id, now):
+            return Job.objects.get(pk=job.pk)
+    return None
+
+
+def retry_delay(attempts):
+    """Seconds to wait before the next attempt: exponential backoff with jitter"""
+    delay = min(settings.JOBS_RETRY_BASE_DELAY * 2 ** (attempts - 1), settings.JOBS_RETRY_MAX_DELAY)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def run_job(job):
+    """Run a claimed job and record the outcome"""
+    func = get_handler(job.name)
+    now = timezone.now()
+    try:
+        if func is None:
+            raise PermanentJobError(f"No handler registered for job {job.name}")
+        result = func(job)
+    except Exception as e:
+        job.last_error = f"{type(e).__name__}: {str(e)}"
+        job.locked_at = None
+        job.locked_by = ''
+        retry_after = getattr(e, 'retry_after', None)
+        if retry_after is not None and not isinstance(e, PermanentJobError):
+            # Throttled, not failed: try again when the limit lifts
+            job.status = Job.QUEUED
+            job.attempts -= 1
+            job.run_at = now + timedelta(seconds=retry_after)
+            logger.info(f"Job {job} throttled, retrying at {job.run_at}")
+        elif isinstance(e, PermanentJobError) or job.attempts >= job.max_attempts:
+            job.status = Job.FAILED
+            job.finished_at = now
+            logger.error(f"Job {job} failed after {job.attempts} attempts: {job.last_error}")
+        else:
+            job.status = Job.QUEUED
+            job.run_at = now + timedelta(seconds=retry_delay(job.attempts))
+            logger.warning(f"Job {job} attempt {job.attempts} failed, retrying at {job.run_at}: {job.last_error}")
+        job.save(update_fields=[
+            'status', 'attempts', 'run_at', 'locked_at', 'locked_by', 'last_error', 'finished_at', 'updated_at'
+        ])
+        return job
+
+    job.status = Job.SUCCEEDED
+    job.result = result
+    job.finished_at = now
+    job.locked_at = None
+    job.locked_by = ''
+    job.save(update_fields=['status', 'result', 'finished_at', 'locked_at', 'locked_by', 'updated_at'])
+    logger.info(f"Job {job} succeeded")
+    return job
+
+
+def run_pending(worker_id=None, max_jobs=None):
+    """Run due jobs until there are none left (or max_jobs ran); returns how many ran"""
+    worker_id = worker_id or default_worker_id()
+    ran = 0
+    while max_jobs is None or ran < max_jobs:
+        record_heartbeat(worker_id)
+        job = claim_next(worker_id)
+        if job is None:
+            break
+        run_job(job)
+        ran += 1
+    return ran
+
+
+def serialize_job(job):
+    """JSON representation of a job for the status endpoint"""
+    return {
+        'id': job.id,
+        'name': job.name,
+        'status': job.status,
+        'attempts': job.attempts,
+        'result': job.result,
+        'error': job.last_error if job.status == Job.FAILED else None,
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
@@ -1,7 +1,9 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
 from social.models import Post, Follow
-from spotify.models import TrackRating
+from social import timeline
+from spotify import catalog
+from spotify.models import TrackRating, TrackRatingStats
 import random
 
 User = get_user_model()
@@ -29,7 +31,9 @@ class Command(BaseCommand):
             User.objects.filter(is_superuser=False).delete()
             Post.objects.all().delete()
             Follow.objects.all().delete()
+            User.objects.update(follower_count=0, following_count=0)
             TrackRating.objects.all().delete()
+            TrackRatingStats.objects.all().delete()
             self.stdout.write(self.style.SUCCESS('Existing data cleared.'))
 
         num_users = options['users']
@@ -240,10 +244,10 @@ class Command(BaseCommand):
                         post_type='track',
                         content=random.choice(sample_comments),
                         spotify_id=track['id'],
-                        spotify_name=track['name'],
-                        spotify_artist=track['artist'],
-                        spotify_image_url=track['image'],
-                        spotify_url=track['url'],
+                        track=catalog.remember_item(
+                            'track', track['id'], track['name'], track['artist'],
+                            image_url=track['image'], spotify_url=track['url']
+                        ),
                         rating=random.choice([None, None, round(random.uniform(6.0, 10.0), 1)])
                     )
                 else:  # Album post
@@ -253,10 +257,10 @@ class Command(BaseCommand):
                         post_type='album',
                         content=random.choice(sample_comments),
                         spotify_id=album['id'],
-                        spotify_name=album['name'],
-                        spotify_artist=album['artist'],
-                        spotify_image_url=album['image'],
-                        spotify_url=album['url'],
+                        album=catalog.remember_item(
+                            'album', album['id'], album['name'], album['artist'],
+                            image_url=album['image'], spotify_url=album['url']
+                        ),
                         rating=round(random.uniform(7.0, 10.0), 1)
                     )
 
@@ -268,15 +272,14 @@ class Command(BaseCommand):
             rated_tracks = random.sample(sample_tracks, min(num_ratings, len(sample_tracks)))
             
             for track in rated_tracks:
-                TrackRating.objects.get_or_create(
-                    user=user,
-                    track_id=track['id'],
-                    defaults={
-                        'track_name': track['name'],
-                        'artist_name': track['artist'],
-                        'rating': round(random.uniform(6.0, 10.0), 1)
-                    }
-                )
+                if not TrackRating.objects.filter(user=user, track_id=track['id']).exists():
+                    TrackRating.set_rating(
+                        user,
+                        track['id'],
+                        track['name'],
+                        track['artist'],
+                        round(random.uniform(6.0, 10.0), 1)
+                    )
 
         # Create follow relationships
         self.stdout.write('Creating follow relationships...')
@@ -287,10 +290,12 @@ class Command(BaseCommand):
             users_to_follow = random.sample(possible_follows, num_follows)
             
             for follow_user in users_to_follow:
-                Follow.objects.get_or_create(
+                follow, created = Follow.objects.get_or_create(
                     follower=user,
                     following=follow_user
                 )
+                if created:
+                    timeline.backfill(user, follow_user)
 
         # Print summary
         total_users = User.objects.count()
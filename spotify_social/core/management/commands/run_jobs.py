@@ -0,0 +1,52 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs, polling for new ones until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run the jobs that are due now, then exit'
+        )
+        parser.add_argument(
+            '--max-jobs',
+            type=int,
+            default=None,
+            help='Exit after running this many jobs'
+        )
+        parser.add_argument(
+            '--worker-id',
+            default=None,
+            help='Name recorded on claimed jobs (default: host:pid)'
+        )
+
+    def handle(self, *args, **options):
+        worker_id = options['worker_id'] or jobs.default_worker_id()
+        max_jobs = options['max_jobs']
+        self.stdout.write(f'Worker {worker_id} started')
+
+        jobs.record_heartbeat(worker_id, force=True)
+        total = 0
+        try:
+            while max_jobs is None or total < max_jobs:
+                ran = jobs.run_pending(
+                    worker_id,
+                    max_jobs=None if max_jobs is None else max_jobs - total
+                )
+                total += ran
+                if options['once']:
+                    break
+                if not ran:
+                    time.sleep(settings.JOBS_POLL_INTERVAL)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            jobs.forget_heartbeat(worker_id)
+
+        self.stdout.write(self.style.SUCCESS(f'Worker {worker_id} ran {total} jobs.'))
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 19:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0004_user_top_artist1_id_user_top_artist1_image_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="spotify_token_expires_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.0.2 on 2026-10-18 21:02
+
+from django.db import migrations
+
+# SQLite: an external-content FTS5 table over core_user, kept in sync by triggers
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE core_user_fts USING fts5(
+        username, first_name, last_name,
+        content='core_user', content_rowid='id',
+        tokenize='unicode61', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER core_user_fts_insert AFTER INSERT ON core_user BEGIN
+        INSERT INTO core_user_fts(rowid, username, first_name, last_name)
+        VALUES (new.id, new.username, new.first_name, new.last_name);
+    END
+    """,
+    """
+    CREATE TRIGGER core_user_fts_delete AFTER DELETE ON core_user BEGIN
+        INSERT INTO core_user_fts(core_user_fts, rowid, username, first_name, last_name)
+        VALUES ('delete', old.id, old.username, old.first_name, old.last_name);
+    END
+    """,
+    """
+    CREATE TRIGGER core_user_fts_update AFTER UPDATE OF username, first_name, last_name ON core_user BEGIN
+        INSERT INTO core_user_fts(core_user_fts, rowid, username, first_name, last_name)
+        VALUES ('delete', old.id, old.username, old.first_name, old.last_name);
+        INSERT INTO core_user_fts(rowid, username, first_name, last_name)
+        VALUES (new.id, new.username, new.first_name, new.last_name);
+    END
+    """,
+    "INSERT INTO core_user_fts(core_user_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS core_user_fts_update",
+    "DROP TRIGGER IF EXISTS core_user_fts_delete",
+    "DROP TRIGGER IF EXISTS core_user_fts_insert",
+    "DROP TABLE IF EXISTS core_user_fts",
+]
+
+# PostgreSQL: trigram indexes, which serve both icontains and similarity ranking
+POSTGRESQL_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS core_user_username_trgm ON core_user USING gin (UPPER(username) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS core_user_first_name_trgm ON core_user USING gin (UPPER(first_name) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS core_user_last_name_trgm ON core_user USING gin (UPPER(last_name) gin_trgm_ops)",
+]
+
+POSTGRESQL_BACKWARD = [
+    "DROP INDEX IF EXISTS core_user_last_name_trgm",
+    "DROP INDEX IF EXISTS core_user_first_name_trgm",
+    "DROP INDEX IF EXISTS core_user_username_trgm",
+]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0006_user_follow_counts"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({"sqlite": SQLITE_FORWARD, "postgresql": POSTGRESQL_FORWARD}),
+            run_for_vendor({"sqlite": SQLITE_BACKWARD, "postgresql": POSTGRESQL_BACKWARD}),
+        ),
+    ]
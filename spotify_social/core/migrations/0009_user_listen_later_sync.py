@@ -0,0 +1,40 @@
+# Generated by Django 5.0.2 on 2026-10-18 19:36
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+search_index = import_module("core.migrations.0007_user_search_index")
+
+# Adding a NOT NULL column makes SQLite rebuild core_user, which drops the
+# user search triggers from 0007; put them back (and resync the index) after
+SQLITE_RESTORE_TRIGGERS = [
+    "DROP TRIGGER IF EXISTS core_user_fts_insert",
+    "DROP TRIGGER IF EXISTS core_user_fts_delete",
+    "DROP TRIGGER IF EXISTS core_user_fts_update",
+] + search_index.SQLITE_FORWARD[1:]
+
+restore_triggers = search_index.run_for_vendor({"sqlite": SQLITE_RESTORE_TRIGGERS})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0008_job"),
+    ]
+
+    operations = [
+        # Runs last when migrating backwards, after the columns are removed
+        migrations.RunPython(migrations.RunPython.noop, restore_triggers),
+        migrations.AddField(
+            model_name="user",
+            name="listen_later_snapshot_id",
+            field=models.CharField(blank=True, default="", max_length=255),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="listen_later_synced_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(restore_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2 on 2026-10-18 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0010_workerheartbeat"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="user",
+            name="follower_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name="user",
+            name="following_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 
@@ -7,6 +8,7 @@ class User(AbstractUser):
     spotify_id = models.CharField(max_length=255, blank=True, null=True)
     spotify_access_token = models.CharField(max_length=255, blank=True, null=True)
     spotify_refresh_token = models.CharField(max_length=255, blank=True, null=True)
+    spotify_token_expires_at = models.DateTimeField(blank=True, null=True)
     
     # Top 3 albums picked by user
     top_album1_id = models.CharField(max_length=255, blank=True, null=True)
@@ -35,6 +37,16 @@ class User(AbstractUser):
     top_artist3_image = models.URLField(max_length=500, blank=True, null=True)
     
     listen_later = models.CharField(max_length=255, blank=True, null=True)
+    # Playlist version the spotify.ListenLaterItem mirror matches, and when it was last checked
+    listen_later_snapshot_id = models.CharField(max_length=255, blank=True, default='')
+    listen_later_synced_at = models.DateTimeField(null=True, blank=True)
+    
+    # Maintained by Follow.save()/delete() with F() updates; not editable, so
+    # forms and the admin never write back a stale copy
+    follower_count = models.IntegerField(default=0, editable=False)
+    following_count = models.IntegerField(default=0, editable=False)
+    
+    COUNTER_FIELDS = ('follower_count', 'following_count')
 
     groups = models.ManyToManyField(
         'auth.Group',
@@ -79,15 +91,27 @@ class User(AbstractUser):
 
     def get_follower_count(self):
         """Return the number of followers"""
-        return self.followers.count()
+        return self.follower_count
 
     def get_following_count(self):
         """Return the number of users this user is following"""
-        return self.following.count()
+        return self.following_count
+
+    def get_following_ids(self):
+        """
+        Return the ids of the users this user follows as a set.
+
+        Loaded with one query and memoized on the instance, so it lives for one
+        request. It is not shared across requests: the default cache is per
+        process and a follow in one worker would leave the others stale.
+        """
+        if not hasattr(self, '_following_ids'):
+            self._following_ids = frozenset(self.following.values_list('following_id', flat=True))
+        return self._following_ids
 
     def is_following(self, user):
         """Check if this user is following another user"""
-        return self.following.filter(following=user).exists()
+        return user.pk in self.get_following_ids()
 
     def get_following_users(self):
         """Get all users this user is following"""
@@ -99,3 +123,58 @@ class User(AbstractUser):
 
     def __str__(self):
         return self.username
+
+
+class Job(models.Model):
+    """A unit of background work, run by the run_jobs worker (see core.jobs)"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUSES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    user = models.ForeignKey(User, related_name='jobs', null=True, blank=True, on_delete=models.CASCADE)
+    # Enqueueing again with the same key returns the existing job instead of adding one
+    idempotency_key = models.CharField(max_length=255, unique=True, null=True, blank=True)
+
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+
+    result = models.JSONField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The worker's "next due job" lookup
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in (self.SUCCEEDED, self.FAILED)
+
+
+class WorkerHeartbeat(models.Model):
+    """When a run_jobs worker last checked in, so the app can tell if one is running"""
+    worker_id = models.CharField(max_length=100, unique=True)
+    last_seen = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.worker_id} ({self.last_seen})"
@@ -0,0 +1,91 @@
+"""
+User search.
+
+On SQLite users are looked up in the core_user_fts FTS5 index (see migration
+0007_user_search_index), which the database keeps in sync through triggers
+whenever a user is created, renamed or deleted (a migration that makes SQLite
+rebuild core_user drops the triggers and has to restore them, see 0009).
+Every word of the query is matched as a prefix and results are ranked by
+bm25, with username matches weighted above names. On PostgreSQL the same
+migration adds trigram indexes and results are ranked by similarity. Other
+backends fall back to icontains.
+"""
+
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from .models import User
+
+# Username matches count this much more than first/last name matches
+USERNAME_WEIGHT = 10.0
+
+WORD_RE = re.compile(r'[^\W_]+')
+
+
+def fts_query(query):
+    """Turn free text into an FTS5 query matching every word as a prefix"""
+    return ' '.join(f'"{word}"*' for word in WORD_RE.findall(query.lower()))
+
+
+def _search_sqlite(query, limit, exclude_id):
+    match = fts_query(query)
+    if not match:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT rowid FROM core_user_fts WHERE core_user_fts MATCH %s AND rowid != %s '
+            'ORDER BY bm25(core_user_fts, %s, 1.0, 1.0) LIMIT %s',
+            [match, exclude_id, USERNAME_WEIGHT, limit]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _matching_users(query, exclude_id):
+    return User.objects.filter(
+        Q(username__icontains=query) | Q(first_name__icontains=query) | Q(last_name__icontains=query)
+    ).exclude(id=exclude_id)
+
+
+def _search_postgresql(query, limit, exclude_id):
+    from django.contrib.postgres.search import TrigramWordSimilarity
+
+    users = _matching_users(query, exclude_id).annotate(
+        rank=TrigramWordSimilarity(query, 'username') * USERNAME_WEIGHT
+        + TrigramWordSimilarity(query, 'first_name')
+        + TrigramWordSimilarity(query, 'last_name')
+    ).order_by('-rank', 'username')
+    return list(users.values_list('id', flat=True)[:limit])
+
+
+def _search_fallback(query, limit, exclude_id):
+    users = _matching_users(query, exclude_id).order_by('username')
+    return list(users.values_list('id', flat=True)[:limit])
+
+
+def search_user_ids(query, limit=None, exclude_id=None):
+    """
+    Return the ids of the best matching users for a query, best first.
+
+    ``exclude_id`` is filtered out in the query itself, before the limit, so
+    it doesn't cost the caller a result.
+    """
+    query = query.strip()
+    limit = limit or settings.USER_SEARCH_MAX_RESULTS
+    if not query:
+        return []
+    if connection.vendor == 'sqlite':
+        # rowid != NULL would match nothing
+        return _search_sqlite(query, limit, exclude_id or 0)
+    if connection.vendor == 'postgresql':
+        return _search_postgresql(query, limit, exclude_id)
+    return _search_fallback(query, limit, exclude_id)
+
+
+def search_users(query, exclude=None, limit=None):
+    """Return matching User objects, best first, capped at USER_SEARCH_MAX_RESULTS"""
+    user_ids = search_user_ids(query, limit, exclude.pk if exclude is not None else None)
+    users_by_id = User.objects.in_bulk(user_ids)
+    return [users_by_id[user_id] for user_id in user_ids if user_id in users_by_id]
@@ -1,3 +1,248 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import skipUnless
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import jobs
+from .models import Job, User, WorkerHeartbeat
+from .search import search_users
+
+calls = []
+
+
+@jobs.handler('tests.succeed')
+def succeed(job):
+    calls.append(job.pk)
+    return {'ok': True}
+
+
+@jobs.handler('tests.fail')
+def fail(job):
+    raise RuntimeError("Spotify said no")
+
+
+@jobs.handler('tests.fail_permanently')
+def fail_permanently(job):
+    raise jobs.PermanentJobError("Unknown track")
+
+
+class Throttled(Exception):
+    retry_after = 30
+
+
+@jobs.handler('tests.throttled')
+def throttled(job):
+    raise Throttled("Rate limited")
+
+
+@override_settings(JOBS_RETRY_BASE_DELAY=10, JOBS_RETRY_MAX_DELAY=60, JOBS_MAX_ATTEMPTS=3)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_claim_next_runs_each_job_once(self):
+        job = jobs.enqueue('tests.succeed')
+        claimed = jobs.claim_next('worker-a')
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual((claimed.status, claimed.locked_by, claimed.attempts), (Job.RUNNING, 'worker-a', 1))
+        self.assertIsNone(jobs.claim_next('worker-b'))
+
+    def test_claim_loses_race_for_job_already_claimed(self):
+        job = jobs.enqueue('tests.succeed')
+        # worker-b read the job as queued just before worker-a claimed it
+        seen_by_b = Job.objects.get(pk=job.pk)
+        self.assertTrue(jobs._claim(job, 'worker-a', timezone.now()))
+        self.assertFalse(jobs._claim(seen_by_b, 'worker-b', timezone.now()))
+        self.assertEqual(Job.objects.get(pk=job.pk).locked_by, 'worker-a')
+
+    def test_claim_takes_over_stale_running_job(self):
+        job = jobs.enqueue('tests.succeed')
+        jobs.claim_next('worker-a')
+        with override_settings(JOBS_LOCK_TIMEOUT=60):
+            self.assertIsNone(jobs.claim_next('worker-b'))
+            Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(seconds=61))
+            claimed = jobs.claim_next('worker-b')
+        self.assertEqual((claimed.pk, claimed.locked_by, claimed.attempts), (job.pk, 'worker-b', 2))
+
+    def test_claim_skips_jobs_not_due(self):
+        jobs.enqueue('tests.succeed', delay=60)
+        self.assertIsNone(jobs.claim_next('worker-a'))
+
+    def test_success_stores_result(self):
+        job = jobs.enqueue('tests.succeed')
+        self.assertEqual(jobs.run_pending('worker-a'), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result, job.locked_by), (Job.SUCCEEDED, {'ok': True}, ''))
+        self.assertEqual(calls, [job.pk])
+
+    def test_failure_retries_with_backoff_then_fails(self):
+        job = jobs.enqueue('tests.fail')
+        delays = []
+        for attempt in range(1, 4):
+            Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+            before = timezone.now()
+            jobs.run_pending('worker-a')
+            job.refresh_from_db()
+            self.assertEqual(job.attempts, attempt)
+            self.assertIn('Spotify said no', job.last_error)
+            delays.append((job.run_at - before).total_seconds())
+
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIsNotNone(job.finished_at)
+        # 10s then 20s, each with up to 20% jitter
+        self.assertTrue(8 <= delays[0] <= 12.5, delays)
+        self.assertTrue(16 <= delays[1] <= 24.5, delays)
+
+    def test_retry_delay_is_capped(self):
+        self.assertLessEqual(jobs.retry_delay(20), 60 * 1.2)
+
+    def test_permanent_error_is_not_retried(self):
+        job = jobs.enqueue('tests.fail_permanently')
+        jobs.run_pending('worker-a')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 1))
+
+    def test_throttled_job_is_rescheduled_without_using_an_attempt(self):
+        job = jobs.enqueue('tests.throttled')
+        before = timezone.now()
+        jobs.run_pending('worker-a')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 0))
+        self.assertGreaterEqual(job.run_at, before + timedelta(seconds=30))
+
+    def test_unknown_handler_fails(self):
+        job = jobs.enqueue('tests.nobody_handles_this')
+        jobs.run_pending('worker-a')
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+
+    def test_idempotency_key_returns_unfinished_job(self):
+        first = jobs.enqueue('tests.succeed', {'n': 1}, idempotency_key='k')
+        again = jobs.enqueue('tests.succeed', {'n': 2}, idempotency_key='k')
+        self.assertEqual(again.pk, first.pk)
+        self.assertEqual(Job.objects.get(pk=first.pk).payload, {'n': 1})
+
+        jobs.claim_next('worker-a')
+        self.assertEqual(jobs.enqueue('tests.succeed', idempotency_key='k').pk, first.pk)
+        self.assertEqual(Job.objects.get(pk=first.pk).status, Job.RUNNING)
+
+    def test_idempotency_key_requeues_finished_job(self):
+        first = jobs.enqueue('tests.succeed', {'n': 1}, idempotency_key='k')
+        jobs.run_pending('worker-a')
+        again = jobs.enqueue('tests.succeed', {'n': 2}, idempotency_key='k')
+        self.assertEqual(again.pk, first.pk)
+        again.refresh_from_db()
+        self.assertEqual((again.status, again.attempts, again.result, again.payload), (Job.QUEUED, 0, None, {'n': 2}))
+        self.assertEqual(Job.objects.count(), 1)
+
+
+class InlineFallbackTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_runs_inline_without_worker(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            job = jobs.enqueue('tests.succeed')
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertTrue(job.locked_by == '' and calls == [job.pk])
+
+    def test_queues_while_worker_is_alive(self):
+        jobs.record_heartbeat('worker-a', force=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            job = jobs.enqueue('tests.succeed')
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertEqual(calls, [])
+
+    @override_settings(JOBS_WORKER_TIMEOUT=60)
+    def test_runs_inline_when_worker_went_quiet(self):
+        WorkerHeartbeat.objects.create(worker_id='worker-a', last_seen=timezone.now() - timedelta(seconds=61))
+        self.assertFalse(jobs.worker_alive())
+        with self.captureOnCommitCallbacks(execute=True):
+            job = jobs.enqueue('tests.succeed')
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+
+    @override_settings(JOBS_INLINE_FALLBACK=False)
+    def test_fallback_can_be_turned_off(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            job = jobs.enqueue('tests.succeed')
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+
+    def test_status_poll_runs_due_retry(self):
+        user = User.objects.create_user(username='poller', password='p')
+        self.client.login(username='poller', password='p')
+        job = jobs.enqueue('tests.succeed', user=user, delay=60)
+
+        response = self.client.get(reverse('job_status', args=[job.pk])).json()
+        self.assertEqual(response['job']['status'], Job.QUEUED)
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        response = self.client.get(reverse('job_status', args=[job.pk])).json()
+        self.assertEqual(response['job']['status'], Job.SUCCEEDED)
+
+    def test_stopping_worker_removes_its_heartbeat(self):
+        jobs.record_heartbeat('worker-a', force=True)
+        WorkerHeartbeat.objects.create(worker_id='long-gone', last_seen=timezone.now() - timedelta(days=2))
+        jobs.forget_heartbeat('worker-a')
+        self.assertFalse(WorkerHeartbeat.objects.exists())
+
+
+class ListenLaterPageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='listener', spotify_access_token='token', listen_later='playlist')
+        self.client.force_login(self.user)
+        # Keep the sync job queued rather than run inline against Spotify
+        jobs.record_heartbeat('worker-a', force=True)
+
+    def test_first_sync_is_polled(self):
+        response = self.client.get(reverse('listen_later'))
+        job = Job.objects.get(name='spotify.reconcile_listen_later', user=self.user)
+        self.assertTrue(response.context['syncing'])
+        self.assertEqual(response.context['sync_status_url'], reverse('job_status', args=[job.pk]))
+        self.assertContains(response, f'data-job-status-url="{reverse("job_status", args=[job.pk])}"')
+
+    def test_no_polling_once_synced(self):
+        User.objects.filter(pk=self.user.pk).update(listen_later_synced_at=timezone.now())
+        response = self.client.get(reverse('listen_later'))
+        self.assertFalse(Job.objects.exists())
+        self.assertIsNone(response.context['sync_status_url'])
+        self.assertNotContains(response, 'data-job-status-url')
+
+
+@skipUnless(connection.vendor == 'sqlite', 'The FTS5 index only exists on SQLite')
+class UserSearchIndexTests(TestCase):
+    def test_triggers_survive_migrations(self):
+        # A later migration that rebuilds core_user silently drops them
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'core_user_fts_%'")
+            triggers = {row[0] for row in cursor.fetchall()}
+        self.assertEqual(triggers, {'core_user_fts_insert', 'core_user_fts_update', 'core_user_fts_delete'})
+
+    def test_renamed_user_is_found_by_new_name(self):
+        user = User.objects.create_user(username='nightowl', first_name='Ada')
+        self.assertEqual(search_users('night'), [user])
+
+        user.username = 'earlybird'
+        user.save(update_fields=['username'])
+        self.assertEqual(search_users('early'), [user])
+        self.assertEqual(search_users('night'), [])
+        self.assertEqual(search_users('ada'), [user])
+
+        user.delete()
+        self.assertEqual(search_users('early'), [])
+
+
+class UserSearchTests(TestCase):
+    def test_excluded_user_does_not_use_up_the_limit(self):
+        searcher = User.objects.create_user(username='jazzfan')
+        other = User.objects.create_user(username='jazzcat')
+        # The searcher is the best match, so excluding after the LIMIT left nothing
+        self.assertEqual(search_users('jazzfan', limit=1), [searcher])
+        self.assertEqual(search_users('jazz', exclude=searcher, limit=1), [other])
+        self.assertEqual(search_users('jazzfan', exclude=searcher), [])
@@ -1,14 +1,18 @@
-from django.shortcuts import render, redirect
+from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login
 from django.contrib import messages
 from django.contrib.auth.forms import UserCreationForm
-from .models import User
+from . import jobs
+from .models import Job, User
 from .forms import UsernameEditForm
 from social.models import Post
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
+from social.pagination import paginate_for_page
+from spotify import listen_later as spotify_listen_later
+from spotify import profile as spotify_profile
+from spotify.tokens import SpotifyTokenError
 from django.http import JsonResponse
+from django.urls import reverse
 from django.conf import settings
 import logging
 
@@ -20,7 +24,6 @@ def home(request):
 @login_required
 def profile(request):
     spotify_data = None
-    currently_playing = None
     top_artists = None
     top_tracks = None
     
@@ -29,58 +32,35 @@ def profile(request):
     
     if request.user.spotify_access_token:
         try:
-            # Create SpotifyOAuth instance for token refresh
-            sp_oauth = SpotifyOAuth(
-                client_id=settings.SPOTIFY_CLIENT_ID,
-                client_secret=settings.SPOTIFY_CLIENT_SECRET,
-                redirect_uri=settings.SPOTIFY_REDIRECT_URI,
-                scope=settings.SPOTIFY_SCOPES
-            )
-            
-            # Try to refresh the token
-            if request.user.spotify_refresh_token:
-                try:
-                    token_info = sp_oauth.refresh_access_token(request.user.spotify_refresh_token)
-                    if token_info:
-                        request.user.spotify_access_token = token_info['access_token']
-                        request.user.save()
-                        logger.info(f"Refreshed access token for user {request.user.username}")
-                except Exception as refresh_error:
-                    logger.error(f"Token refresh failed: {str(refresh_error)}")
-                    messages.error(request, 'Your Spotify session has expired. Please reconnect your account.')
-                    
-            sp = spotipy.Spotify(auth=request.user.spotify_access_token)
-            spotify_data = sp.current_user()
-            
-            # Get currently playing track
-            current = sp.currently_playing()
-            if current and current['is_playing']:
-                currently_playing = current['item']
-            
-            # Get top artists for the selected time range
-            top_artists = sp.current_user_top_artists(limit=3, time_range=time_range)
-            
-            # Get top tracks for the selected time range
-            top_tracks = sp.current_user_top_tracks(limit=3, time_range=time_range)
-            
+            # Last known account and top items for the selected time range,
+            # refreshed in the background once they get old; anything not
+            # cached yet is fetched from Spotify concurrently
+            data = spotify_profile.get_profile_data(request.user, time_range)
+            spotify_data = data['current_user']
+            top_artists = data['top_artists']
+            top_tracks = data['top_tracks']
+        except SpotifyTokenError as refresh_error:
+            logger.error(f"Token refresh failed: {str(refresh_error)}")
+            messages.error(request, 'Your Spotify session has expired. Please reconnect your account.')
         except Exception as e:
             logger.error(f"Error fetching Spotify data: {str(e)}")
             messages.error(request, 'Error fetching Spotify data. Please reconnect your Spotify account.')
     
-    # Get user's posts
-    posts = Post.objects.filter(user=request.user).order_by('-created_at')
-    
-    # Add liked status for each post
-    for post in posts:
-        post.user_has_liked = post.is_liked_by(request.user)
+    # Get user's posts, with like/comment counts and liked status in the same query
+    posts, next_cursor = paginate_for_page(
+        request,
+        Post.objects.for_profile(request.user, request.user).with_activity(request.user)
+    )
     
     return render(request, 'core/profile.html', {
         'spotify_data': spotify_data,
-        'currently_playing': currently_playing,
+        # Polled from the page, so rendering never waits on it
+        'currently_playing_poll_interval': settings.SPOTIFY_CURRENTLY_PLAYING_POLL_INTERVAL,
         'top_artists': top_artists,
         'top_tracks': top_tracks,
         'time_range': time_range,
-        'posts': posts
+        'posts': posts,
+        'next_cursor': next_cursor
     })
 
 @login_required
@@ -88,7 +68,7 @@ def edit_username(request):
     if request.method == 'POST':
         form = UsernameEditForm(request.POST, instance=request.user)
         if form.is_valid():
-            form.save()
+            form.save(commit=False).save(update_fields=['username'])
             messages.success(request, 'Your username has been updated successfully!')
             return redirect('profile')
     else:
@@ -125,7 +105,7 @@ def update_top_album(request):
         else:
             return JsonResponse({'error': 'Invalid position'}, status=400)
             
-        user.save()
+        user.save(update_fields=[f'top_album{position}_id', f'top_album{position}_name', f'top_album{position}_image'])
         return JsonResponse({'success': True})
         
     return JsonResponse({'error': 'Invalid request method'}, status=400)
@@ -158,7 +138,7 @@ def update_top_artist(request):
         else:
             return JsonResponse({'error': 'Invalid position'}, status=400)
             
-        user.save()
+        user.save(update_fields=[f'top_artist{position}_id', f'top_artist{position}_name', f'top_artist{position}_image'])
         return JsonResponse({'success': True})
         
     return JsonResponse({'error': 'Invalid request method'}, status=400)
@@ -170,18 +150,39 @@ def listen_later(request):
         messages.error(request, 'Please connect your Spotify account first.')
         return redirect('profile')
     
-    try:
-        sp = spotipy.Spotify(auth=request.user.spotify_access_token)
-        
-        # Get the playlist tracks
-        playlist = sp.playlist(request.user.listen_later)
-        tracks = playlist['tracks']['items']
-        
+    if not request.user.listen_later:
+        # Created in the background after signing up with Spotify
         return render(request, 'core/listen_later.html', {
-            'tracks': tracks
-        })
-    except Exception as e:
-        messages.error(request, 'Error fetching playlist data. Please try again.')
-        return render(request, 'core/listen_later.html', {
-            'error': str(e)
+            'error': 'Your Listen Later playlist is still being set up. Please check back shortly.'
         })
+    
+    # Rendered from the local mirror; changes made in the Spotify apps are
+    # picked up in the background
+    sync_job = None
+    if spotify_listen_later.is_stale(request.user):
+        sync_job = jobs.enqueue(
+            'spotify.reconcile_listen_later',
+            user=request.user,
+            idempotency_key=f'listen-later-reconcile:{request.user.pk}'
+        )
+    
+    # First page only, the rest is loaded from spotify:listen_later_items
+    items, next_cursor = spotify_listen_later.get_page(request.user)
+    return render(request, 'core/listen_later.html', {
+        'items': items,
+        'next_cursor': next_cursor,
+        'syncing': request.user.listen_later_synced_at is None,
+        # Polled by the page while the first sync is running
+        'sync_status_url': reverse('job_status', args=[sync_job.id]) if sync_job else None
+    })
+
+@login_required
+def job_status(request, job_id):
+    """Report the status of one of the user's background jobs"""
+    job = get_object_or_404(Job, id=job_id, user=request.user)
+    # Without a worker, a retry that is due runs when the client polls
+    job = jobs.run_inline_if_no_worker(job.pk)
+    return JsonResponse({
+        'success': True,
+        'job': jobs.serialize_job(job)
+    })
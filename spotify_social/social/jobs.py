@@ -0,0 +1,15 @@
+"""Background jobs for the social app (see core.jobs)"""
+
+from core.jobs import handler
+from core.models import User
+from . import timeline
+
+
+@handler('social.backfill_followers')
+def backfill_followers(job):
+    """Copy an author's recent posts into their followers' timelines"""
+    author = User.objects.filter(pk=job.payload['author_id']).first()
+    # Over the threshold again by now: their posts are merged at read time
+    if author is None or not timeline.is_fanned_out(author):
+        return {'entries': 0}
+    return {'entries': timeline.backfill_followers(author)}
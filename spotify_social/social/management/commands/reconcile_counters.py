@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from core.models import User
+from social.models import Comment, Follow, Like, Post, count_subquery
+
+# (model, counter field, related model, field on related model pointing back)
+COUNTERS = [
+    (Post, 'like_count', Like, 'post'),
+    (Post, 'comment_count', Comment, 'post'),
+    (User, 'follower_count', Follow, 'following'),
+    (User, 'following_count', Follow, 'follower'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Recompute denormalized like, comment and follow counters and report drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only report drift, do not fix it'
+        )
+
+    def handle(self, *args, **options):
+        for model, counter, related_model, field in COUNTERS:
+            label = f'{model.__name__}.{counter}'
+            drifted = model.objects.annotate(
+                actual=count_subquery(related_model, field)
+            ).filter(~Q(**{counter: F('actual')}))
+            drift_count = drifted.count()
+
+            if not drift_count:
+                self.stdout.write(self.style.SUCCESS(f'{label}: no drift'))
+                continue
+
+            self.stdout.write(self.style.WARNING(f'{label}: {drift_count} rows drifted'))
+            if options['verify']:
+                continue
+
+            updated = model.objects.filter(
+                pk__in=drifted.values('pk')
+            ).update(**{counter: count_subquery(related_model, field)})
+            self.stdout.write(self.style.SUCCESS(f'{label}: fixed {updated} rows'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from core.models import User
+from social import suggestions
+
+
+class Command(BaseCommand):
+    help = 'Recompute and store "who to follow" suggestions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            action='append',
+            dest='usernames',
+            help='Only refresh this user (can be repeated)'
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(spotify_access_token__isnull=False)
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+
+        refreshed = 0
+        for user in users.iterator():
+            suggestions.refresh_suggestions(user)
+            refreshed += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Refreshed suggestions for {refreshed} users.'))
@@ -0,0 +1,45 @@
+# Generated by Django 5.0.2 on 2026-10-18 19:13
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_timelines(apps, schema_editor):
+    Follow = apps.get_model("social", "Follow")
+    Post = apps.get_model("social", "Post")
+    TimelineEntry = apps.get_model("social", "TimelineEntry")
+    for follow in Follow.objects.all().iterator():
+        posts = Post.objects.filter(user_id=follow.following_id, is_private=False).order_by("-created_at").values_list(
+            "id", "created_at"
+        )[:settings.SOCIAL_TIMELINE_BACKFILL]
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(owner_id=follow.follower_id, post_id=post_id, created_at=created_at) for post_id, created_at in posts],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social", "0006_comment_like"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TimelineEntry",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("owner", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="timeline_entries", to=settings.AUTH_USER_MODEL)),
+                ("post", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="timeline_entries", to="social.post")),
+            ],
+            options={
+                "ordering": ["-created_at"],
+                "unique_together": {("owner", "post")},
+            },
+        ),
+        migrations.RunPython(backfill_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.0.2 on 2026-10-18 19:14
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_subquery(model, field):
+    counts = model.objects.filter(**{field: OuterRef("pk")}).order_by().values(field).annotate(
+        total=Count("*")
+    ).values("total")
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def populate_counts(apps, schema_editor):
+    Post = apps.get_model("social", "Post")
+    Like = apps.get_model("social", "Like")
+    Comment = apps.get_model("social", "Comment")
+    Follow = apps.get_model("social", "Follow")
+    User = apps.get_model("core", "User")
+    Post.objects.update(like_count=count_subquery(Like, "post"), comment_count=count_subquery(Comment, "post"))
+    User.objects.update(
+        follower_count=count_subquery(Follow, "following"),
+        following_count=count_subquery(Follow, "follower"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social", "0007_timelineentry"),
+        ("core", "0006_user_follow_counts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="comment_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="like_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.2 on 2026-10-18 19:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social", "0008_post_counts"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(fields=["post", "created_at"], name="comment_post_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(fields=["user", "-created_at", "-id"], name="post_user_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(condition=models.Q(("is_private", False)), fields=["user", "-created_at", "-id"], name="post_public_user_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(fields=["user", "spotify_id", "post_type", "created_at"], name="post_user_item_created_idx"),
+        ),
+    ]
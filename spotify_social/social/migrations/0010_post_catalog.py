@@ -0,0 +1,89 @@
+# Generated by Django 5.0.2 on 2026-10-18 19:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F
+
+
+def link_posts_to_catalog(apps, schema_editor):
+    Post = apps.get_model("social", "Post")
+    Track = apps.get_model("spotify", "Track")
+    Album = apps.get_model("spotify", "Album")
+
+    for model, posts, fk in (
+        (Track, Post.objects.exclude(post_type="album"), "track_id"),
+        (Album, Post.objects.filter(post_type="album"), "album_id"),
+    ):
+        fields = ["name", "artist_name", "image_url", "spotify_url"]
+        if model is Track:
+            fields.append("preview_url")
+
+        # When several posts describe the same item, each field takes the
+        # newest non-blank value: the post columns are dropped below, so
+        # artwork or a link only an older post had would be lost otherwise
+        items = {}
+        for post in posts.order_by("-created_at").iterator():
+            values = {
+                "name": post.spotify_name,
+                "artist_name": post.spotify_artist,
+                "image_url": post.spotify_image_url,
+                "spotify_url": post.spotify_url,
+                "preview_url": post.spotify_preview_url or None,
+            }
+            item = items.setdefault(post.spotify_id, {field: None if field == "preview_url" else "" for field in fields})
+            for field in fields:
+                if values[field] and not item[field]:
+                    item[field] = values[field]
+
+        # Rated tracks are already in the catalog, but without artwork or links
+        existing = model.objects.in_bulk(list(items))
+        for item_id, item in existing.items():
+            for field, value in items.pop(item_id).items():
+                if value and not getattr(item, field):
+                    setattr(item, field, value)
+        model.objects.bulk_update(existing.values(), fields, batch_size=1000)
+        model.objects.bulk_create([model(id=item_id, **values) for item_id, values in items.items()], batch_size=1000)
+
+        posts.update(**{fk: F("spotify_id")})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social", "0009_hot_query_indexes"),
+        ("spotify", "0005_catalog"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="album",
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name="posts", to="spotify.album"),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="track",
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name="posts", to="spotify.track"),
+        ),
+        migrations.RunPython(link_posts_to_catalog, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="post",
+            name="spotify_artist",
+        ),
+        migrations.RemoveField(
+            model_name="post",
+            name="spotify_image_url",
+        ),
+        migrations.RemoveField(
+            model_name="post",
+            name="spotify_name",
+        ),
+        migrations.RemoveField(
+            model_name="post",
+            name="spotify_preview_url",
+        ),
+        migrations.RemoveField(
+            model_name="post",
+            name="spotify_url",
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.0.2 on 2026-10-18 19:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_threads(apps, schema_editor):
+    Comment = apps.get_model("social", "Comment")
+    # Replies to top-level comments first, then one level deeper per pass
+    Comment.objects.filter(parent__isnull=False, parent__parent__isnull=True).update(root_id=F("parent_id"))
+    while True:
+        pending = Comment.objects.filter(parent__isnull=False, root__isnull=True, parent__root__isnull=False)
+        updated = pending.update(
+            root_id=Subquery(Comment.objects.filter(pk=OuterRef("parent_id")).values("root_id")[:1])
+        )
+        if not updated:
+            break
+
+    counts = (
+        Comment.objects.filter(root_id=OuterRef("pk")).order_by().values("root_id").annotate(total=Count("*")).values("total")
+    )
+    Comment.objects.filter(root__isnull=True).update(reply_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social", "0010_post_catalog"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="comment",
+            name="comment_post_created_idx",
+        ),
+        migrations.AddField(
+            model_name="comment",
+            name="reply_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="comment",
+            name="root",
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name="thread_replies", to="social.comment"),
+        ),
+        migrations.RunPython(populate_threads, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(fields=["post", "root", "created_at", "id"], name="comment_post_root_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(fields=["root", "created_at", "id"], name="comment_root_created_idx"),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.2 on 2026-10-18 19:57
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social", "0011_comment_threads"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="timelineentry",
+            index=models.Index(fields=["owner", "-created_at", "-post"], name="timeline_owner_created_idx"),
+        ),
+    ]
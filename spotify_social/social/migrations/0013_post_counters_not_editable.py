@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2 on 2026-10-18 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social", "0012_timeline_owner_created_idx"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="post",
+            name="comment_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name="post",
+            name="like_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
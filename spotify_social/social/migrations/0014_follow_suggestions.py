@@ -0,0 +1,25 @@
+# Generated by Django 5.0.2 on 2026-10-18 20:10
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0011_counters_not_editable"),
+        ("social", "0013_post_counters_not_editable"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FollowSuggestions",
+            fields=[
+                ("user", models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name="follow_suggestions", serialize=False, to=settings.AUTH_USER_MODEL)),
+                ("entries", models.JSONField(default=list)),
+                ("computed_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -1,7 +1,51 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
 from core.models import User
+from django.db.models import Count, Exists, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
+
+def count_subquery(model, field):
+    """Correlated COUNT(*) of model rows whose field points at the outer row"""
+    counts = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(
+        total=Count('*')
+    ).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def refresh_counters(instance, field_name):
+    """
+    Reload the counters of a related object the instance has loaded, after
+    an F() update changed them in the database, so saving that object later
+    doesn't write the old values back.
+    """
+    field = instance._meta.get_field(field_name)
+    if field.is_cached(instance):
+        related = getattr(instance, field_name)
+        related.refresh_from_db(fields=related.COUNTER_FIELDS)
+
+
+class PostQuerySet(models.QuerySet):
+    def for_profile(self, profile_user, viewer):
+        """Posts on a profile page: everything for the owner, public posts for everyone else"""
+        if profile_user == viewer:
+            return self.filter(user=profile_user)
+        return self.filter(user=profile_user, is_private=False)
+
+    def with_activity(self, user):
+        """
+        Annotate posts with user_has_liked and join their author, so rendering
+        a list of posts needs no per-post queries (counts are stored on Post).
+        """
+        queryset = self.select_related('user', 'track', 'album')
+        if user.is_authenticated:
+            return queryset.annotate(
+                user_has_liked=Exists(Like.objects.filter(post=OuterRef('pk'), user=user))
+            )
+        return queryset.annotate(user_has_liked=Value(False))
+
+
 class Post(models.Model):
     POST_TYPES = [
         ('track', 'Track'),
@@ -13,22 +57,66 @@ class Post(models.Model):
     post_type = models.CharField(max_length=10, choices=POST_TYPES)
     content = models.TextField(blank=True)
     spotify_id = models.CharField(max_length=100)
-    spotify_name = models.CharField(max_length=255)
-    spotify_artist = models.CharField(max_length=255)
-    spotify_image_url = models.URLField(blank=True)
-    spotify_preview_url = models.URLField(blank=True, null=True)
-    spotify_url = models.URLField()
+    # Names, artwork and links live in the local catalog: album posts point
+    # at an Album, track and rating posts at a Track
+    track = models.ForeignKey('spotify.Track', related_name='posts', null=True, blank=True, on_delete=models.PROTECT)
+    album = models.ForeignKey('spotify.Album', related_name='posts', null=True, blank=True, on_delete=models.PROTECT)
     rating = models.DecimalField(max_digits=3, decimal_places=1, null=True, blank=True)
     is_private = models.BooleanField(default=False)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Maintained by Like and Comment save()/delete() with F() updates
+    like_count = models.IntegerField(default=0, editable=False)
+    comment_count = models.IntegerField(default=0, editable=False)
+    
+    COUNTER_FIELDS = ('like_count', 'comment_count')
+    
+    objects = PostQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Profile post lists, newest first, paged by (created_at, id): all
+            # of a user's posts for the owner, public ones for everyone else
+            models.Index(fields=['user', '-created_at', '-id'], name='post_user_created_idx'),
+            models.Index(
+                fields=['user', '-created_at', '-id'],
+                condition=models.Q(is_private=False),
+                name='post_public_user_created_idx'
+            ),
+            # Duplicate check in create_post
+            models.Index(fields=['user', 'spotify_id', 'post_type', 'created_at'], name='post_user_item_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.spotify_name}"
     
+    @property
+    def item(self):
+        """The catalog Track or Album this post is about"""
+        return self.album if self.post_type == 'album' else self.track
+    
+    @property
+    def spotify_name(self):
+        return self.item.name if self.item else ''
+    
+    @property
+    def spotify_artist(self):
+        return self.item.artist_name if self.item else ''
+    
+    @property
+    def spotify_image_url(self):
+        return self.item.image_url if self.item else ''
+    
+    @property
+    def spotify_preview_url(self):
+        return self.track.preview_url if self.post_type != 'album' and self.track else None
+    
+    @property
+    def spotify_url(self):
+        return self.item.spotify_url if self.item else ''
+    
     def get_spotify_uri(self):
         """Get the Spotify URI for the track/album"""
         if self.post_type == 'track':
@@ -39,14 +127,17 @@ class Post(models.Model):
     
     def get_like_count(self):
         """Get the number of likes for this post"""
-        return self.likes.count()
+        return self.like_count
     
     def get_comment_count(self):
         """Get the number of comments for this post"""
-        return self.comments.count()
+        return self.comment_count
     
     def is_liked_by(self, user):
         """Check if a user has liked this post"""
+        if hasattr(self, 'user_has_liked'):
+            # Annotated by PostQuerySet.with_activity() for the viewing user
+            return self.user_has_liked
         if user.is_authenticated:
             return self.likes.filter(user=user).exists()
         return False
@@ -64,6 +155,21 @@ class Like(models.Model):
     
     def __str__(self):
         return f"{self.user.username} likes {self.post.spotify_name}"
+    
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                Post.objects.filter(pk=self.post_id).update(like_count=F('like_count') + 1)
+                refresh_counters(self, 'post')
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            Post.objects.filter(pk=self.post_id).update(like_count=F('like_count') - 1)
+            refresh_counters(self, 'post')
+        return result
 
 
 class Comment(models.Model):
@@ -72,18 +178,54 @@ class Comment(models.Model):
     post = models.ForeignKey(Post, related_name='comments', on_delete=models.CASCADE)
     content = models.TextField()
     parent = models.ForeignKey('self', null=True, blank=True, related_name='replies', on_delete=models.CASCADE)
+    # Top-level comment of the thread (null for top-level comments), so a
+    # thread's replies at any depth are one range scan on (root, created_at)
+    root = models.ForeignKey(
+        'self', null=True, blank=True, related_name='thread_replies', on_delete=models.CASCADE, db_index=False
+    )
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Replies in the thread, kept on top-level comments by save()/delete()
+    reply_count = models.IntegerField(default=0)
+    
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # Top-level comments of a post, oldest first, paged by (created_at, id)
+            models.Index(fields=['post', 'root', 'created_at', 'id'], name='comment_post_root_created_idx'),
+            # Replies in a thread, oldest first, paged by (created_at, id)
+            models.Index(fields=['root', 'created_at', 'id'], name='comment_root_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username}: {self.content[:50]}..."
     
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        if adding and self.parent_id:
+            self.root_id = self.parent.root_id or self.parent_id
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                Post.objects.filter(pk=self.post_id).update(comment_count=F('comment_count') + 1)
+                refresh_counters(self, 'post')
+                if self.root_id:
+                    Comment.objects.filter(pk=self.root_id).update(reply_count=F('reply_count') + 1)
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            # Replies are deleted along with the comment, so recount
+            Post.objects.filter(pk=self.post_id).update(comment_count=count_subquery(Comment, 'post'))
+            refresh_counters(self, 'post')
+            if self.root_id:
+                Comment.objects.filter(pk=self.root_id).update(reply_count=count_subquery(Comment, 'root'))
+        return result
+    
     def get_reply_count(self):
-        """Get the number of replies to this comment"""
-        return self.replies.count()
+        """Get the number of replies in this comment's thread"""
+        return self.reply_count
     
     def is_reply(self):
         """Check if this comment is a reply to another comment"""
@@ -102,3 +244,64 @@ class Follow(models.Model):
     
     def __str__(self):
         return f"{self.follower.username} follows {self.following.username}"
+    
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                User.objects.filter(pk=self.follower_id).update(following_count=F('following_count') + 1)
+                User.objects.filter(pk=self.following_id).update(follower_count=F('follower_count') + 1)
+                refresh_counters(self, 'follower')
+                refresh_counters(self, 'following')
+                self._invalidate_follow_set()
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            User.objects.filter(pk=self.follower_id).update(following_count=F('following_count') - 1)
+            User.objects.filter(pk=self.following_id).update(follower_count=F('follower_count') - 1)
+            refresh_counters(self, 'follower')
+            refresh_counters(self, 'following')
+            self._invalidate_follow_set()
+            
+            # Counts change one at a time, so exactly one unfollow lands on the threshold
+            follower_count = User.objects.filter(pk=self.following_id).values_list('follower_count', flat=True).first()
+            if follower_count == settings.SOCIAL_FANOUT_MAX_FOLLOWERS:
+                from .timeline import schedule_follower_backfill
+                schedule_follower_backfill(self.following_id)
+        return result
+    
+    def _invalidate_follow_set(self):
+        # The follower instance may have memoized its follow set earlier in the request
+        if Follow.follower.is_cached(self):
+            self.follower.__dict__.pop('_following_ids', None)
+
+
+class TimelineEntry(models.Model):
+    """A public post fanned out into a follower's home timeline"""
+    owner = models.ForeignKey(User, related_name='timeline_entries', on_delete=models.CASCADE)
+    post = models.ForeignKey(Post, related_name='timeline_entries', on_delete=models.CASCADE)
+    # Copied from the post, so a feed page is a range scan of the owner's entries
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        unique_together = ('owner', 'post')
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['owner', '-created_at', '-post'], name='timeline_owner_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.post} in {self.owner.username}'s timeline"
+
+
+class FollowSuggestions(models.Model):
+    """A user's ranked "who to follow" list, stored by social.suggestions"""
+    user = models.OneToOneField(User, related_name='follow_suggestions', on_delete=models.CASCADE, primary_key=True)
+    # [{id, score, mutuals, artists, albums, ratings}, ...], best first
+    entries = models.JSONField(default=list)
+    computed_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"Suggestions for {self.user.username} ({len(self.entries)})"
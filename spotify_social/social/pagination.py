@@ -0,0 +1,99 @@
+"""
+Keyset pagination for post and comment lists.
+
+Posts are ordered newest first and comments oldest first, both by
+(created_at, id). Pages are addressed by an opaque cursor naming the last
+row of the previous page, so fetching page N costs the same indexed range
+scan as fetching page 1.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor can't be decoded"""
+
+
+def encode_cursor(obj):
+    """Encode the position just after a post or comment as an opaque cursor string"""
+    payload = json.dumps([obj.created_at.isoformat(), obj.id])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor into a (created_at, id) pair"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        # Strict urlsafe base64; bad base64, non-UTF-8 bytes and bad JSON are all ValueErrors
+        created_at, obj_id = json.loads(base64.b64decode(padded.encode('ascii'), altchars=b'-_', validate=True))
+        created_at, obj_id = datetime.fromisoformat(created_at), int(obj_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+    # encode_cursor always writes an aware timestamp and a real row id
+    if created_at.tzinfo is None or obj_id < 1:
+        raise InvalidCursor(f"Invalid cursor: {cursor}")
+    return created_at, obj_id
+
+
+def get_page_size(request, default=None):
+    """Page size from the request, bounded by the configured maximum"""
+    default = default or settings.SOCIAL_POSTS_PAGE_SIZE
+    try:
+        page_size = int(request.GET.get('page_size', default))
+    except ValueError:
+        page_size = default
+    return max(1, min(page_size, settings.SOCIAL_POSTS_MAX_PAGE_SIZE))
+
+
+def paginate_posts(queryset, cursor=None, page_size=None):
+    """
+    Return (posts, next_cursor) for the page after the cursor.
+
+    next_cursor is None on the last page.
+    """
+    page_size = page_size or settings.SOCIAL_POSTS_PAGE_SIZE
+    queryset = queryset.order_by('-created_at', '-id')
+
+    if cursor:
+        created_at, post_id = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=post_id)
+        )
+
+    # Fetch one extra row to find out if there is another page
+    posts = list(queryset[:page_size + 1])
+    next_cursor = encode_cursor(posts[page_size - 1]) if len(posts) > page_size else None
+    return posts[:page_size], next_cursor
+
+
+def paginate_comments(queryset, cursor=None, page_size=None):
+    """
+    Return (comments, next_cursor) for the page after the cursor, oldest first.
+
+    next_cursor is None on the last page.
+    """
+    page_size = page_size or settings.SOCIAL_COMMENTS_PAGE_SIZE
+    queryset = queryset.order_by('created_at', 'id')
+
+    if cursor:
+        created_at, comment_id = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=comment_id)
+        )
+
+    comments = list(queryset[:page_size + 1])
+    next_cursor = encode_cursor(comments[page_size - 1]) if len(comments) > page_size else None
+    return comments[:page_size], next_cursor
+
+
+def paginate_for_page(request, queryset):
+    """Paginate posts for an HTML page from ?cursor=, starting over if the cursor is bad"""
+    try:
+        return paginate_posts(queryset, request.GET.get('cursor'), get_page_size(request))
+    except InvalidCursor:
+        return paginate_posts(queryset, None, get_page_size(request))
@@ -0,0 +1,159 @@
+"""
+"Who to follow" suggestions.
+
+Candidates are ranked by how many of the people you follow already follow
+them, plus taste overlap: shared top artists and albums and tracks you have
+both rated. Each signal is one grouped query (or one query and a set
+intersection), so computing a user's list costs a handful of queries no
+matter how large the graph is. Results are stored per user in the database
+(FollowSuggestions), so every web process and the refresh_suggestions
+command share them; follows made since are filtered out on read.
+"""
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from core.models import User
+from spotify.models import TrackRating
+from .models import Follow, FollowSuggestions
+
+logger = logging.getLogger(__name__)
+
+# How much each signal counts towards a candidate's score
+MUTUAL_WEIGHT = 3
+ARTIST_WEIGHT = 2
+ALBUM_WEIGHT = 1
+RATING_WEIGHT = 1
+
+TOP_SLOTS = range(1, 4)
+
+
+def _top_ids(user, kind):
+    ids = {getattr(user, f'top_{kind}{i}_id') for i in TOP_SLOTS}
+    ids.discard(None)
+    ids.discard('')
+    return ids
+
+
+def _mutual_counts(user, excluded_ids):
+    """Number of people the user follows who follow each candidate"""
+    rows = Follow.objects.filter(
+        follower_id__in=user.get_following_ids()
+    ).exclude(
+        following_id__in=excluded_ids
+    ).values('following_id').annotate(mutuals=Count('id'))
+    return {row['following_id']: row['mutuals'] for row in rows}
+
+
+def _taste_overlap(user, excluded_ids):
+    """Shared top artists and albums per candidate"""
+    artist_ids = _top_ids(user, 'artist')
+    album_ids = _top_ids(user, 'album')
+    if not artist_ids and not album_ids:
+        return {}
+
+    match = Q()
+    for i in TOP_SLOTS:
+        match |= Q(**{f'top_artist{i}_id__in': artist_ids}) | Q(**{f'top_album{i}_id__in': album_ids})
+
+    fields = [f'top_{kind}{i}_id' for kind in ('artist', 'album') for i in TOP_SLOTS]
+    overlap = {}
+    for row in User.objects.filter(match).exclude(id__in=excluded_ids).values('id', *fields):
+        artists = len(artist_ids & {row[f'top_artist{i}_id'] for i in TOP_SLOTS})
+        albums = len(album_ids & {row[f'top_album{i}_id'] for i in TOP_SLOTS})
+        overlap[row['id']] = (artists, albums)
+    return overlap
+
+
+def _shared_ratings(user, excluded_ids):
+    """Number of tracks each candidate has rated that the user rated too"""
+    rows = TrackRating.objects.filter(
+        track_id__in=TrackRating.objects.filter(user=user).values('track_id')
+    ).exclude(
+        user_id__in=excluded_ids
+    ).values('user_id').annotate(shared=Count('id'))
+    return {row['user_id']: row['shared'] for row in rows}
+
+
+def compute_suggestions(user, limit=None):
+    """
+    Rank follow suggestions for a user.
+
+    Returns a list of dicts (id, score, mutuals, artists, albums, ratings),
+    best first. If there are fewer scored candidates than ``limit`` the rest
+    is filled with the most followed users so new accounts still get a list.
+    """
+    limit = limit or settings.SOCIAL_SUGGESTIONS_LIMIT
+    excluded_ids = set(user.get_following_ids()) | {user.pk}
+
+    mutuals = _mutual_counts(user, excluded_ids)
+    taste = _taste_overlap(user, excluded_ids)
+    ratings = _shared_ratings(user, excluded_ids)
+
+    candidates = []
+    for candidate_id in set(mutuals) | set(taste) | set(ratings):
+        artists, albums = taste.get(candidate_id, (0, 0))
+        entry = {
+            'id': candidate_id,
+            'mutuals': mutuals.get(candidate_id, 0),
+            'artists': artists,
+            'albums': albums,
+            'ratings': ratings.get(candidate_id, 0),
+        }
+        entry['score'] = (
+            entry['mutuals'] * MUTUAL_WEIGHT
+            + artists * ARTIST_WEIGHT
+            + albums * ALBUM_WEIGHT
+            + entry['ratings'] * RATING_WEIGHT
+        )
+        candidates.append(entry)
+
+    # Only suggest people who have connected Spotify
+    connected = set(
+        User.objects.filter(
+            id__in=[entry['id'] for entry in candidates],
+            spotify_access_token__isnull=False
+        ).values_list('id', flat=True)
+    )
+    candidates = [entry for entry in candidates if entry['id'] in connected]
+    candidates.sort(key=lambda entry: (-entry['score'], entry['id']))
+    candidates = candidates[:limit]
+
+    if len(candidates) < limit:
+        popular = User.objects.exclude(
+            id__in=excluded_ids | connected
+        ).filter(
+            spotify_access_token__isnull=False
+        ).order_by('-follower_count', 'id').values_list('id', flat=True)[:limit - len(candidates)]
+        candidates.extend(
+            {'id': user_id, 'score': 0, 'mutuals': 0, 'artists': 0, 'albums': 0, 'ratings': 0}
+            for user_id in popular
+        )
+
+    return candidates
+
+
+def refresh_suggestions(user):
+    """Recompute a user's suggestions and store them"""
+    suggestions = compute_suggestions(user)
+    FollowSuggestions.objects.update_or_create(
+        user=user, defaults={'entries': suggestions, 'computed_at': timezone.now()}
+    )
+    logger.debug(f"Refreshed {len(suggestions)} follow suggestions for user {user.username}")
+    return suggestions
+
+
+def get_suggestions(user):
+    """Return a user's stored suggestions, minus anyone they have followed since"""
+    stored = FollowSuggestions.objects.filter(user=user).first()
+    max_age = timedelta(seconds=settings.SOCIAL_SUGGESTIONS_MAX_AGE)
+    if stored is None or stored.computed_at < timezone.now() - max_age:
+        suggestions = refresh_suggestions(user)
+    else:
+        suggestions = stored.entries
+    following_ids = user.get_following_ids()
+    return [entry for entry in suggestions if entry['id'] not in following_ids]
@@ -1,3 +1,475 @@
-from django.test import TestCase
+import base64
+from datetime import timedelta
+from io import StringIO
+from unittest import skipUnless
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.forms import modelform_factory
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from core import jobs
+from core.models import User
+from spotify.models import Track, TrackRating
+from . import suggestions, timeline
+from .pagination import InvalidCursor, decode_cursor, encode_cursor
+from .models import Comment, Follow, FollowSuggestions, Like, Post, TimelineEntry
+
+
+def explain(queryset):
+    """Return SQLite's EXPLAIN QUERY PLAN output for a queryset as one string"""
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return '\n'.join(row[-1] for row in cursor.fetchall())
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plan assertions are written for SQLite')
+class HotQueryIndexTests(TestCase):
+    """The hottest post and comment queries must be served by an index, not a table scan"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='indexed')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = explain(queryset)
+        self.assertIn(f'INDEX {index_name}', plan)
+        self.assertNotRegex(plan, r'(?m)^SCAN (?!.*INDEX)')
+
+    def test_public_profile_posts(self):
+        queryset = Post.objects.filter(user=self.user, is_private=False).order_by('-created_at', '-id')
+        plan = explain(queryset)
+        self.assertIn('INDEX post_public_user_created_idx', plan)
+        self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan)
+
+    def test_own_profile_posts(self):
+        plan = explain(Post.objects.filter(user=self.user).order_by('-created_at', '-id'))
+        self.assertIn('INDEX post_user_created_idx', plan)
+        self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan)
+
+    def test_duplicate_post_check(self):
+        queryset = Post.objects.filter(
+            user=self.user,
+            spotify_id='4iV5W9uYEdYUVa79Axb7Rh',
+            post_type='track',
+            created_at__gte=timezone.now() - timedelta(minutes=5)
+        )
+        self.assertUsesIndex(queryset, 'post_user_item_created_idx')
+
+    def test_feed_page(self):
+        queryset = TimelineEntry.objects.filter(owner=self.user).order_by('-created_at', '-post_id')
+        plan = explain(queryset.values_list('created_at', 'post_id'))
+        self.assertIn('INDEX timeline_owner_created_idx', plan)
+        self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan)
+
+    def test_post_comments(self):
+        post = Post.objects.create(
+            user=self.user,
+            post_type='track',
+            spotify_id='4iV5W9uYEdYUVa79Axb7Rh',
+            track=Track.objects.create(
+                id='4iV5W9uYEdYUVa79Axb7Rh',
+                name='As It Was',
+                artist_name='Harry Styles',
+                spotify_url='https://open.spotify.com/track/4iV5W9uYEdYUVa79Axb7Rh'
+            )
+        )
+        plan = explain(Comment.objects.filter(post=post, root__isnull=True).order_by('created_at', 'id'))
+        self.assertIn('INDEX comment_post_root_created_idx', plan)
+        self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan)
+
+        root = Comment.objects.create(user=self.user, post=post, content='First')
+        plan = explain(Comment.objects.filter(root=root).order_by('created_at', 'id'))
+        self.assertIn('INDEX comment_root_created_idx', plan)
+        self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan)
+
+
+@override_settings(SOCIAL_COMMENT_REPLIES_PREVIEW=2)
+class CommentThreadTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='talker')
+        self.client.force_login(self.user)
+        self.post = Post.objects.create(user=self.user, post_type='track', spotify_id='4iV5W9uYEdYUVa79Axb7Rh')
+        self.start = timezone.now() - timedelta(hours=1)
+        self.minutes = 0
+
+    def comment(self, content, parent=None, created_at=None):
+        self.minutes += 1
+        return Comment.objects.create(
+            user=self.user, post=self.post, content=content, parent=parent,
+            created_at=created_at or self.start + timedelta(minutes=self.minutes)
+        )
+
+    def get_comments(self, **params):
+        return self.client.get(f'/social/get-comments/{self.post.pk}/', params).json()
+
+    def get_replies(self, root, **params):
+        return self.client.get(f'/social/get-replies/{root.pk}/', params).json()
+
+    def test_top_level_comments_page_oldest_first(self):
+        roots = [self.comment(f'Root {n}') for n in range(5)]
+        self.comment('Reply', parent=roots[0])
+
+        seen, cursor = [], None
+        while True:
+            params = {'page_size': 2, **({'cursor': cursor} if cursor else {})}
+            data = self.get_comments(**params)
+            seen += [comment['id'] for comment in data['comments']]
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, [root.id for root in roots])
+        self.assertEqual(data['comment_count'], 6)
+
+    def test_each_thread_previews_its_first_replies(self):
+        busy, quiet, empty = self.comment('Busy'), self.comment('Quiet'), self.comment('Empty')
+        busy_replies = [self.comment(f'Busy {n}', parent=busy) for n in range(2)]
+        # A reply to a reply belongs to the same thread
+        busy_replies += [self.comment('Nested', parent=busy_replies[0]), self.comment('Busy 3', parent=busy)]
+        quiet_reply = self.comment('Quiet 0', parent=quiet)
+
+        comments = {comment['id']: comment for comment in self.get_comments()['comments']}
+        busy_data, quiet_data, empty_data = comments[busy.id], comments[quiet.id], comments[empty.id]
+        self.assertEqual([reply['id'] for reply in busy_data['replies']], [reply.id for reply in busy_replies[:2]])
+        self.assertEqual(busy_data['reply_count'], 4)
+        self.assertIsNotNone(busy_data['replies_cursor'])
+        self.assertEqual(([reply['id'] for reply in quiet_data['replies']], quiet_data['replies_cursor']), ([quiet_reply.id], None))
+        self.assertEqual((empty_data['replies'], empty_data['reply_count'], empty_data['replies_cursor']), ([], 0, None))
+
+        # The cursor continues the thread right after the preview
+        data = self.get_replies(busy, cursor=busy_data['replies_cursor'], page_size=1)
+        self.assertEqual([reply['id'] for reply in data['replies']], [busy_replies[2].id])
+        data = self.get_replies(busy, cursor=data['next_cursor'], page_size=1)
+        self.assertEqual(([reply['id'] for reply in data['replies']], data['next_cursor']), ([busy_replies[3].id], None))
+
+    def test_replies_share_a_timestamp(self):
+        root = self.comment('Root')
+        replies = [self.comment(f'Reply {n}', parent=root, created_at=self.start) for n in range(4)]
+
+        seen, cursor = [], None
+        while True:
+            data = self.get_replies(root, page_size=3, **({'cursor': cursor} if cursor else {}))
+            seen += [reply['id'] for reply in data['replies']]
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, [reply.id for reply in replies])
+
+    def test_reply_count_after_nested_delete(self):
+        root = self.comment('Root')
+        reply = self.comment('Reply', parent=root)
+        self.comment('Nested', parent=reply)
+        self.comment('Nested again', parent=Comment.objects.get(content='Nested'))
+        self.comment('Other reply', parent=root)
+        self.assertEqual(Comment.objects.get(pk=root.pk).reply_count, 4)
+
+        # Deleting a reply takes its sub-thread with it
+        reply.delete()
+        self.assertEqual(Comment.objects.get(pk=root.pk).reply_count, 1)
+        self.assertEqual(Post.objects.get(pk=self.post.pk).comment_count, 2)
+        data = self.get_comments()['comments'][0]
+        self.assertEqual((data['reply_count'], len(data['replies']), data['replies_cursor']), (1, 1, None))
+
+        root.delete()
+        self.assertEqual(Post.objects.get(pk=self.post.pk).comment_count, 0)
+
+    def test_bad_cursor_and_non_root(self):
+        root = self.comment('Root')
+        reply = self.comment('Reply', parent=root)
+        self.assertEqual(self.client.get(f'/social/get-comments/{self.post.pk}/', {'cursor': 'nope'}).status_code, 400)
+        self.assertEqual(self.client.get(f'/social/get-replies/{root.pk}/', {'cursor': 'nope'}).status_code, 400)
+        self.assertEqual(self.client.get(f'/social/get-replies/{reply.pk}/').status_code, 404)
+
+
+@override_settings(SOCIAL_FANOUT_MAX_FOLLOWERS=2)
+class FeedTests(TestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user(username='reader')
+        self.author = User.objects.create_user(username='author')
+        self.others = [User.objects.create_user(username=f'fan{i}') for i in range(2)]
+        Follow.objects.create(follower=self.reader, following=self.author)
+        self.start = timezone.now() - timedelta(days=1)
+
+    def post(self, minutes, user=None, is_private=False):
+        post = Post.objects.create(
+            user=User.objects.get(pk=(user or self.author).pk),
+            post_type='track',
+            spotify_id='4iV5W9uYEdYUVa79Axb7Rh',
+            is_private=is_private,
+            created_at=self.start + timedelta(minutes=minutes)
+        )
+        timeline.fan_out_post(post)
+        return post
+
+    def read_feed(self, page_size=2):
+        posts, cursor = timeline.get_feed_page(self.reader, None, page_size)
+        while cursor:
+            page, cursor = timeline.get_feed_page(self.reader, cursor, page_size)
+            posts += page
+        return posts
+
+    def test_pages_through_timeline_newest_first(self):
+        posts = [self.post(minutes) for minutes in range(5)]
+        self.post(10, is_private=True)
+        self.post(11, user=self.others[0])
+        self.assertEqual(self.read_feed(), posts[::-1])
+
+    def test_merges_authors_too_large_to_fan_out(self):
+        fanned = self.post(0)
+        for other in self.others:
+            Follow.objects.create(follower=other, following=self.author)
+        merged = [self.post(minutes) for minutes in (1, 2, 3)]
+        self.assertFalse(TimelineEntry.objects.filter(post__in=merged).exists())
+        self.assertEqual(self.read_feed(), merged[::-1] + [fanned])
+
+    def test_posts_stay_in_feed_when_author_drops_under_threshold(self):
+        for other in self.others:
+            Follow.objects.create(follower=other, following=self.author)
+        posts = [self.post(minutes) for minutes in (1, 2)]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.get(follower=self.others[0]).delete()
+        jobs.run_pending('worker')
+
+        self.assertTrue(timeline.is_fanned_out(User.objects.get(pk=self.author.pk)))
+        self.assertEqual(self.read_feed(), posts[::-1])
+        self.assertEqual(
+            TimelineEntry.objects.filter(owner=self.others[1], post__in=posts).count(), 2
+        )
+
+    def test_feed_views(self):
+        posts = [self.post(minutes) for minutes in range(3)]
+        self.client.force_login(self.reader)
+        response = self.client.get('/social/feed/')
+        self.assertEqual(list(response.context['posts']), posts[::-1])
+
+        response = self.client.get('/social/posts/', {'page_size': 2}).json()
+        self.assertEqual([post['id'] for post in response['posts']], [posts[2].id, posts[1].id])
+        response = self.client.get('/social/posts/', {'cursor': response['next_cursor']}).json()
+        self.assertEqual([post['id'] for post in response['posts']], [posts[0].id])
+        self.assertIsNone(response['next_cursor'])
+
+
+class PostListTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+        # Two posts share a timestamp, so pages must break ties on id
+        now = timezone.now()
+        self.posts = [
+            Post.objects.create(user=self.author, post_type='track', spotify_id='4iV5W9uYEdYUVa79Axb7Rh',
+                                created_at=now - timedelta(minutes=minutes))
+            for minutes in (3, 2, 2, 1)
+        ]
+        self.client.force_login(self.reader)
+
+    def get_posts(self, **params):
+        return self.client.get('/social/posts/', {'source': 'user', **params})
+
+    def test_cursor_round_trip(self):
+        post = self.posts[1]
+        self.assertEqual(decode_cursor(encode_cursor(post)), (post.created_at, post.id))
+
+    def test_pages_through_profile_with_cursor(self):
+        seen, cursor = [], None
+        while True:
+            params = {'user_id': self.author.id, 'page_size': 1}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.get_posts(**params).json()
+            seen += [post['id'] for post in response['posts']]
+            cursor = response['next_cursor']
+            if not cursor:
+                break
+        expected = sorted(self.posts, key=lambda post: (post.created_at, post.id), reverse=True)
+        self.assertEqual(seen, [post.id for post in expected])
+
+    def test_tampered_cursors_are_rejected(self):
+        valid = encode_cursor(self.posts[0])
+        tampered = [
+            valid[:-3],
+            valid + '!',
+            'not a cursor',
+            'é',
+            base64.urlsafe_b64encode(b'\xff\xfe').decode(),
+            base64.urlsafe_b64encode(b'{"a": 1}').decode(),
+            base64.urlsafe_b64encode(b'["2024-01-01T00:00:00+00:00"]').decode(),
+            base64.urlsafe_b64encode(b'["2024-01-01T00:00:00", 5]').decode(),
+            base64.urlsafe_b64encode(b'["2024-01-01T00:00:00+00:00", "abc"]').decode(),
+            base64.urlsafe_b64encode(b'["2024-01-01T00:00:00+00:00", -5]').decode(),
+            base64.urlsafe_b64encode(b'[null, 5]').decode(),
+        ]
+        for cursor in tampered:
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(InvalidCursor):
+                    decode_cursor(cursor)
+                response = self.get_posts(user_id=self.author.id, cursor=cursor)
+                self.assertEqual(response.status_code, 400)
+
+    def test_bad_user_id(self):
+        response = self.get_posts(user_id='abc')
+        self.assertEqual((response.status_code, response.json()['success']), (400, False))
+        response = self.get_posts(user_id=self.author.id + 1000)
+        self.assertEqual(response.status_code, 404)
+        response = self.get_posts()
+        self.assertEqual((response.status_code, response.json()['posts']), (200, []))
+
+
+class CounterTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author')
+        self.fan = User.objects.create_user(username='fan')
+        self.post = Post.objects.create(user=self.author, post_type='track', spotify_id='4iV5W9uYEdYUVa79Axb7Rh')
+
+    def test_saving_after_like_keeps_count(self):
+        Like.objects.create(user=self.fan, post=self.post)
+        Comment.objects.create(user=self.fan, post=self.post, content='Great')
+        self.assertEqual((self.post.like_count, self.post.comment_count), (1, 1))
+        self.post.content = 'Edited'
+        self.post.save()
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.comment_count, self.post.content), (1, 1, 'Edited'))
+
+    def test_follow_refreshes_loaded_users(self):
+        follow = Follow.objects.create(follower=self.fan, following=self.author)
+        self.assertEqual((self.fan.following_count, self.author.follower_count), (1, 1))
+        follow.delete()
+        self.assertEqual((self.fan.following_count, self.author.follower_count), (0, 0))
+
+    def test_edit_post_keeps_counts(self):
+        Like.objects.create(user=self.fan, post=self.post)
+        self.client.force_login(self.author)
+        response = self.client.post(f'/social/edit-post/{self.post.pk}/', {'content': 'Edited'})
+        self.assertTrue(response.json()['success'])
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.content), (1, 'Edited'))
+
+    def test_save_inserts_missing_row(self):
+        user = User(username='phoenix')
+        user.save()
+        User.objects.filter(pk=user.pk).delete()
+        user.save()
+        self.assertTrue(User.objects.filter(pk=user.pk).exists())
+
+    def test_counters_are_not_form_fields(self):
+        self.assertNotIn('like_count', modelform_factory(Post, fields='__all__').base_fields)
+        self.assertNotIn('follower_count', modelform_factory(User, fields='__all__').base_fields)
+
+    def test_follow_set_is_fresh_for_every_request(self):
+        # Another worker's request holds its own User instance
+        other_request_fan = User.objects.get(pk=self.fan.pk)
+        self.assertFalse(other_request_fan.is_following(self.author))
+        Follow.objects.create(follower=self.fan, following=self.author)
+        self.assertTrue(self.fan.is_following(self.author))
+        self.assertTrue(User.objects.get(pk=self.fan.pk).is_following(self.author))
+
+
+@override_settings(SOCIAL_SUGGESTIONS_LIMIT=5)
+class SuggestionTests(TestCase):
+    def setUp(self):
+        def connected(username, **fields):
+            return User.objects.create_user(username=username, spotify_access_token='token', **fields)
+
+        self.me = connected('me', top_artist1_id='a1', top_artist2_id='a2', top_album1_id='b1')
+        friends = [connected(f'friend{i}') for i in range(2)]
+        for friend in friends:
+            Follow.objects.create(follower=self.me, following=friend)
+
+        # Followed by both friends: 2 mutuals * 3
+        self.mutual = connected('mutual')
+        # Two shared artists * 2 + one shared album * 1, in different slots
+        self.taste = connected('taste', top_artist3_id='a1', top_artist1_id='a2', top_album2_id='b1')
+        # Three tracks both rated * 1
+        self.rater = connected('rater')
+        # Would rank first, but hasn't connected Spotify
+        self.unconnected = User.objects.create_user(username='unconnected', top_artist1_id='a1')
+        for friend in friends:
+            Follow.objects.create(follower=friend, following=self.mutual)
+            Follow.objects.create(follower=friend, following=self.unconnected)
+        for n in range(3):
+            for user in (self.me, self.rater):
+                TrackRating.set_rating(user, f'track{n}', 'Song', 'Band', 8)
+
+        # No signals, filled in by follower count
+        self.popular = connected('popular')
+        self.quiet = connected('quiet')
+        for fan in (self.rater, self.quiet, self.unconnected):
+            Follow.objects.create(follower=fan, following=self.popular)
+
+    def suggested(self, user=None):
+        return [(entry['id'], entry['score']) for entry in suggestions.get_suggestions(user or User.objects.get(pk=self.me.pk))]
+
+    def test_ranking(self):
+        self.assertEqual(self.suggested(), [
+            (self.mutual.id, 6),
+            (self.taste.id, 5),
+            (self.rater.id, 3),
+            (self.popular.id, 0),
+            (self.quiet.id, 0),
+        ])
+        entry = suggestions.get_suggestions(self.me)[1]
+        self.assertEqual((entry['artists'], entry['albums'], entry['mutuals'], entry['ratings']), (2, 1, 0, 0))
+
+    def test_new_user_gets_popular_users(self):
+        newcomer = User.objects.create_user(username='newcomer', spotify_access_token='token')
+        self.assertEqual([user_id for user_id, score in self.suggested(newcomer)][:2], [self.popular.id, self.mutual.id])
+        self.assertNotIn(self.unconnected.id, [user_id for user_id, score in self.suggested(newcomer)])
+
+    def test_stored_list_is_shared_and_skips_new_follows(self):
+        call_command('refresh_suggestions', user=['me', 'unconnected'], stdout=StringIO())
+        self.assertEqual(list(FollowSuggestions.objects.values_list('user', flat=True)), [self.me.id])
+
+        Follow.objects.create(follower=self.me, following=self.mutual)
+        me = User.objects.get(pk=self.me.pk)
+        # The stored list and the follow set, nothing recomputed
+        with self.assertNumQueries(2):
+            ids = [user_id for user_id, score in self.suggested(me)[:1]]
+        self.assertEqual(ids, [self.taste.id])
+
+    @override_settings(SOCIAL_SUGGESTIONS_MAX_AGE=60)
+    def test_old_list_is_recomputed(self):
+        suggestions.refresh_suggestions(self.me)
+        FollowSuggestions.objects.update(entries=[], computed_at=timezone.now() - timedelta(seconds=61))
+        self.assertEqual(len(self.suggested()), 5)
+
+
+class PostCatalogMigrationTests(TransactionTestCase):
+    before = [('social', '0009_hot_query_indexes'), ('spotify', '0005_catalog')]
+    after = [('social', '0010_post_catalog')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        call_command('migrate', verbosity=0)
+
+    def test_older_posts_fill_in_blank_fields(self):
+        apps = self.migrate(self.before)
+        # core isn't migrated back, so its current model matches the table
+        user = User.objects.create_user(username='poster')
+        Post = apps.get_model('social', 'Post')
+        track_id = '4iV5W9uYEdYUVa79Axb7Rh'
+        for days_ago, image_url, preview_url in (
+            (3, 'https://i.scdn.co/image/old', 'https://p.scdn.co/mp3-preview/old'),
+            (2, 'https://i.scdn.co/image/middle', ''),
+            (1, '', ''),
+        ):
+            Post.objects.create(
+                user_id=user.pk, post_type='track', spotify_id=track_id, spotify_name=f'Song {days_ago}',
+                spotify_artist='Band', spotify_image_url=image_url, spotify_preview_url=preview_url,
+                spotify_url='', created_at=timezone.now() - timedelta(days=days_ago)
+            )
+
+        apps = self.migrate(self.after)
+        track = apps.get_model('spotify', 'Track').objects.get(pk=track_id)
+        self.assertEqual(
+            (track.name, track.image_url, track.preview_url, track.spotify_url),
+            ('Song 1', 'https://i.scdn.co/image/middle', 'https://p.scdn.co/mp3-preview/old', '')
+        )
+        self.assertEqual(apps.get_model('social', 'Post').objects.filter(track_id=track_id).count(), 3)
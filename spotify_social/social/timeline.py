@@ -0,0 +1,158 @@
+"""
+Fan-out-on-write home timelines.
+
+When a public post is created it is copied into a TimelineEntry for each of
+the author's followers, so reading the feed is a lookup on the reader's own
+entries instead of a query over everyone they follow. Authors with more
+than SOCIAL_FANOUT_MAX_FOLLOWERS followers are not fanned out; their posts
+are merged into followers' feeds at read time instead (see get_feed_page).
+When such an author drops back to the threshold their recent posts are
+copied into their followers' timelines, since they stop being merged.
+"""
+
+import logging
+
+from django.conf import settings
+from django.db.models import Q
+
+from core import jobs
+from core.models import User
+from .models import Follow, Post, TimelineEntry
+from .pagination import decode_cursor, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+
+def is_fanned_out(author):
+    """Check if an author's posts are pushed into follower timelines"""
+    return author.follower_count <= settings.SOCIAL_FANOUT_MAX_FOLLOWERS
+
+
+def get_unfanned_following_ids(user):
+    """Ids of followed users whose posts are merged into the feed at read time"""
+    return list(
+        User.objects.filter(
+            followers__follower=user,
+            follower_count__gt=settings.SOCIAL_FANOUT_MAX_FOLLOWERS
+        ).values_list('id', flat=True)
+    )
+
+
+def fan_out_post(post):
+    """Add a public post to the timeline of each of its author's followers"""
+    if post.is_private or not is_fanned_out(post.user):
+        return 0
+
+    follower_ids = Follow.objects.filter(following=post.user).values_list('follower_id', flat=True)
+    entries = [
+        TimelineEntry(owner_id=follower_id, post=post, created_at=post.created_at)
+        for follower_id in follower_ids.iterator()
+    ]
+    TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    logger.debug(f"Fanned out post {post.id} to {len(entries)} timelines")
+    return len(entries)
+
+
+def get_feed_page(user, cursor=None, page_size=None):
+    """
+    Return (posts, next_cursor) for a page of the user's home feed, newest first.
+
+    The page is a range scan of the user's own timeline entries on
+    (owner, created_at). Posts by followed authors that aren't fanned out
+    are read with the same bounds and merged in. Raises InvalidCursor.
+    """
+    page_size = page_size or settings.SOCIAL_POSTS_PAGE_SIZE
+    entries = TimelineEntry.objects.filter(owner=user).order_by('-created_at', '-post_id')
+    if cursor:
+        created_at, post_id = decode_cursor(cursor)
+        entries = entries.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, post_id__lt=post_id))
+    # Fetch one extra row to find out if there is another page
+    positions = list(entries.values_list('created_at', 'post_id')[:page_size + 1])
+
+    unfanned_ids = get_unfanned_following_ids(user)
+    if unfanned_ids:
+        merged = Post.objects.filter(user_id__in=unfanned_ids, is_private=False).order_by('-created_at', '-id')
+        if cursor:
+            merged = merged.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=post_id))
+        positions += merged.values_list('created_at', 'id')[:page_size + 1]
+        # Posts fanned out before their author passed the threshold come from both
+        positions = sorted(set(positions), reverse=True)
+
+    post_ids = [post_id for _, post_id in positions[:page_size]]
+    posts = Post.objects.filter(pk__in=post_ids).with_activity(user).in_bulk()
+    page = [posts[post_id] for post_id in post_ids if post_id in posts]
+    next_cursor = encode_cursor(page[-1]) if len(positions) > page_size and page else None
+    return page, next_cursor
+
+
+def remove_post(post):
+    """Take a post out of every timeline, e.g. when it is made private"""
+    TimelineEntry.objects.filter(post=post).delete()
+
+
+def update_post_visibility(post):
+    """Re-sync timelines after a post's privacy setting changed"""
+    if post.is_private:
+        remove_post(post)
+    else:
+        fan_out_post(post)
+
+
+def backfill(follower, followee):
+    """Copy a newly followed user's recent public posts into the follower's timeline"""
+    if not is_fanned_out(followee):
+        return 0
+
+    posts = Post.objects.filter(user=followee, is_private=False).order_by('-created_at').values_list(
+        'id', 'created_at'
+    )[:settings.SOCIAL_TIMELINE_BACKFILL]
+    entries = [
+        TimelineEntry(owner=follower, post_id=post_id, created_at=created_at)
+        for post_id, created_at in posts
+    ]
+    TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    return len(entries)
+
+
+def schedule_follower_backfill(author_id):
+    """Queue backfill_followers for an author who just dropped back to the fan-out threshold"""
+    jobs.enqueue(
+        'social.backfill_followers',
+        {'author_id': author_id},
+        idempotency_key=f'timeline-backfill-followers:{author_id}'
+    )
+
+
+def backfill_followers(author):
+    """
+    Copy an author's recent public posts into every follower's timeline.
+
+    Posts made while the author had too many followers to fan out were only
+    merged in at read time, which stops once they are back under the limit.
+    """
+    posts = list(
+        Post.objects.filter(user=author, is_private=False).order_by('-created_at').values_list(
+            'id', 'created_at'
+        )[:settings.SOCIAL_TIMELINE_BACKFILL]
+    )
+    if not posts:
+        return 0
+
+    total = 0
+    follower_ids = Follow.objects.filter(following=author).values_list('follower_id', flat=True)
+    for follower_id in follower_ids.iterator():
+        entries = [
+            TimelineEntry(owner_id=follower_id, post_id=post_id, created_at=created_at)
+            for post_id, created_at in posts
+        ]
+        TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+        total += len(entries)
+    logger.info(f"Backfilled {len(posts)} posts by {author.username} into follower timelines")
+    return total
+
+
+def prune(follower, followee):
+    """Remove an unfollowed user's posts from the follower's timeline"""
+    TimelineEntry.objects.filter(owner=follower, post__user=followee).delete()
@@ -14,10 +14,12 @@ urlpatterns = [
     path('like-post/<int:post_id>/', views.like_post, name='like_post'),
     path('add-comment/<int:post_id>/', views.add_comment, name='add_comment'),
     path('get-comments/<int:post_id>/', views.get_comments, name='get_comments'),
+    path('get-replies/<int:comment_id>/', views.get_replies, name='get_replies'),
     
     # Follow system URLs
     path('discover/', views.discover_users, name='discover_users'),
     path('feed/', views.feed, name='feed'),
+    path('posts/', views.post_list, name='post_list'),
     path('follow/<int:user_id>/', views.follow_user, name='follow_user'),
     path('unfollow/<int:user_id>/', views.unfollow_user, name='unfollow_user'),
     path('following/', views.following_list, name='following_list'),
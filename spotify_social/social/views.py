@@ -2,16 +2,26 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from .models import Post, Follow, Like, Comment
+from . import suggestions, timeline
+from .pagination import InvalidCursor, encode_cursor, get_page_size, paginate_comments, paginate_for_page, paginate_posts
+from core import jobs
 from core.models import User
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
+from core.search import search_users
+from spotify import catalog, ratelimit
+from spotify import listen_later as spotify_listen_later
+from spotify import playback as spotify_playback
+from spotify import profile as spotify_profile
+from spotify.tokens import SpotifyTokenError
 from django.conf import settings
+from django.core.paginator import Paginator
 import logging
 from django.http import JsonResponse
+from django.urls import reverse
 from django.views.decorators.http import require_POST
 import re
 from django.utils import timezone
-from django.db.models import Q
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
 
 logger = logging.getLogger(__name__)
 
@@ -64,24 +74,6 @@ def create_post(request):
         })
     
     try:
-        # Create SpotifyOAuth instance
-        sp_oauth = SpotifyOAuth(
-            client_id=settings.SPOTIFY_CLIENT_ID,
-            client_secret=settings.SPOTIFY_CLIENT_SECRET,
-            redirect_uri=settings.SPOTIFY_REDIRECT_URI,
-            scope='user-read-private user-read-email'
-        )
-        
-        # Try to refresh the token
-        token_info = sp_oauth.refresh_access_token(request.user.spotify_refresh_token)
-        if token_info:
-            request.user.spotify_access_token = token_info['access_token']
-            request.user.save()
-            logger.info(f"Refreshed access token for user {request.user.username}")
-        
-        # Create Spotify instance with new token
-        sp = spotipy.Spotify(auth=request.user.spotify_access_token)
-        
         # Check if a similar post already exists for this user and track/album
         existing_post = Post.objects.filter(
             user=request.user,
@@ -105,20 +97,27 @@ def create_post(request):
         
         # Create the post
         try:
+            item = catalog.remember_item(
+                post_type,
+                spotify_id,
+                spotify_name,
+                spotify_artist,
+                image_url=spotify_image_url,
+                preview_url=spotify_preview_url,
+                spotify_url=spotify_link
+            )
             post = Post.objects.create(
                 user=request.user,
                 post_type=post_type,
                 content=content,
                 spotify_id=spotify_id,
-                spotify_name=spotify_name,
-                spotify_artist=spotify_artist,
-                spotify_image_url=spotify_image_url,
-                spotify_preview_url=spotify_preview_url,
-                spotify_url=spotify_link,
+                track=item if post_type != 'album' else None,
+                album=item if post_type == 'album' else None,
                 rating=rating if rating else None,
                 is_private=is_private
             )
             logger.info(f"Created post {post.id} for {post_type} {spotify_id}")
+            timeline.fan_out_post(post)
         except Exception as post_error:
             logger.error(f"Error creating post object: {str(post_error)}")
             return JsonResponse({
@@ -130,14 +129,12 @@ def create_post(request):
         if rating and post_type == 'track':
             try:
                 from spotify.models import TrackRating
-                TrackRating.objects.update_or_create(
-                    user=request.user,
-                    track_id=spotify_id,
-                    defaults={
-                        'track_name': spotify_name,
-                        'artist_name': spotify_artist,
-                        'rating': rating
-                    }
+                TrackRating.set_rating(
+                    request.user,
+                    spotify_id,
+                    spotify_name,
+                    spotify_artist,
+                    rating
                 )
                 logger.info(f"Updated rating for track {spotify_id} to {rating}")
             except Exception as rating_error:
@@ -167,50 +164,11 @@ def add_to_queue(request):
         return JsonResponse({'success': False, 'message': 'No track URI provided'})
     
     try:
-        # Create SpotifyOAuth instance with all required scopes
-        sp_oauth = SpotifyOAuth(
-            client_id=settings.SPOTIFY_CLIENT_ID,
-            client_secret=settings.SPOTIFY_CLIENT_SECRET,
-            redirect_uri=settings.SPOTIFY_REDIRECT_URI,
-            scope=settings.SPOTIFY_SCOPES
-        )
-        
-        # Try to refresh the token
-        token_info = sp_oauth.refresh_access_token(request.user.spotify_refresh_token)
-        if token_info:
-            request.user.spotify_access_token = token_info['access_token']
-            request.user.save()
-        
-        # Create Spotify instance with new token
-        sp = spotipy.Spotify(auth=request.user.spotify_access_token)
-        
-        # Check if user has an active device
-        devices = sp.devices()
-        if not devices['devices']:
-            return JsonResponse({
-                'success': False, 
-                'message': 'No active Spotify device found. Please make sure Spotify is open on one of your devices.'
-            })
-        
-        # Check if any device is currently playing
-        current_playback = sp.current_playback()
-        if not current_playback or not current_playback['is_playing']:
-            return JsonResponse({
-                'success': False,
-                'message': 'No device is currently playing. Please start playback on one of your devices.'
-            })
-        
-        # Get the active device ID
-        active_device = next((device for device in devices['devices'] if device['is_active']), None)
-        if not active_device:
-            return JsonResponse({
-                'success': False,
-                'message': 'No active device found. Please make sure Spotify is the active device.'
-            })
-        
-        # Add to queue with the active device
-        sp.add_to_queue(uri=spotify_uri, device_id=active_device['id'])
+        # The active device is cached, so a repeat click is one Spotify call
+        spotify_playback.queue_track(request.user, spotify_uri)
         return JsonResponse({'success': True})
+    except spotify_playback.NoActiveDevice as e:
+        return JsonResponse({'success': False, 'message': str(e)})
     except Exception as e:
         logger.error(f"Error adding to queue: {str(e)}")
         return JsonResponse({'success': False, 'message': str(e)})
@@ -226,79 +184,28 @@ def add_to_listen_later(request):
     if not spotify_uri:
         return JsonResponse({'success': False, 'message': 'No track URI provided'})
     
-    try:
-        # Create SpotifyOAuth instance with all required scopes
-        sp_oauth = SpotifyOAuth(
-            client_id=settings.SPOTIFY_CLIENT_ID,
-            client_secret=settings.SPOTIFY_CLIENT_SECRET,
-            redirect_uri=settings.SPOTIFY_REDIRECT_URI,
-            scope=settings.SPOTIFY_SCOPES
-        )
-        
-        # Try to refresh the token
-        token_info = sp_oauth.refresh_access_token(request.user.spotify_refresh_token)
-        if token_info:
-            request.user.spotify_access_token = token_info['access_token']
-            request.user.save()
-        
-        # Create Spotify instance with new token
-        sp = spotipy.Spotify(auth=request.user.spotify_access_token)
-        
-        # Verify the track exists
-        try:
-            track_info = sp.track(spotify_uri.split(':')[-1])
-            if not track_info:
-                return JsonResponse({
-                    'success': False,
-                    'message': 'Invalid track'
-                })
-        except Exception as e:
-            logger.error(f"Error verifying track: {str(e)}")
-            return JsonResponse({
-                'success': False,
-                'message': 'Invalid track'
-            })
-        
-        # Check if track is already in playlist
-        try:
-            playlist_tracks = sp.playlist_items(request.user.listen_later)
-            for item in playlist_tracks['items']:
-                if item['track']['uri'] == spotify_uri:
-                    return JsonResponse({
-                        'success': False,
-                        'message': 'Track is already in your Listen Later playlist'
-                    })
-        except Exception as e:
-            logger.error(f"Error checking playlist: {str(e)}")
-            return JsonResponse({
-                'success': False,
-                'message': 'Error checking playlist'
-            })
-        
-        # Add to playlist
-        try:
-            sp.playlist_add_items(
-                playlist_id=request.user.listen_later,
-                items=[spotify_uri]
-            )
-            
-            return JsonResponse({
-                'success': True,
-                'message': 'Track added to Listen Later playlist!'
-            })
-        except Exception as e:
-            logger.error(f"Error adding to playlist: {str(e)}")
-            return JsonResponse({
-                'success': False,
-                'message': 'Error adding to playlist'
-            })
-            
-    except Exception as e:
-        logger.error(f"Error in add_to_listen_later: {str(e)}")
+    # Duplicates are caught from the local mirror without calling Spotify
+    if spotify_listen_later.contains(request.user, spotify_uri):
         return JsonResponse({
-            'success': False,
-            'message': 'Error adding to Listen Later playlist'
+            'success': True,
+            'message': 'Track is already in your Listen Later playlist'
         })
+    
+    # Verifying the track and adding it take Spotify calls, so the worker
+    # does them; the client can poll the job status
+    job = jobs.enqueue(
+        'spotify.add_to_listen_later',
+        {'spotify_uri': spotify_uri},
+        user=request.user,
+        idempotency_key=jobs.request_idempotency_key(request, f'listen-later:{request.user.pk}:{spotify_uri}')
+    )
+    
+    return JsonResponse({
+        'success': True,
+        'message': 'Adding track to your Listen Later playlist...',
+        'job_id': job.id,
+        'job_status_url': reverse('job_status', args=[job.id])
+    })
 
 @login_required
 @require_POST
@@ -364,6 +271,7 @@ def edit_post(request, post_id):
             
             # Update fields
             post.content = content
+            privacy_changed = post.is_private != is_private
             post.is_private = is_private
             
             # Only update rating if provided and valid
@@ -383,20 +291,22 @@ def edit_post(request, post_id):
                         'message': 'Invalid rating value'
                     })
             
-            post.save()
+            # Counters are left to Like and Comment
+            post.save(update_fields=['content', 'is_private', 'rating', 'updated_at'])
+            
+            if privacy_changed:
+                timeline.update_post_visibility(post)
             
             # Update track rating if it's a track post with rating
             if rating and post.post_type == 'track':
                 try:
                     from spotify.models import TrackRating
-                    TrackRating.objects.update_or_create(
-                        user=request.user,
-                        track_id=post.spotify_id,
-                        defaults={
-                            'track_name': post.spotify_name,
-                            'artist_name': post.spotify_artist,
-                            'rating': rating
-                        }
+                    TrackRating.set_rating(
+                        request.user,
+                        post.spotify_id,
+                        post.spotify_name,
+                        post.spotify_artist,
+                        rating
                     )
                     logger.info(f"Updated track rating for {post.spotify_id} to {rating}")
                 except Exception as rating_error:
@@ -421,30 +331,36 @@ def edit_post(request, post_id):
 def discover_users(request):
     """Discover users to follow"""
     # Get users that the current user is not following and exclude themselves
-    following_ids = request.user.following.values_list('following_id', flat=True)
+    following_ids = request.user.get_following_ids()
     
     # Search functionality
     search_query = request.GET.get('search', '').strip()
     
     if search_query:
-        # When searching, show ALL users (except self) that match the search
-        users_to_discover = User.objects.exclude(id=request.user.id).filter(
-            Q(username__icontains=search_query) | 
-            Q(first_name__icontains=search_query) | 
-            Q(last_name__icontains=search_query)
-        ).order_by('username')
+        # When searching, show the best matching users (except self) from the search index
+        users_to_discover = search_users(search_query, exclude=request.user)
+        page = Paginator(users_to_discover, settings.SOCIAL_SUGGESTIONS_PAGE_SIZE).get_page(request.GET.get('page'))
+        users = list(page)
     else:
-        # When not searching, show users not currently following (and have Spotify connected)
-        users_to_discover = User.objects.exclude(
-            Q(id=request.user.id) | Q(id__in=following_ids)
-        ).filter(spotify_access_token__isnull=False).order_by('username')
+        # When not searching, show ranked "who to follow" suggestions
+        page = Paginator(
+            suggestions.get_suggestions(request.user), settings.SOCIAL_SUGGESTIONS_PAGE_SIZE
+        ).get_page(request.GET.get('page'))
+        users_by_id = User.objects.in_bulk([entry['id'] for entry in page])
+        users = []
+        for entry in page:
+            user = users_by_id.get(entry['id'])
+            if user:
+                user.suggestion = entry
+                users.append(user)
     
-    # Add a flag to indicate if each user is already being followed
-    for user in users_to_discover:
-        user.is_already_following = request.user.is_following(user)
+    # Add a flag to indicate if each user is already being followed (in memory)
+    for user in users:
+        user.is_already_following = user.id in following_ids
     
     return render(request, 'social/discover_users.html', {
-        'users': users_to_discover,
+        'users': users,
+        'page': page,
         'search_query': search_query
     })
 
@@ -462,8 +378,8 @@ def follow_user(request, user_id):
                 'message': 'You cannot follow yourself.'
             })
         
-        # Check if already following
-        if request.user.is_following(user_to_follow):
+        # Check if already following (against the database, not the cached follow set)
+        if Follow.objects.filter(follower=request.user, following=user_to_follow).exists():
             return JsonResponse({
                 'success': False,
                 'message': f'You are already following {user_to_follow.username}.'
@@ -474,6 +390,7 @@ def follow_user(request, user_id):
             follower=request.user,
             following=user_to_follow
         )
+        timeline.backfill(request.user, user_to_follow)
         
         return JsonResponse({
             'success': True,
@@ -508,6 +425,7 @@ def unfollow_user(request, user_id):
         
         # Delete follow relationship
         follow_relation.delete()
+        timeline.prune(request.user, user_to_unfollow)
         
         return JsonResponse({
             'success': True,
@@ -521,27 +439,92 @@ def unfollow_user(request, user_id):
             'message': 'Error unfollowing user.'
         })
 
+def serialize_post(post, user):
+    """Post data for the JSON endpoints"""
+    return {
+        'id': post.id,
+        'user': {
+            'id': post.user.id,
+            'username': post.user.username
+        },
+        'post_type': post.post_type,
+        'content': post.content,
+        'spotify_id': post.spotify_id,
+        'spotify_name': post.spotify_name,
+        'spotify_artist': post.spotify_artist,
+        'spotify_image_url': post.spotify_image_url,
+        'spotify_preview_url': post.spotify_preview_url,
+        'spotify_url': post.spotify_url,
+        'spotify_uri': post.get_spotify_uri(),
+        'rating': float(post.rating) if post.rating else None,
+        'is_private': post.is_private,
+        'created_at': post.created_at.strftime('%Y-%m-%d %H:%M'),
+        'like_count': post.get_like_count(),
+        'comment_count': post.get_comment_count(),
+        'user_has_liked': post.is_liked_by(user)
+    }
+
 @login_required
 def feed(request):
     """Display posts from users you follow"""
-    # Get users the current user is following
-    following_users = request.user.get_following_users()
-    
-    # Get posts from followed users, excluding private posts
-    if following_users.exists():
-        feed_posts = Post.objects.filter(
-            user__in=following_users,
-            is_private=False
-        ).order_by('-created_at')
-    else:
-        feed_posts = Post.objects.none()
-    
-    # Add liked status for each post
-    for post in feed_posts:
-        post.user_has_liked = post.is_liked_by(request.user)
+    # Public posts from followed users, read from the user's timeline with
+    # like status and author in the same query; a bad cursor starts over
+    try:
+        posts, next_cursor = timeline.get_feed_page(request.user, request.GET.get('cursor'), get_page_size(request))
+    except InvalidCursor:
+        posts, next_cursor = timeline.get_feed_page(request.user, None, get_page_size(request))
     
     return render(request, 'social/feed.html', {
-        'posts': feed_posts
+        'posts': posts,
+        'next_cursor': next_cursor
+    })
+
+@login_required
+def post_list(request):
+    """Return a page of feed or profile posts as JSON for infinite scroll"""
+    source = request.GET.get('source', 'feed')
+    if source not in ('feed', 'user'):
+        return JsonResponse({
+            'success': False,
+            'message': 'Invalid post source'
+        }, status=400)
+    
+    try:
+        if source == 'feed':
+            page, next_cursor = timeline.get_feed_page(
+                request.user,
+                request.GET.get('cursor'),
+                get_page_size(request)
+            )
+        else:
+            try:
+                profile_user_id = int(request.GET.get('user_id') or request.user.id)
+            except ValueError:
+                return JsonResponse({
+                    'success': False,
+                    'message': 'Invalid user id'
+                }, status=400)
+            profile_user = User.objects.filter(id=profile_user_id).first()
+            if profile_user is None:
+                return JsonResponse({
+                    'success': False,
+                    'message': 'User not found'
+                }, status=404)
+            page, next_cursor = paginate_posts(
+                Post.objects.for_profile(profile_user, request.user).with_activity(request.user),
+                request.GET.get('cursor'),
+                get_page_size(request)
+            )
+    except InvalidCursor:
+        return JsonResponse({
+            'success': False,
+            'message': 'Invalid cursor'
+        }, status=400)
+    
+    return JsonResponse({
+        'success': True,
+        'posts': [serialize_post(post, request.user) for post in page],
+        'next_cursor': next_cursor
     })
 
 @login_required
@@ -554,7 +537,7 @@ def following_list(request, user_id=None):
     
     following_users = profile_user.get_following_users()
     
-    # Add follow status for each following user
+    # Add follow status for each following user (in memory)
     for user in following_users:
         user.is_followed_by_current_user = request.user.is_following(user)
     
@@ -574,7 +557,7 @@ def followers_list(request, user_id=None):
     
     followers_users = profile_user.get_followers_users()
     
-    # Add follow status for each follower
+    # Add follow status for each follower (in memory)
     for user in followers_users:
         user.is_followed_by_current_user = request.user.is_following(user)
     
@@ -594,16 +577,11 @@ def user_profile(request, user_id):
         return redirect('profile')
     
     # Get user's posts - only show public posts if viewing someone else's profile
-    if profile_user == request.user:
-        # Show all posts if it's the user's own profile
-        posts = Post.objects.filter(user=profile_user).order_by('-created_at')
-    else:
-        # Only show public posts for other users
-        posts = Post.objects.filter(user=profile_user, is_private=False).order_by('-created_at')
-    
-    # Add liked status for each post
-    for post in posts:
-        post.user_has_liked = post.is_liked_by(request.user)
+    # Like/comment counts, liked status and author come from the same query
+    posts, next_cursor = paginate_for_page(
+        request,
+        Post.objects.for_profile(profile_user, request.user).with_activity(request.user)
+    )
     
     # Check if current user is following this profile user
     is_following = request.user.is_following(profile_user)
@@ -611,33 +589,20 @@ def user_profile(request, user_id):
     spotify_data = None
     if profile_user.spotify_access_token:
         try:
-            # Create SpotifyOAuth instance for token refresh
-            sp_oauth = SpotifyOAuth(
-                client_id=settings.SPOTIFY_CLIENT_ID,
-                client_secret=settings.SPOTIFY_CLIENT_SECRET,
-                redirect_uri=settings.SPOTIFY_REDIRECT_URI,
-                scope=settings.SPOTIFY_SCOPES
-            )
-            
-            # Try to refresh the token if refresh token exists
-            if profile_user.spotify_refresh_token:
-                try:
-                    token_info = sp_oauth.refresh_access_token(profile_user.spotify_refresh_token)
-                    if token_info:
-                        profile_user.spotify_access_token = token_info['access_token']
-                        profile_user.save()
-                        logger.info(f"Refreshed access token for user {profile_user.username}")
-                except Exception as refresh_error:
-                    logger.error(f"Token refresh failed for {profile_user.username}: {str(refresh_error)}")
-            
-            sp = spotipy.Spotify(auth=profile_user.spotify_access_token)
-            spotify_data = sp.current_user()
+            # Usually cached. Someone else's profile works without it, so a
+            # cache miss is the first call dropped near Spotify's rate limit
+            spotify_data = spotify_profile.get_current_user(profile_user, ratelimit.LOW)
+        except SpotifyTokenError as refresh_error:
+            logger.error(f"Token refresh failed for {profile_user.username}: {str(refresh_error)}")
+        except ratelimit.SpotifyRateLimited:
+            pass
         except Exception as e:
             logger.error(f"Error fetching Spotify data for user {profile_user.username}: {str(e)}")
     
     return render(request, 'social/user_profile.html', {
         'profile_user': profile_user,
         'posts': posts,
+        'next_cursor': next_cursor,
         'is_following': is_following,
         'spotify_data': spotify_data
     })
@@ -665,6 +630,7 @@ def like_post(request, post_id):
             liked = True
             message = 'Post liked'
         
+        post.refresh_from_db(fields=['like_count'])
         return JsonResponse({
             'success': True,
             'liked': liked,
@@ -712,18 +678,12 @@ def add_comment(request, post_id):
             content=content,
             parent=parent
         )
+        post.refresh_from_db(fields=['comment_count'])
         
         return JsonResponse({
             'success': True,
             'message': 'Comment added successfully',
-            'comment': {
-                'id': comment.id,
-                'content': comment.content,
-                'user': comment.user.username,
-                'created_at': comment.created_at.strftime('%Y-%m-%d %H:%M'),
-                'is_reply': comment.is_reply(),
-                'parent_id': comment.parent.id if comment.parent else None
-            },
+            'comment': serialize_comment(comment),
             'comment_count': post.get_comment_count()
         })
         
@@ -734,46 +694,68 @@ def add_comment(request, post_id):
             'message': 'Error adding comment'
         })
 
+def serialize_comment(comment):
+    """JSON representation of a comment, without its replies"""
+    return {
+        'id': comment.id,
+        'content': comment.content,
+        'user': comment.user.username,
+        'created_at': comment.created_at.strftime('%Y-%m-%d %H:%M'),
+        'is_reply': comment.is_reply(),
+        'parent_id': comment.parent_id,
+        'root_id': comment.root_id
+    }
+
+def reply_previews(root_ids, limit):
+    """The first ``limit`` replies of each thread, in one query, keyed by root id"""
+    replies = Comment.objects.filter(root_id__in=root_ids).annotate(
+        position=Window(RowNumber(), partition_by=[F('root_id')], order_by=[F('created_at').asc(), F('id').asc()])
+    ).filter(position__lte=limit).select_related('user').order_by('root_id', 'created_at', 'id')
+    
+    previews = {root_id: [] for root_id in root_ids}
+    for reply in replies:
+        previews[reply.root_id].append(reply)
+    return previews
+
 @login_required
 def get_comments(request, post_id):
-    """Get comments for a post"""
+    """Get a page of top-level comments for a post, each with its first few replies"""
     try:
         post = get_object_or_404(Post, id=post_id)
         
-        # Get all comments for the post (top-level comments and replies)
-        comments = Comment.objects.filter(post=post).select_related('user', 'parent')
+        # One range scan for the page of top-level comments...
+        try:
+            comments, next_cursor = paginate_comments(
+                Comment.objects.filter(post=post, root__isnull=True).select_related('user'),
+                request.GET.get('cursor'),
+                get_page_size(request, settings.SOCIAL_COMMENTS_PAGE_SIZE)
+            )
+        except InvalidCursor:
+            return JsonResponse({
+                'success': False,
+                'message': 'Invalid cursor'
+            }, status=400)
+        
+        # ...and one for the first replies of every thread on it
+        preview_size = settings.SOCIAL_COMMENT_REPLIES_PREVIEW
+        previews = reply_previews([comment.id for comment in comments], preview_size)
         
-        # Organize comments into a tree structure
         comment_tree = []
-        comment_dict = {}
-        
-        # First pass: create all comment objects
-        for comment in comments:
-            comment_data = {
-                'id': comment.id,
-                'content': comment.content,
-                'user': comment.user.username,
-                'created_at': comment.created_at.strftime('%Y-%m-%d %H:%M'),
-                'is_reply': comment.is_reply(),
-                'parent_id': comment.parent.id if comment.parent else None,
-                'replies': []
-            }
-            comment_dict[comment.id] = comment_data
-        
-        # Second pass: organize into tree structure
         for comment in comments:
-            comment_data = comment_dict[comment.id]
-            if comment.parent:
-                # This is a reply, add it to parent's replies
-                if comment.parent.id in comment_dict:
-                    comment_dict[comment.parent.id]['replies'].append(comment_data)
-            else:
-                # This is a top-level comment
-                comment_tree.append(comment_data)
+            replies = previews[comment.id]
+            comment_data = serialize_comment(comment)
+            comment_data['replies'] = [serialize_comment(reply) for reply in replies]
+            comment_data['reply_count'] = comment.reply_count
+            # Cursor for "load more replies", if the preview didn't show them all
+            comment_data['replies_cursor'] = (
+                encode_cursor(replies[-1]) if comment.reply_count > len(replies) and replies else None
+            )
+            comment_tree.append(comment_data)
         
         return JsonResponse({
             'success': True,
             'comments': comment_tree,
+            'next_cursor': next_cursor,
             'comment_count': post.get_comment_count()
         })
         
@@ -783,3 +765,26 @@ def get_comments(request, post_id):
             'success': False,
             'message': 'Error fetching comments'
         })
+
+@login_required
+def get_replies(request, comment_id):
+    """Get the next page of replies in a comment thread"""
+    root = get_object_or_404(Comment, id=comment_id, root__isnull=True)
+    
+    try:
+        replies, next_cursor = paginate_comments(
+            Comment.objects.filter(root=root).select_related('user'),
+            request.GET.get('cursor'),
+            get_page_size(request, settings.SOCIAL_COMMENTS_PAGE_SIZE)
+        )
+    except InvalidCursor:
+        return JsonResponse({
+            'success': False,
+            'message': 'Invalid cursor'
+        }, status=400)
+    
+    return JsonResponse({
+        'success': True,
+        'replies': [serialize_comment(reply) for reply in replies],
+        'next_cursor': next_cursor
+    })
@@ -0,0 +1,95 @@
+"""
+Album track listings, cached for everyone.
+
+An album's tracks practically never change, so a listing fetched for one
+user is served to all of them for SPOTIFY_ALBUM_TRACKS_TTL seconds. There
+are two levels: a small in-process LRU of SPOTIFY_ALBUM_TRACKS_LOCAL_MAX
+albums in front of the 'spotify' cache, so popular albums don't even cost a
+cache round trip. Albums with more tracks than fit in one page are read
+page by page, the pages after the first concurrently.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import ratelimit
+from .cache import get_or_fetch, make_key
+from .client import call_spotify, call_spotify_concurrently
+
+# Spotify's maximum page size for album tracks
+ALBUM_TRACKS_PAGE_LIMIT = 50
+
+_lock = threading.Lock()
+# album_id -> (expires_at, tracks), least recently used first
+_local = OrderedDict()
+
+
+def _page_fetcher(album_id, offset):
+    return lambda sp: sp.album_tracks(album_id, limit=ALBUM_TRACKS_PAGE_LIMIT, offset=offset)
+
+
+def _serialize_track(track):
+    return {
+        'id': track['id'],
+        'uri': track['uri'],
+        'name': track['name'],
+        'artists': [{'id': artist.get('id'), 'name': artist['name']} for artist in track.get('artists', [])],
+        'disc_number': track.get('disc_number'),
+        'track_number': track.get('track_number'),
+        'duration_ms': track.get('duration_ms'),
+        'preview_url': track.get('preview_url'),
+        'spotify_url': track.get('external_urls', {}).get('spotify', ''),
+    }
+
+
+def _fetch(user, album_id, priority):
+    first = call_spotify(user, _page_fetcher(album_id, 0), priority)
+    items = list(first['items'])
+    offsets = range(ALBUM_TRACKS_PAGE_LIMIT, first['total'], ALBUM_TRACKS_PAGE_LIMIT)
+    if offsets:
+        pages = call_spotify_concurrently(user, [_page_fetcher(album_id, offset) for offset in offsets], priority)
+        for page in pages:
+            items += page['items']
+    return [_serialize_track(track) for track in items if track]
+
+
+def _get_local(album_id):
+    with _lock:
+        entry = _local.get(album_id)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del _local[album_id]
+            return None
+        _local.move_to_end(album_id)
+        return entry[1]
+
+
+def _set_local(album_id, tracks):
+    with _lock:
+        _local[album_id] = (time.monotonic() + settings.SPOTIFY_ALBUM_TRACKS_TTL, tracks)
+        _local.move_to_end(album_id)
+        while len(_local) > settings.SPOTIFY_ALBUM_TRACKS_LOCAL_MAX:
+            _local.popitem(last=False)
+
+
+def get_album_tracks(user, album_id, priority=ratelimit.NORMAL):
+    """All of an album's tracks in order, fetched with the user's token if nobody has yet"""
+    tracks = _get_local(album_id)
+    if tracks is None:
+        tracks = get_or_fetch(
+            make_key('album_tracks', album_id),
+            lambda: _fetch(user, album_id, priority),
+            settings.SPOTIFY_ALBUM_TRACKS_TTL
+        )
+        _set_local(album_id, tracks)
+    return tracks
+
+
+def reset():
+    """Empty this process's LRU (tests)"""
+    with _lock:
+        _local.clear()
@@ -0,0 +1,125 @@
+"""
+Circuit breaker for the Spotify Web API.
+
+When Spotify is down or very slow every call would otherwise wait out its
+timeout and tie up a worker. After SPOTIFY_BREAKER_FAILURE_THRESHOLD
+consecutive failures (timeouts, connection errors, 5xx) the breaker opens
+and calls fail straight away with SpotifyUnavailable. After
+SPOTIFY_BREAKER_COOLDOWN seconds a single trial call is let through: if it
+succeeds the breaker closes again, if not it stays open for another cooldown.
+
+State is kept per process, like the rate limit buckets.
+"""
+
+import logging
+import math
+import threading
+import time
+
+import requests
+from django.conf import settings
+from spotipy.exceptions import SpotifyException
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+_lock = threading.Lock()
+_state = CLOSED
+_failures = 0
+_opened_at = 0.0
+
+
+class SpotifyUnavailable(SpotifyException):
+    """Raised instead of calling Spotify while the circuit breaker is open"""
+
+    def __init__(self, retry_after):
+        super().__init__(
+            503,
+            -1,
+            f"Spotify call not sent: Spotify looks unavailable, retry in {retry_after:.1f}s",
+            reason='circuit open',
+            headers={'Retry-After': str(math.ceil(retry_after))}
+        )
+        self.retry_after = retry_after
+
+
+def is_outage(error):
+    """Whether an exception from a Spotify call means Spotify itself is failing"""
+    if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return True
+    if isinstance(error, SpotifyException):
+        # spotipy reports exhausted 5xx retries as a 429 without headers
+        # (which it stores as {}), real 429s always carry Retry-After
+        return error.http_status >= 500 or (error.http_status == 429 and not error.headers)
+    return False
+
+
+def _cooldown_left():
+    return max(_opened_at + settings.SPOTIFY_BREAKER_COOLDOWN - time.monotonic(), 0)
+
+
+def check():
+    """Raise SpotifyUnavailable if the breaker is open and still cooling down"""
+    if _state != CLOSED:
+        with _lock:
+            if _state == OPEN and _cooldown_left():
+                raise SpotifyUnavailable(_cooldown_left())
+
+
+def before_call():
+    """
+    Let a call through, or raise SpotifyUnavailable.
+
+    Every call let through must be followed by record_result().
+    """
+    global _state
+    with _lock:
+        if _state == CLOSED:
+            return
+        if _state == OPEN and not _cooldown_left():
+            _state = HALF_OPEN
+            logger.info("Spotify circuit breaker half open, sending a trial call")
+            return
+        # Open and cooling down, or a trial call is already in flight
+        raise SpotifyUnavailable(_cooldown_left() or 1)
+
+
+def record_result(ok):
+    """Record how a call let through by before_call() went"""
+    global _state, _failures, _opened_at
+    with _lock:
+        if ok:
+            if _state != CLOSED:
+                logger.info("Spotify circuit breaker closed")
+            _state = CLOSED
+            _failures = 0
+            return
+
+        _failures += 1
+        if _state == HALF_OPEN or _failures >= settings.SPOTIFY_BREAKER_FAILURE_THRESHOLD:
+            if _state != OPEN:
+                logger.warning(f"Spotify circuit breaker opened after {_failures} failures")
+            _state = OPEN
+            _opened_at = time.monotonic()
+
+
+def metrics():
+    """Breaker state for this process"""
+    with _lock:
+        return {
+            'state': _state,
+            'failures': _failures,
+            'retry_after': round(_cooldown_left(), 2) if _state == OPEN else 0,
+        }
+
+
+def reset():
+    """Close the breaker (tests)"""
+    global _state, _failures, _opened_at
+    with _lock:
+        _state = CLOSED
+        _failures = 0
+        _opened_at = 0.0
@@ -0,0 +1,85 @@
+"""
+Shared cache for data fetched from Spotify.
+
+Backed by the 'spotify' alias in CACHES, so it is local memory in development
+and can point at a shared store (e.g. Redis) in production. Lookups go
+through get_or_fetch(), which coalesces concurrent misses for the same key
+so only one caller actually goes upstream.
+"""
+
+import hashlib
+import threading
+import time
+import weakref
+
+from django.core.cache import caches
+
+# How long a fetch may hold the cross-process lock before others give up waiting
+FETCH_LOCK_TIMEOUT = 10
+FETCH_POLL_INTERVAL = 0.05
+
+_key_locks = weakref.WeakValueDictionary()
+_key_locks_guard = threading.Lock()
+
+
+def get_cache():
+    return caches['spotify']
+
+
+def make_key(prefix, *parts):
+    """Build a cache key that is safe for every backend, whatever the parts contain"""
+    digest = hashlib.sha1('\x1f'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return f'spotify:{prefix}:{digest}'
+
+
+def _get_key_lock(key):
+    with _key_locks_guard:
+        lock = _key_locks.get(key)
+        if lock is None:
+            lock = threading.Lock()
+            _key_locks[key] = lock
+        return lock
+
+
+def get_or_fetch(key, fetch, timeout):
+    """
+    Return the cached value for key, calling fetch() on a miss.
+
+    Concurrent misses for the same key are coalesced: threads in this process
+    wait on a per-key lock, other processes wait on a lock entry in the cache,
+    and all of them pick up the value stored by the single caller that fetched.
+    fetch() must not return None, which is how misses are detected.
+    """
+    cache = get_cache()
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    with _get_key_lock(key):
+        value = cache.get(key)
+        if value is not None:
+            return value
+
+        lock_key = f'{key}:lock'
+        if cache.add(lock_key, 1, FETCH_LOCK_TIMEOUT):
+            try:
+                value = fetch()
+                cache.set(key, value, timeout)
+            finally:
+                cache.delete(lock_key)
+            return value
+
+        # Another process is fetching the same key, wait for its result
+        deadline = time.monotonic() + FETCH_LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(FETCH_POLL_INTERVAL)
+            value = cache.get(key)
+            if value is not None:
+                return value
+            if cache.get(lock_key) is None:
+                break
+
+    # The other fetch failed or timed out, don't leave the caller empty handed
+    value = fetch()
+    cache.set(key, value, timeout)
+    return value
@@ -0,0 +1,195 @@
+"""
+Local catalog of tracks, albums and artists.
+
+Posts and ratings reference Track and Album rows instead of each carrying
+their own copy of names, artwork and links. The catalog is filled from three
+places: items users post, tracks they rate, and every Spotify search response.
+Search responses are authoritative, overwrite what is stored and mark the
+row verified; posts only add items the catalog hasn't seen yet, with what
+the client sent, and ratings add bare names.
+
+Because the catalog grows with what users actually search and post about,
+most searches can be answered from it without calling Spotify at all (see
+search_local and spotify.search.cached_search). Only verified rows are
+used for that, so one user's post can't change what others find.
+"""
+
+import logging
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db.models import F, Q
+
+from .models import Album, Artist, Track
+
+logger = logging.getLogger(__name__)
+
+TRACK_FIELDS = ['name', 'artist_name', 'album', 'image_url', 'preview_url', 'spotify_url', 'popularity', 'verified']
+ALBUM_FIELDS = ['name', 'artist_name', 'image_url', 'spotify_url', 'release_date', 'verified']
+ARTIST_FIELDS = ['name', 'image_url', 'spotify_url', 'follower_total', 'popularity']
+
+
+def _artist_names(item):
+    return ', '.join(artist.get('name') or '' for artist in item.get('artists') or [] if artist)
+
+
+def _image_url(item):
+    images = item.get('images') or []
+    return (images[0] or {}).get('url', '') if images else ''
+
+
+def _spotify_url(item):
+    return (item.get('external_urls') or {}).get('spotify', '')
+
+
+def https_url(url, host=None):
+    """The URL if it is https (on ``host``, if given), otherwise ''"""
+    try:
+        parts = urlsplit(url or '')
+    except ValueError:
+        return ''
+    if parts.scheme != 'https' or not parts.hostname or (host and parts.hostname != host):
+        return ''
+    return url
+
+
+def remember_item(item_type, spotify_id, name, artist_name, image_url='', preview_url=None, spotify_url=''):
+    """
+    Return the catalog row for a posted item, creating it if it is new.
+
+    Album posts get an Album, anything else a Track. The values come from
+    the client, so links that aren't https (or not on open.spotify.com) are
+    dropped, and existing rows are never overwritten: verified ones are left
+    alone, others only get blank fields filled in.
+    """
+    model = Album if item_type == 'album' else Track
+    defaults = {
+        'name': name or '',
+        'artist_name': artist_name or '',
+        'image_url': https_url(image_url),
+        'spotify_url': https_url(spotify_url, 'open.spotify.com'),
+    }
+    if model is Track:
+        defaults['preview_url'] = https_url(preview_url) or None
+
+    item, created = model.objects.get_or_create(id=spotify_id, defaults=defaults)
+    if not created and not item.verified:
+        missing = [field for field, value in defaults.items() if value and not getattr(item, field)]
+        if missing:
+            for field in missing:
+                setattr(item, field, defaults[field])
+            item.save(update_fields=missing + ['updated_at'])
+    return item
+
+
+def _with_ids(items):
+    # Spotify returns null for unavailable items and no id for local files
+    return [item for item in items or [] if item and item.get('id')]
+
+
+def remember_search_results(results):
+    """Upsert the tracks, albums and artists from a search_catalog() response"""
+    # Keyed by id: a row may appear twice in one response, and an upsert
+    # can't touch the same row twice in one statement
+    albums = {}
+    tracks = {}
+    for track in _with_ids(results.get('tracks')):
+        album = track.get('album') or {}
+        if album.get('id'):
+            albums[album['id']] = Album(
+                id=album['id'],
+                name=album.get('name') or '',
+                artist_name=_artist_names(album),
+                image_url=_image_url(album),
+                spotify_url=_spotify_url(album),
+                release_date=album.get('release_date') or '',
+                verified=True
+            )
+        tracks[track['id']] = Track(
+            id=track['id'],
+            name=track.get('name') or '',
+            artist_name=_artist_names(track),
+            album_id=album.get('id'),
+            image_url=_image_url(album),
+            preview_url=track.get('preview_url'),
+            spotify_url=_spotify_url(track),
+            popularity=track.get('popularity'),
+            verified=True
+        )
+    for album in _with_ids(results.get('albums')):
+        albums[album['id']] = Album(
+            id=album['id'],
+            name=album.get('name') or '',
+            artist_name=_artist_names(album),
+            image_url=_image_url(album),
+            spotify_url=_spotify_url(album),
+            release_date=album.get('release_date') or '',
+            verified=True
+        )
+    artists = {
+        artist['id']: Artist(
+            id=artist['id'],
+            name=artist.get('name') or '',
+            image_url=_image_url(artist),
+            spotify_url=_spotify_url(artist),
+            follower_total=(artist.get('followers') or {}).get('total'),
+            popularity=artist.get('popularity')
+        )
+        for artist in _with_ids(results.get('artists'))
+    }
+
+    # Albums first, tracks point at them
+    for model, rows, fields in (
+        (Album, albums, ALBUM_FIELDS),
+        (Track, tracks, TRACK_FIELDS),
+        (Artist, artists, ARTIST_FIELDS),
+    ):
+        if rows:
+            model.objects.bulk_create(
+                rows.values(),
+                update_conflicts=True,
+                unique_fields=['id'],
+                update_fields=fields + ['updated_at']
+            )
+
+
+def _match(query, fields):
+    """Every word of the query must appear in one of the fields"""
+    condition = Q()
+    for word in query.split():
+        word_condition = Q()
+        for field in fields:
+            word_condition |= Q(**{f'{field}__icontains': word})
+        condition &= word_condition
+    return condition
+
+
+def search_local(query, types, limit=10):
+    """
+    Answer a search from the local catalog.
+
+    Returns results shaped like search_catalog(), or None when the catalog
+    has fewer than SPOTIFY_SEARCH_LOCAL_MIN_RESULTS matches for any of the
+    requested types - the caller should ask Spotify then.
+    """
+    needed = min(limit, settings.SPOTIFY_SEARCH_LOCAL_MIN_RESULTS)
+    querysets = {
+        'track': Track.objects.select_related('album').filter(
+            _match(query, ['name', 'artist_name']), verified=True
+        ).order_by(F('popularity').desc(nulls_last=True), 'name'),
+        'album': Album.objects.filter(
+            _match(query, ['name', 'artist_name']), verified=True
+        ).order_by('-release_date', 'name'),
+        'artist': Artist.objects.filter(
+            _match(query, ['name'])
+        ).order_by(F('popularity').desc(nulls_last=True), 'name'),
+    }
+
+    results = {}
+    for search_type in types:
+        items = list(querysets[search_type][:limit])
+        if len(items) < needed:
+            return None
+        results[f'{search_type}s'] = [item.as_search_result() for item in items]
+    logger.debug(f"Answered search '{query}' from the local catalog")
+    return results
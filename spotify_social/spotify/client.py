@@ -0,0 +1,217 @@
+"""
+Process-wide Spotify Web API client factory.
+
+All views get their spotipy client from here. Clients share a single
+requests session, so outbound calls reuse pooled keep-alive connections
+instead of paying for a new TLS handshake every time. Every call also goes
+through the rate limiter in spotify.ratelimit and the circuit breaker in
+spotify.breaker, with a timeout chosen per endpoint
+(SPOTIFY_HTTP_ENDPOINT_TIMEOUTS).
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import spotipy
+import urllib3
+from django.conf import settings
+from spotipy.exceptions import SpotifyException
+from spotipy.oauth2 import SpotifyOAuth
+
+from . import breaker, ratelimit
+
+_session = None
+_session_lock = threading.Lock()
+_executor = None
+
+
+class PooledSpotify(spotipy.Spotify):
+    """spotipy client that borrows the shared session instead of owning one"""
+
+    def __init__(self, *args, user_id=None, priority=ratelimit.NORMAL, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user_id = user_id
+        self.priority = priority
+
+    def __del__(self):
+        # spotipy closes its session when the client is collected, which would
+        # drop every pooled connection for the whole process
+        pass
+
+    def _internal_call(self, method, url, payload, params):
+        # Clients aren't shared between threads, so the timeout can be set per call
+        self.requests_timeout = endpoint_timeout(url)
+
+        # A 429 pauses calls for Retry-After (see ratelimit); NORMAL calls then
+        # wait their turn and retry once, LOW calls give up straight away
+        retries = 0 if self.priority == ratelimit.LOW else 1
+        while True:
+            breaker.check()
+            ratelimit.acquire(self.user_id, self.priority)
+            try:
+                return self._send(method, url, payload, params)
+            except SpotifyException as e:
+                # spotipy also reports exhausted 5xx retries as a 429, without headers
+                if e.http_status != 429 or not e.headers:
+                    raise
+                ratelimit.record_throttled(e.headers)
+                if not retries:
+                    raise
+                retries -= 1
+
+    def _send(self, method, url, payload, params):
+        breaker.before_call()
+        try:
+            result = super()._internal_call(method, url, payload, params)
+        except Exception as e:
+            breaker.record_result(not breaker.is_outage(e))
+            raise
+        breaker.record_result(True)
+        return result
+
+
+class PooledSpotifyOAuth(SpotifyOAuth):
+    """SpotifyOAuth that borrows the shared session instead of owning one"""
+
+    def __del__(self):
+        pass
+
+
+def endpoint_timeout(url):
+    """Timeout for a Web API URL: the longest matching SPOTIFY_HTTP_ENDPOINT_TIMEOUTS prefix, or the default"""
+    path = url.split('/v1/', 1)[-1].split('?', 1)[0]
+    best = None
+    for prefix in settings.SPOTIFY_HTTP_ENDPOINT_TIMEOUTS:
+        if (path == prefix or path.startswith(prefix + '/')) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    if best is None:
+        return settings.SPOTIFY_HTTP_TIMEOUT
+    return settings.SPOTIFY_HTTP_ENDPOINT_TIMEOUTS[best]
+
+
+def _build_session():
+    session = requests.Session()
+    retry = urllib3.Retry(
+        total=settings.SPOTIFY_HTTP_RETRIES,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+        status=settings.SPOTIFY_HTTP_RETRIES,
+        backoff_factor=0.3,
+        # 429s are left to the rate limiter (PooledSpotify._internal_call)
+        # instead of sleeping on them inside this request. urllib3 retries any
+        # response with a Retry-After header, whatever the forcelist says, and
+        # Spotify always sends one with a 429
+        status_forcelist=[code for code in spotipy.Spotify.default_retry_codes if code != 429],
+        respect_retry_after_header=False
+    )
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=settings.SPOTIFY_HTTP_POOL_CONNECTIONS,
+        pool_maxsize=settings.SPOTIFY_HTTP_POOL_SIZE,
+        max_retries=retry
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    """Return the requests session shared by every Spotify call in this process"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def spotify_client(access_token, user=None, priority=ratelimit.NORMAL):
+    """
+    Create a Spotify client for an access token, using the shared connection pool.
+
+    Calls count against the user's rate limit budget as well as the app's
+    when the user is given.
+    """
+    return PooledSpotify(
+        auth=access_token,
+        requests_session=get_session(),
+        requests_timeout=settings.SPOTIFY_HTTP_TIMEOUT,
+        user_id=user.pk if user is not None else None,
+        priority=priority
+    )
+
+
+def get_client(user, priority=ratelimit.NORMAL):
+    """Create a Spotify client for a user, refreshing their token only if needed"""
+    from .tokens import get_access_token
+    return spotify_client(get_access_token(user), user, priority)
+
+
+def call_spotify(user, func, priority=ratelimit.NORMAL):
+    """
+    Call func(sp) with the user's client.
+
+    If Spotify rejects the token anyway (revoked, clock skew) it is refreshed
+    once and the call retried, so views don't need to probe the token first.
+    """
+    from .tokens import refresh_access_token
+    try:
+        return func(get_client(user, priority))
+    except SpotifyException as e:
+        if e.http_status != 401:
+            raise
+    refresh_access_token(user, force=True)
+    return func(get_client(user, priority))
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _session_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.SPOTIFY_HTTP_CONCURRENCY,
+                    thread_name_prefix='spotify'
+                )
+    return _executor
+
+
+def call_spotify_in_background(user, func, priority=ratelimit.LOW):
+    """
+    Start func(sp) on the shared executor and return its Future without waiting.
+
+    As with call_spotify_concurrently(), the token is looked up here so the
+    worker thread only talks to Spotify.
+    """
+    from .tokens import get_access_token
+    access_token = get_access_token(user)
+    return _get_executor().submit(lambda: func(spotify_client(access_token, user, priority)))
+
+
+def call_spotify_concurrently(user, funcs, priority=ratelimit.NORMAL):
+    """
+    Call several independent func(sp) at once with the user's token, returning their results in order.
+
+    The token is looked up (and refreshed if needed) here, so the worker
+    threads only talk to Spotify, never to the database. Like call_spotify(),
+    a rejected token is refreshed once and the calls retried. The first
+    error raised by any call is re-raised.
+    """
+    from .tokens import get_access_token, refresh_access_token
+    if len(funcs) == 1:
+        return [call_spotify(user, funcs[0], priority)]
+
+    access_token = get_access_token(user)
+    for attempt in range(2):
+        # Each call gets its own client, clients aren't thread safe
+        futures = [
+            _get_executor().submit(lambda func=func: func(spotify_client(access_token, user, priority)))
+            for func in funcs
+        ]
+        try:
+            return [future.result() for future in futures]
+        except SpotifyException as e:
+            if e.http_status != 401 or attempt:
+                raise
+        access_token = refresh_access_token(user, force=True)
@@ -0,0 +1,129 @@
+"""
+Background jobs for Spotify side effects that views used to do inline.
+
+Each handler reloads what it needs from the database and is safe to run
+again: a retried or re-enqueued job checks what already happened first.
+"""
+
+import logging
+
+from django.db import transaction
+from spotipy.exceptions import SpotifyException
+
+from core.jobs import PermanentJobError, handler
+from core.models import Job, User
+from social import timeline
+from social.models import Post
+from . import catalog, client, listen_later, ratelimit
+
+logger = logging.getLogger(__name__)
+
+
+def call_spotify(user, func):
+    # Nobody is waiting on a job, so its calls go last; a shed call is
+    # retried once the rate limit allows
+    return client.call_spotify(user, func, priority=ratelimit.LOW)
+
+
+def _job_user(job):
+    user = User.objects.filter(pk=job.user_id).first()
+    if user is None or not user.spotify_access_token:
+        raise PermanentJobError("User is gone or has disconnected Spotify")
+    return user
+
+
+def _not_found(e):
+    return isinstance(e, SpotifyException) and e.http_status in (400, 404)
+
+
+@handler('spotify.create_listen_later_playlist')
+def create_listen_later_playlist(job):
+    """Create the user's "listen later" playlist, once"""
+    user = _job_user(job)
+    if user.listen_later:
+        return {'playlist_id': user.listen_later, 'created': False}
+
+    playlist = call_spotify(user, lambda sp: sp.user_playlist_create(
+        user=user.spotify_id,
+        name="listen later",
+        public=True,
+        description="made for pmo"
+    ))
+    user.listen_later = playlist['id']
+    user.save(update_fields=['listen_later'])
+    # A new playlist is empty, so is the mirror
+    listen_later.mark_synced(user, playlist.get('snapshot_id'))
+    return {'playlist_id': playlist['id'], 'created': True}
+
+
+@handler('spotify.post_rating')
+def post_rating(job):
+    """Create the feed post announcing a track rating"""
+    user = _job_user(job)
+    track_id = job.payload['track_id']
+    rating = job.payload['rating']
+
+    # The post is recorded on the job as it is created, so a retry (say
+    # after fan-out failed) finds it instead of posting twice. Other posts
+    # about the track, like a "now playing" post, don't count
+    post = Post.objects.filter(pk=(job.result or {}).get('post_id'), user=user).first()
+    if post is None:
+        try:
+            track = call_spotify(user, lambda sp: sp.track(track_id))
+        except SpotifyException as e:
+            if _not_found(e):
+                raise PermanentJobError(f"Unknown track {track_id}") from e
+            raise
+        catalog.remember_search_results({'tracks': [track]})
+
+        with transaction.atomic():
+            post = Post.objects.create(
+                user=user,
+                post_type='track',  # Changed from 'rating' to 'track' to enable queue functionality
+                content=f"Rated this song {rating}/5 stars!",
+                spotify_id=track_id,
+                track_id=track_id
+            )
+            Job.objects.filter(pk=job.pk).update(result={'post_id': post.id})
+
+    timeline.fan_out_post(post)
+    return {'post_id': post.id, 'created': True}
+
+
+@handler('spotify.add_to_listen_later')
+def add_to_listen_later(job):
+    """Add a track to the user's "listen later" playlist unless it is already there"""
+    user = _job_user(job)
+    spotify_uri = job.payload['spotify_uri']
+    if not user.listen_later:
+        # The playlist is created by its own job at signup, try again later
+        raise RuntimeError("Listen Later playlist has not been created yet")
+
+    result = listen_later.add_tracks(user, [spotify_uri], priority=ratelimit.LOW)[spotify_uri]
+    if result in (listen_later.INVALID, listen_later.NOT_FOUND):
+        raise PermanentJobError("Invalid track")
+    if result == listen_later.DUPLICATE:
+        return {'added': False, 'message': 'Track is already in your Listen Later playlist'}
+    return {'added': True, 'message': 'Track added to Listen Later playlist!'}
+
+
+@handler('spotify.add_many_to_listen_later')
+def add_many_to_listen_later(job):
+    """Add a list of tracks to the user's "listen later" playlist, skipping ones already there"""
+    user = _job_user(job)
+    if not user.listen_later:
+        raise RuntimeError("Listen Later playlist has not been created yet")
+
+    # A retry after a partial failure finds the added tracks in the mirror
+    # and reports them as duplicates
+    results = listen_later.add_tracks(user, job.payload['spotify_uris'], priority=ratelimit.LOW)
+    return {'results': [{'uri': uri, 'result': result} for uri, result in results.items()]}
+
+
+@handler('spotify.reconcile_listen_later')
+def reconcile_listen_later(job):
+    """Bring the user's listen later mirror in line with Spotify"""
+    user = _job_user(job)
+    if not user.listen_later:
+        return {'rebuilt': False}
+    return {'rebuilt': listen_later.reconcile(user, priority=ratelimit.LOW)}
@@ -0,0 +1,264 @@
+"""
+Local mirror of each user's "listen later" playlist.
+
+ListenLaterItem rows mirror the playlist, so duplicate checks and the listen
+later page never need Spotify. Adds and removes made through this app update
+the mirror as they happen. Changes made elsewhere (in the Spotify apps) are
+picked up by reconcile(), which compares the playlist's snapshot_id with the
+one the mirror was built from and only re-reads the playlist when they
+differ. It runs before each write, from the reconcile_listen_later command,
+and in the background when the page is viewed and the last check is older
+than SPOTIFY_LISTEN_LATER_RECONCILE_INTERVAL.
+
+Re-reading asks only for the fields the mirror needs, and once the first
+page says how long the playlist is, the remaining pages are fetched
+SPOTIFY_LISTEN_LATER_FETCH_CONCURRENCY at a time.
+
+Adds and removes take lists of URIs and are sent in batches of 100, the most
+Spotify accepts per call, so saving a whole album is a couple of calls.
+"""
+
+import logging
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.models import User
+from . import catalog, ratelimit
+from .client import call_spotify, call_spotify_concurrently
+from .models import ListenLaterItem, Track
+
+logger = logging.getLogger(__name__)
+
+# Spotify's maximum page size for playlist items, and the most items it
+# accepts per add or remove call
+PLAYLIST_PAGE_LIMIT = 100
+PLAYLIST_WRITE_LIMIT = 100
+# The most tracks sp.tracks() looks up at once
+TRACKS_LOOKUP_LIMIT = 50
+
+TRACK_URI_RE = re.compile(r'^spotify:track:[0-9A-Za-z]{22}$')
+
+# Per-track results of add_tracks() and remove_tracks()
+ADDED = 'added'
+DUPLICATE = 'duplicate'
+REMOVED = 'removed'
+NOT_IN_PLAYLIST = 'not_in_playlist'
+INVALID = 'invalid'
+NOT_FOUND = 'not_found'
+
+# Only what the mirror and the catalog need from each playlist item
+PLAYLIST_ITEM_FIELDS = (
+    'total,items(added_at,track(id,uri,type,name,is_local,popularity,preview_url,external_urls,'
+    'artists(name),album(id,name,release_date,images,external_urls,artists(name))))'
+)
+
+
+def contains(user, track_uri):
+    """Whether the track is in the user's playlist, according to the mirror"""
+    return ListenLaterItem.objects.filter(user=user, track_uri=track_uri).exists()
+
+
+def get_items(user):
+    """The mirrored playlist in playlist order, with catalog tracks attached"""
+    return ListenLaterItem.objects.filter(user=user).select_related('track')
+
+
+def get_page(user, after=None, page_size=None):
+    """
+    Return (items, next_cursor) for the page of the mirror after position ``after``.
+
+    next_cursor is the position to pass as ``after`` for the next page, or
+    None on the last page.
+    """
+    page_size = page_size or settings.SPOTIFY_LISTEN_LATER_PAGE_SIZE
+    items = get_items(user)
+    if after is not None:
+        items = items.filter(position__gt=after)
+
+    # Fetch one extra row to find out if there is another page
+    items = list(items[:page_size + 1])
+    next_cursor = items[page_size - 1].position if len(items) > page_size else None
+    return items[:page_size], next_cursor
+
+
+def is_stale(user):
+    """Whether the mirror is due a check against Spotify"""
+    if user.listen_later_synced_at is None:
+        return True
+    interval = timedelta(seconds=settings.SPOTIFY_LISTEN_LATER_RECONCILE_INTERVAL)
+    return user.listen_later_synced_at < timezone.now() - interval
+
+
+def mark_synced(user, snapshot_id):
+    """Record that the mirror matches this version of the playlist"""
+    user.listen_later_snapshot_id = snapshot_id or ''
+    user.listen_later_synced_at = timezone.now()
+    User.objects.filter(pk=user.pk).update(
+        listen_later_snapshot_id=user.listen_later_snapshot_id,
+        listen_later_synced_at=user.listen_later_synced_at
+    )
+
+
+def _page_fetcher(playlist_id, offset):
+    return lambda sp: sp.playlist_items(
+        playlist_id, fields=PLAYLIST_ITEM_FIELDS, limit=PLAYLIST_PAGE_LIMIT, offset=offset
+    )
+
+
+def _fetch_all_items(user, playlist_id):
+    # A rebuild shouldn't be dropped halfway, so pages are never LOW priority
+    first = call_spotify(user, _page_fetcher(playlist_id, 0))
+    items = list(first['items'])
+
+    offsets = list(range(PLAYLIST_PAGE_LIMIT, first['total'], PLAYLIST_PAGE_LIMIT))
+    window = settings.SPOTIFY_LISTEN_LATER_FETCH_CONCURRENCY
+    for start in range(0, len(offsets), window):
+        batch = [_page_fetcher(playlist_id, offset) for offset in offsets[start:start + window]]
+        for page in call_spotify_concurrently(user, batch):
+            items += page['items']
+    return items
+
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _is_catalog_track(track):
+    return track.get('type') == 'track' and track.get('id') and not track.get('is_local')
+
+
+def reconcile(user, force=False, priority=ratelimit.NORMAL):
+    """
+    Bring the mirror in line with the playlist on Spotify.
+
+    Costs one small request when the playlist hasn't changed since the last
+    sync, and re-reads every page of it otherwise (or when ``force``).
+    Returns whether the mirror was rebuilt.
+    """
+    playlist_id = user.listen_later
+    snapshot_id = call_spotify(
+        user, lambda sp: sp.playlist(playlist_id, fields='snapshot_id'), priority
+    )['snapshot_id']
+    if snapshot_id == user.listen_later_snapshot_id and not force:
+        mark_synced(user, snapshot_id)
+        return False
+
+    # If the playlist changes while this runs the stored snapshot is already
+    # behind, so the next reconcile reads it again
+    entries = _fetch_all_items(user, playlist_id)
+    tracks = [entry['track'] for entry in entries if entry.get('track') and _is_catalog_track(entry['track'])]
+    catalog.remember_search_results({'tracks': tracks})
+
+    items = {}
+    for position, entry in enumerate(entries):
+        track = entry.get('track')
+        # Removed tracks come back as null, and the mirror keeps one row per URI
+        if not track or not track.get('uri') or track['uri'] in items:
+            continue
+        items[track['uri']] = ListenLaterItem(
+            user=user,
+            track_uri=track['uri'],
+            track_id=track['id'] if _is_catalog_track(track) else None,
+            position=position,
+            added_at=parse_datetime(entry.get('added_at') or '') or timezone.now()
+        )
+
+    with transaction.atomic():
+        ListenLaterItem.objects.filter(user=user).delete()
+        ListenLaterItem.objects.bulk_create(items.values())
+        mark_synced(user, snapshot_id)
+    logger.info(f"Reconciled listen later playlist for {user.username}: {len(items)} items")
+    return True
+
+
+def check_tracks(user, track_uris):
+    """
+    Return {uri: result} for what the mirror can answer without Spotify:
+    INVALID, DUPLICATE, or None for tracks that still need adding.
+    """
+    results = {uri: None if TRACK_URI_RE.match(uri) else INVALID for uri in track_uris}
+    existing = ListenLaterItem.objects.filter(
+        user=user, track_uri__in=[uri for uri, result in results.items() if result is None]
+    ).values_list('track_uri', flat=True)
+    for uri in existing:
+        results[uri] = DUPLICATE
+    return results
+
+
+def add_tracks(user, track_uris, priority=ratelimit.NORMAL):
+    """
+    Add tracks to the playlist, skipping ones that are already there.
+
+    Returns {uri: result}, in the order given, with each result one of
+    ADDED, DUPLICATE, INVALID (not a track URI) or NOT_FOUND (no such track).
+    """
+    # Picks up changes made in the Spotify apps, so the duplicate check is right
+    reconcile(user, priority=priority)
+    results = check_tracks(user, track_uris)
+    candidates = [uri for uri, result in results.items() if result is None]
+
+    # Verify the tracks exist, unless the catalog already knows them
+    track_ids = {uri: uri.split(':')[-1] for uri in candidates}
+    known = set(Track.objects.filter(id__in=track_ids.values()).values_list('id', flat=True))
+    for batch in _chunks([track_id for track_id in track_ids.values() if track_id not in known], TRACKS_LOOKUP_LIMIT):
+        # Unknown IDs come back as null
+        tracks = [track for track in call_spotify(user, lambda sp: sp.tracks(batch), priority)['tracks'] if track]
+        catalog.remember_search_results({'tracks': tracks})
+        known.update(track['id'] for track in tracks)
+    for uri in candidates:
+        if track_ids[uri] not in known:
+            results[uri] = NOT_FOUND
+    candidates = [uri for uri in candidates if track_ids[uri] in known]
+
+    for batch in _chunks(candidates, PLAYLIST_WRITE_LIMIT):
+        result = call_spotify(
+            user, lambda sp: sp.playlist_add_items(playlist_id=user.listen_later, items=batch), priority
+        )
+        # Each batch is mirrored as soon as Spotify has it, so a failure
+        # halfway leaves the mirror matching the playlist
+        with transaction.atomic():
+            last = ListenLaterItem.objects.filter(user=user).aggregate(last=Max('position'))['last']
+            first = 0 if last is None else last + 1
+            ListenLaterItem.objects.bulk_create([
+                ListenLaterItem(
+                    user=user,
+                    track_uri=uri,
+                    track_id=track_ids[uri],
+                    position=first + offset,
+                    added_at=timezone.now()
+                )
+                for offset, uri in enumerate(batch)
+            ], ignore_conflicts=True)
+            mark_synced(user, result['snapshot_id'])
+        for uri in batch:
+            results[uri] = ADDED
+    return results
+
+
+def remove_tracks(user, track_uris, priority=ratelimit.NORMAL):
+    """
+    Remove every occurrence of the tracks from the playlist.
+
+    Returns {uri: result}, in the order given, with each result REMOVED or
+    NOT_IN_PLAYLIST.
+    """
+    reconcile(user, priority=priority)
+    present = set(
+        ListenLaterItem.objects.filter(user=user, track_uri__in=track_uris).values_list('track_uri', flat=True)
+    )
+    results = {uri: REMOVED if uri in present else NOT_IN_PLAYLIST for uri in track_uris}
+
+    for batch in _chunks([uri for uri in results if uri in present], PLAYLIST_WRITE_LIMIT):
+        result = call_spotify(
+            user, lambda sp: sp.playlist_remove_all_occurrences_of_items(user.listen_later, batch), priority
+        )
+        with transaction.atomic():
+            ListenLaterItem.objects.filter(user=user, track_uri__in=batch).delete()
+            mark_synced(user, result['snapshot_id'])
+    return results
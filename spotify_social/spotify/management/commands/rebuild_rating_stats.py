@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from spotify.models import TrackRatingStats
+
+STAT_FIELDS = ['rating_sum', 'rating_count'] + [f'bucket_{i}' for i in range(1, 11)]
+
+
+class Command(BaseCommand):
+    help = 'Rebuild TrackRatingStats from TrackRating and report any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only report drift, do not rebuild'
+        )
+
+    def handle(self, *args, **options):
+        computed = TrackRatingStats.compute_from_ratings()
+        stored = {stats.track_id: stats for stats in TrackRatingStats.objects.all()}
+
+        drifted = []
+        for track_id in computed.keys() | stored.keys():
+            expected = computed.get(track_id)
+            actual = stored.get(track_id)
+            if expected is None:
+                # Stats left behind for a track with no ratings are only drift if non-zero
+                if any(getattr(actual, field) for field in STAT_FIELDS):
+                    drifted.append(track_id)
+            elif actual is None or any(getattr(expected, field) != getattr(actual, field) for field in STAT_FIELDS):
+                drifted.append(track_id)
+
+        for track_id in sorted(drifted):
+            self.stdout.write(f'  Drift for track {track_id}')
+
+        if drifted:
+            self.stdout.write(self.style.WARNING(f'{len(drifted)} of {len(computed)} rated tracks have drifted.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'No drift found across {len(computed)} rated tracks.'))
+
+        if options['verify']:
+            return
+
+        count = TrackRatingStats.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating stats for {count} tracks.'))
@@ -0,0 +1,43 @@
+import logging
+
+from django.core.management.base import BaseCommand
+from core.models import User
+from spotify import listen_later
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Check listen later mirrors against Spotify and rebuild those whose playlist changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            action='append',
+            dest='usernames',
+            help='Only reconcile this user (can be repeated)'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Rebuild even when the playlist snapshot has not changed'
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(spotify_access_token__isnull=False, listen_later__isnull=False)
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+
+        checked = rebuilt = failed = 0
+        for user in users.iterator():
+            checked += 1
+            try:
+                if listen_later.reconcile(user, force=options['force']):
+                    rebuilt += 1
+            except Exception as e:
+                failed += 1
+                logger.error(f"Error reconciling listen later playlist for {user.username}: {str(e)}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Checked {checked} listen later playlists, rebuilt {rebuilt}, {failed} failed.'
+        ))
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.2 on 2026-10-18 19:10
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def populate_stats(apps, schema_editor):
+    TrackRating = apps.get_model("spotify", "TrackRating")
+    TrackRatingStats = apps.get_model("spotify", "TrackRatingStats")
+    buckets = {f"bucket_{i}": Count("id", filter=Q(rating__gte=i, rating__lt=i + 1)) for i in range(2, 10)}
+    buckets["bucket_1"] = Count("id", filter=Q(rating__lt=2))
+    buckets["bucket_10"] = Count("id", filter=Q(rating__gte=10))
+    rows = TrackRating.objects.order_by().values("track_id").annotate(
+        rating_sum=Sum("rating"), rating_count=Count("id"), **buckets
+    )
+    TrackRatingStats.objects.bulk_create([TrackRatingStats(**row) for row in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spotify", "0002_alter_trackrating_rating"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TrackRatingStats",
+            fields=[
+                ("track_id", models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ("rating_sum", models.DecimalField(decimal_places=1, default=0, max_digits=12)),
+                ("rating_count", models.IntegerField(default=0)),
+                ("bucket_1", models.IntegerField(default=0)),
+                ("bucket_2", models.IntegerField(default=0)),
+                ("bucket_3", models.IntegerField(default=0)),
+                ("bucket_4", models.IntegerField(default=0)),
+                ("bucket_5", models.IntegerField(default=0)),
+                ("bucket_6", models.IntegerField(default=0)),
+                ("bucket_7", models.IntegerField(default=0)),
+                ("bucket_8", models.IntegerField(default=0)),
+                ("bucket_9", models.IntegerField(default=0)),
+                ("bucket_10", models.IntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(populate_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.2 on 2026-10-18 19:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spotify", "0003_trackratingstats"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="trackrating",
+            index=models.Index(fields=["track_id", "rating"], name="trackrating_track_rating_idx"),
+        ),
+    ]
@@ -0,0 +1,107 @@
+# Generated by Django 5.0.2 on 2026-10-18 19:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_tracks(apps, schema_editor):
+    TrackRating = apps.get_model("spotify", "TrackRating")
+    Track = apps.get_model("spotify", "Track")
+    tracks = {}
+    for rating in TrackRating.objects.order_by("-updated_at").values("track_id", "track_name", "artist_name"):
+        tracks.setdefault(
+            rating["track_id"],
+            Track(id=rating["track_id"], name=rating["track_name"], artist_name=rating["artist_name"]),
+        )
+    Track.objects.bulk_create(tracks.values(), batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spotify", "0004_trackrating_track_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Album",
+            fields=[
+                ("id", models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ("name", models.CharField(max_length=255)),
+                ("artist_name", models.CharField(max_length=255)),
+                ("image_url", models.URLField(blank=True)),
+                ("spotify_url", models.URLField(blank=True)),
+                ("release_date", models.CharField(blank=True, max_length=10)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="Artist",
+            fields=[
+                ("id", models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ("name", models.CharField(max_length=255)),
+                ("image_url", models.URLField(blank=True)),
+                ("spotify_url", models.URLField(blank=True)),
+                ("follower_total", models.IntegerField(blank=True, null=True)),
+                ("popularity", models.IntegerField(blank=True, null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="Track",
+            fields=[
+                ("id", models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ("name", models.CharField(max_length=255)),
+                ("artist_name", models.CharField(max_length=255)),
+                ("image_url", models.URLField(blank=True)),
+                ("preview_url", models.URLField(blank=True, null=True)),
+                ("spotify_url", models.URLField(blank=True)),
+                ("popularity", models.IntegerField(blank=True, null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="track",
+            name="album",
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name="tracks", to="spotify.album"),
+        ),
+        migrations.RunPython(populate_tracks, migrations.RunPython.noop),
+        # The track_id column stays as it is and becomes the Track foreign key
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RemoveIndex(
+                    model_name="trackrating",
+                    name="trackrating_track_rating_idx",
+                ),
+                migrations.AlterUniqueTogether(
+                    name="trackrating",
+                    unique_together=set(),
+                ),
+                migrations.RemoveField(
+                    model_name="trackrating",
+                    name="track_id",
+                ),
+                migrations.AddField(
+                    model_name="trackrating",
+                    name="track",
+                    field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name="ratings", to="spotify.track"),
+                ),
+                migrations.AlterUniqueTogether(
+                    name="trackrating",
+                    unique_together={("user", "track")},
+                ),
+                migrations.AddIndex(
+                    model_name="trackrating",
+                    index=models.Index(fields=["track", "rating"], name="trackrating_track_rating_idx"),
+                ),
+            ],
+        ),
+        migrations.RemoveField(
+            model_name="trackrating",
+            name="artist_name",
+        ),
+        migrations.RemoveField(
+            model_name="trackrating",
+            name="track_name",
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.2 on 2026-10-18 19:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spotify", "0005_catalog"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ListenLaterItem",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("track_uri", models.CharField(max_length=255)),
+                ("position", models.PositiveIntegerField(default=0)),
+                ("added_at", models.DateTimeField()),
+                ("track", models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name="+", to="spotify.track")),
+                ("user", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="listen_later_items", to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                "ordering": ["user", "position"],
+                "indexes": [models.Index(fields=["user", "position"], name="listen_later_user_pos_idx")],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="listenlateritem",
+            constraint=models.UniqueConstraint(fields=("user", "track_uri"), name="listen_later_user_uri_uniq"),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.2 on 2026-10-18 20:13
+
+from django.db import migrations, models
+
+
+def mark_spotify_rows(apps, schema_editor):
+    # Only Spotify responses carry popularity and release dates; posts and
+    # ratings never set them
+    apps.get_model("spotify", "Track").objects.filter(popularity__isnull=False).update(verified=True)
+    apps.get_model("spotify", "Album").objects.exclude(release_date="").update(verified=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spotify", "0006_listen_later_item"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="album",
+            name="verified",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="track",
+            name="verified",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_spotify_rows, migrations.RunPython.noop),
+    ]
@@ -1,33 +1,280 @@
-from django.db import models
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import models, transaction
 from core.models import User
-from django.db.models import Avg
+from django.db.models import Count, F, Q, Sum
 
 # Create your models here.
 
+class Artist(models.Model):
+    """An artist seen in a Spotify search response, keyed by Spotify id"""
+    id = models.CharField(max_length=100, primary_key=True)
+    name = models.CharField(max_length=255)
+    image_url = models.URLField(blank=True)
+    spotify_url = models.URLField(blank=True)
+    follower_total = models.IntegerField(null=True, blank=True)
+    popularity = models.IntegerField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+    def as_search_result(self):
+        """Shape the artist like an item from Spotify's search endpoint"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'images': [{'url': self.image_url}] if self.image_url else [],
+            'followers': {'total': self.follower_total or 0},
+            'popularity': self.popularity,
+            'external_urls': {'spotify': self.spotify_url},
+            'spotify_url': self.spotify_url,
+        }
+
+
+class Album(models.Model):
+    """An album that was posted or seen in search, keyed by Spotify id"""
+    id = models.CharField(max_length=100, primary_key=True)
+    name = models.CharField(max_length=255)
+    artist_name = models.CharField(max_length=255)
+    image_url = models.URLField(blank=True)
+    spotify_url = models.URLField(blank=True)
+    release_date = models.CharField(max_length=10, blank=True)
+    # Written from a Spotify response, not from what a client posted
+    verified = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} - {self.artist_name}"
+
+    def as_search_result(self):
+        """Shape the album like an item from Spotify's search endpoint"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'artists': [{'name': self.artist_name}],
+            'images': [{'url': self.image_url}] if self.image_url else [],
+            'release_date': self.release_date,
+            'external_urls': {'spotify': self.spotify_url},
+            'spotify_url': self.spotify_url,
+        }
+
+
+class Track(models.Model):
+    """A track that was posted, rated or seen in search, keyed by Spotify id"""
+    id = models.CharField(max_length=100, primary_key=True)
+    name = models.CharField(max_length=255)
+    artist_name = models.CharField(max_length=255)
+    album = models.ForeignKey(Album, related_name='tracks', null=True, blank=True, on_delete=models.SET_NULL)
+    image_url = models.URLField(blank=True)
+    preview_url = models.URLField(blank=True, null=True)
+    spotify_url = models.URLField(blank=True)
+    popularity = models.IntegerField(null=True, blank=True)
+    # Written from a Spotify response, not from what a client posted
+    verified = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} - {self.artist_name}"
+
+    def as_search_result(self):
+        """Shape the track like an item from Spotify's search endpoint"""
+        album = {'images': [{'url': self.image_url}] if self.image_url else []}
+        if self.album_id:
+            album.update(id=self.album_id, name=self.album.name)
+        return {
+            'id': self.id,
+            'name': self.name,
+            'artists': [{'name': self.artist_name}],
+            'album': album,
+            'preview_url': self.preview_url,
+            'popularity': self.popularity,
+            'external_urls': {'spotify': self.spotify_url},
+            'spotify_url': self.spotify_url,
+        }
+
+
 class TrackRating(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    track_id = models.CharField(max_length=100)
-    track_name = models.CharField(max_length=255)
-    artist_name = models.CharField(max_length=255)
+    # The column predates the catalog, so it carries no database constraint;
+    # set_rating() makes sure the Track row exists
+    track = models.ForeignKey(
+        Track,
+        related_name='ratings',
+        on_delete=models.PROTECT,
+        db_constraint=False,
+        db_index=False
+    )
     rating = models.DecimalField(max_digits=3, decimal_places=1)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        unique_together = ['user', 'track_id']
+        unique_together = ['user', 'track']
         ordering = ['-updated_at']
+        indexes = [
+            # Covers per-track aggregation without touching the table
+            models.Index(fields=['track', 'rating'], name='trackrating_track_rating_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.user.username} rated {self.track_name} - {self.artist_name} as {self.rating}/10"
+        return f"{self.user.username} rated {self.track.name} - {self.track.artist_name} as {self.rating}/10"
     
+    @classmethod
+    def set_rating(cls, user, track_id, track_name, artist_name, rating):
+        """Create or update a user's rating for a track, keeping TrackRatingStats in step"""
+        rating = Decimal(str(rating)).quantize(Decimal('0.1'), rounding=ROUND_HALF_UP)
+        with transaction.atomic():
+            Track.objects.get_or_create(id=track_id, defaults={'name': track_name, 'artist_name': artist_name})
+            existing = cls.objects.select_for_update().filter(user=user, track_id=track_id).first()
+            rating_obj, created = cls.objects.update_or_create(
+                user=user,
+                track_id=track_id,
+                defaults={'rating': rating}
+            )
+            TrackRatingStats.apply(
+                track_id,
+                added=rating,
+                removed=existing.rating if existing else None
+            )
+        return rating_obj, created
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            TrackRatingStats.apply(self.track_id, removed=self.rating)
+            return super().delete(*args, **kwargs)
+
     @classmethod
     def get_average_rating(cls, track_id):
         """Get the average rating for a track across all users"""
-        result = cls.objects.filter(track_id=track_id).aggregate(
-            avg_rating=Avg('rating'),
-            rating_count=models.Count('rating')
-        )
-        return {
-            'average': round(result['avg_rating'], 1) if result['avg_rating'] else None,
-            'count': result['rating_count']
+        return cls.get_average_ratings([track_id])[track_id]
+
+    @classmethod
+    def get_average_ratings(cls, track_ids):
+        """Get average ratings for many tracks with a single primary key lookup"""
+        averages = {
+            track_id: {'average': None, 'count': 0}
+            for track_id in track_ids
         }
+        for stats in TrackRatingStats.objects.filter(track_id__in=averages.keys()):
+            averages[stats.track_id] = {
+                'average': stats.average,
+                'count': stats.rating_count
+            }
+        return averages
+
+
+class TrackRatingStats(models.Model):
+    """Running rating totals per track, maintained alongside TrackRating"""
+    track_id = models.CharField(max_length=100, primary_key=True)
+    rating_sum = models.DecimalField(max_digits=12, decimal_places=1, default=0)
+    rating_count = models.IntegerField(default=0)
+
+    # Histogram of ratings: bucket N counts ratings from N.0 up to N.9
+    bucket_1 = models.IntegerField(default=0)
+    bucket_2 = models.IntegerField(default=0)
+    bucket_3 = models.IntegerField(default=0)
+    bucket_4 = models.IntegerField(default=0)
+    bucket_5 = models.IntegerField(default=0)
+    bucket_6 = models.IntegerField(default=0)
+    bucket_7 = models.IntegerField(default=0)
+    bucket_8 = models.IntegerField(default=0)
+    bucket_9 = models.IntegerField(default=0)
+    bucket_10 = models.IntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.track_id}: {self.average} ({self.rating_count} ratings)"
+
+    @property
+    def average(self):
+        if not self.rating_count:
+            return None
+        return round(self.rating_sum / self.rating_count, 1)
+
+    def get_histogram(self):
+        """Return the rating histogram as a list of counts for buckets 1-10"""
+        return [getattr(self, f'bucket_{i}') for i in range(1, 11)]
+
+    @staticmethod
+    def bucket_field(rating):
+        """Name of the histogram column a rating falls into"""
+        return f'bucket_{min(max(int(rating), 1), 10)}'
+
+    @classmethod
+    def apply(cls, track_id, added=None, removed=None):
+        """
+        Adjust a track's totals for a rating being added and/or removed.
+
+        Uses F() expressions so concurrent updates can't lose counts; call it
+        inside the same transaction as the TrackRating write.
+        """
+        if added is None and removed is None:
+            return
+
+        updates = {}
+        rating_delta = Decimal('0')
+        count_delta = 0
+        if added is not None:
+            rating_delta += Decimal(added)
+            count_delta += 1
+            bucket = cls.bucket_field(added)
+            updates[bucket] = updates.get(bucket, 0) + 1
+        if removed is not None:
+            rating_delta -= Decimal(removed)
+            count_delta -= 1
+            bucket = cls.bucket_field(removed)
+            updates[bucket] = updates.get(bucket, 0) - 1
+
+        cls.objects.get_or_create(track_id=track_id)
+        cls.objects.filter(track_id=track_id).update(
+            rating_sum=F('rating_sum') + rating_delta,
+            rating_count=F('rating_count') + count_delta,
+            **{bucket: F(bucket) + delta for bucket, delta in updates.items() if delta}
+        )
+
+    @classmethod
+    def compute_from_ratings(cls):
+        """Aggregate TrackRating from scratch, returning unsaved stats rows keyed by track id"""
+        # Same clamping as bucket_field: below 2 is bucket 1, 10 and up is bucket 10
+        buckets = {f'bucket_{i}': Count('id', filter=Q(rating__gte=i, rating__lt=i + 1)) for i in range(2, 10)}
+        buckets['bucket_1'] = Count('id', filter=Q(rating__lt=2))
+        buckets['bucket_10'] = Count('id', filter=Q(rating__gte=10))
+        rows = TrackRating.objects.order_by().values('track_id').annotate(
+            rating_sum=Sum('rating'),
+            rating_count=Count('id'),
+            **buckets
+        )
+        return {row['track_id']: cls(**row) for row in rows}
+
+    @classmethod
+    def rebuild(cls):
+        """Replace every stats row with totals recomputed from TrackRating"""
+        with transaction.atomic():
+            computed = cls.compute_from_ratings()
+            cls.objects.all().delete()
+            cls.objects.bulk_create(computed.values(), batch_size=1000)
+        return len(computed)
+
+
+class ListenLaterItem(models.Model):
+    """A track in a user's "listen later" playlist, mirrored by spotify.listen_later"""
+    user = models.ForeignKey(User, related_name='listen_later_items', on_delete=models.CASCADE)
+    track_uri = models.CharField(max_length=255)
+    # Null for items that aren't catalog tracks (local files, episodes)
+    track = models.ForeignKey(Track, related_name='+', null=True, blank=True, on_delete=models.SET_NULL)
+    position = models.PositiveIntegerField(default=0)
+    added_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['user', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'track_uri'], name='listen_later_user_uri_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'position'], name='listen_later_user_pos_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username}: {self.track_uri}"
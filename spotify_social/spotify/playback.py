@@ -0,0 +1,116 @@
+"""
+Queueing tracks on the user's Spotify player.
+
+Spotify only queues on a device that is active and playing. Checking that
+takes two calls (devices and current playback), so the device found is
+cached per user for SPOTIFY_ACTIVE_DEVICE_TTL seconds and repeat queue
+clicks during a listening session cost only the queue call itself. If
+Spotify says the device is gone the cached one is forgotten and the check
+runs again once.
+
+Spotify has no call for queueing several tracks at once, so queue_tracks()
+queues them one by one, in order.
+"""
+
+import logging
+
+from django.conf import settings
+from spotipy.exceptions import SpotifyException
+
+from . import ratelimit
+from .cache import get_cache, get_or_fetch, make_key
+from .client import get_client
+
+logger = logging.getLogger(__name__)
+
+# Per-track results of queue_tracks()
+QUEUED = 'queued'
+INVALID = 'invalid'
+FAILED = 'failed'
+
+# What Spotify answers when the device to queue on is no longer active
+NO_ACTIVE_DEVICE_STATUS = 404
+
+
+class NoActiveDevice(Exception):
+    """The user has no Spotify device that can take queued tracks"""
+
+
+def get_active_device(sp):
+    """Return the user's active, playing device or raise NoActiveDevice"""
+    devices = sp.devices()
+    if not devices['devices']:
+        raise NoActiveDevice(
+            'No active Spotify device found. Please make sure Spotify is open on one of your devices.'
+        )
+
+    current_playback = sp.current_playback()
+    if not current_playback or not current_playback['is_playing']:
+        raise NoActiveDevice('No device is currently playing. Please start playback on one of your devices.')
+
+    active_device = next((device for device in devices['devices'] if device['is_active']), None)
+    if not active_device:
+        raise NoActiveDevice('No active device found. Please make sure Spotify is the active device.')
+    return active_device
+
+
+def _device_key(user):
+    return make_key('active_device', user.pk)
+
+
+def get_active_device_id(user, sp):
+    """The id of the user's active, playing device, cached for SPOTIFY_ACTIVE_DEVICE_TTL"""
+    # NoActiveDevice is not cached, so starting playback takes effect at once
+    return get_or_fetch(_device_key(user), lambda: get_active_device(sp)['id'], settings.SPOTIFY_ACTIVE_DEVICE_TTL)
+
+
+def forget_active_device(user):
+    get_cache().delete(_device_key(user))
+
+
+def _queue(user, sp, uri):
+    try:
+        sp.add_to_queue(uri=uri, device_id=get_active_device_id(user, sp))
+    except SpotifyException as e:
+        if e.http_status != NO_ACTIVE_DEVICE_STATUS:
+            raise
+        # Playback moved or stopped since the device was cached, look again
+        forget_active_device(user)
+        try:
+            sp.add_to_queue(uri=uri, device_id=get_active_device_id(user, sp))
+        except SpotifyException as e:
+            if e.http_status == NO_ACTIVE_DEVICE_STATUS:
+                forget_active_device(user)
+            raise
+
+
+def queue_track(user, track_uri, priority=ratelimit.NORMAL):
+    """Add a track to the user's queue; raises NoActiveDevice if there is nowhere to play it"""
+    _queue(user, get_client(user, priority), track_uri)
+
+
+def queue_tracks(user, track_uris, priority=ratelimit.NORMAL):
+    """
+    Add tracks to the user's queue, in order.
+
+    Returns {uri: result} with each result QUEUED, INVALID (Spotify rejected
+    the URI) or FAILED (an error stopped the batch before or at this track).
+    Raises NoActiveDevice if there is nowhere to play them.
+    """
+    sp = get_client(user, priority)
+    # Raise before queueing anything when there is no device
+    get_active_device_id(user, sp)
+
+    results = dict.fromkeys(track_uris, FAILED)
+    for uri in results:
+        try:
+            _queue(user, sp, uri)
+        except SpotifyException as e:
+            if e.http_status == 400:
+                results[uri] = INVALID
+                continue
+            # Rate limited, or Spotify is failing: the rest would fail too
+            logger.error(f"Error queueing tracks for {user.username}: {str(e)}")
+            break
+        results[uri] = QUEUED
+    return results
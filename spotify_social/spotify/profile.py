@@ -0,0 +1,181 @@
+"""
+A user's Spotify profile data, served stale-while-revalidate.
+
+Profile pages show the user's Spotify account (current_user) and their top
+artists and tracks for a time range. Each of these is one Spotify call and
+one "part" in the 'spotify' cache:
+
+    current_user
+    top_artists:<time_range>
+    top_tracks:<time_range>
+
+Parts are kept for SPOTIFY_PROFILE_STALE_TTL and pages render from them
+straight away. Once a part is older than its fresh TTL
+(SPOTIFY_PROFILE_FRESH_TTL, or SPOTIFY_PROFILE_TOP_FRESH_TTL for top items,
+which Spotify only recomputes about daily) the process serving the page
+fetches it again on the shared Spotify executor, without waiting for it,
+and stores it in its own 'spotify' cache. Only parts that aren't cached at
+all are fetched during the request, concurrently.
+
+What the user is playing right now changes too quickly for that; the
+profile page polls it through get_currently_playing() instead.
+"""
+
+import logging
+import time
+
+from django.conf import settings
+
+from . import ratelimit
+from .cache import get_cache, get_or_fetch, make_key
+from .client import call_spotify, call_spotify_concurrently, call_spotify_in_background
+
+logger = logging.getLogger(__name__)
+
+TIME_RANGES = ('short_term', 'medium_term', 'long_term')
+TOP_LIMIT = 3
+# Seconds a background refresh may take before another page view may start one
+REFRESH_LOCK_TIMEOUT = 60
+
+
+def _key(user, part):
+    return make_key('profile', user.pk, part)
+
+
+def _fetcher(part):
+    """The func(sp) that fetches a part from Spotify"""
+    if part == 'current_user':
+        return lambda sp: sp.current_user()
+    kind, _, time_range = part.partition(':')
+    if time_range not in TIME_RANGES:
+        raise ValueError(f"Unknown profile data part {part}")
+    if kind == 'top_artists':
+        return lambda sp: sp.current_user_top_artists(limit=TOP_LIMIT, time_range=time_range)
+    if kind == 'top_tracks':
+        return lambda sp: sp.current_user_top_tracks(limit=TOP_LIMIT, time_range=time_range)
+    raise ValueError(f"Unknown profile data part {part}")
+
+
+def _fresh_ttl(part):
+    if part == 'current_user':
+        return settings.SPOTIFY_PROFILE_FRESH_TTL
+    return settings.SPOTIFY_PROFILE_TOP_FRESH_TTL
+
+
+def store(user, part, data):
+    """Remember freshly fetched profile data"""
+    get_cache().set(
+        _key(user, part),
+        {'data': data, 'fetched_at': time.time()},
+        settings.SPOTIFY_PROFILE_STALE_TTL
+    )
+
+
+def revalidate(user, part):
+    """Fetch a stale part again in the background, unless that is already happening"""
+    cache = get_cache()
+    lock_key = f'{_key(user, part)}:refreshing'
+    # One refresh per part at a time, however many page views see it stale
+    if not cache.add(lock_key, 1, REFRESH_LOCK_TIMEOUT):
+        return
+
+    def finish(future):
+        try:
+            store(user, part, future.result())
+        except Exception as e:
+            # The stale copy keeps being served, a later view tries again
+            logger.warning(f"Could not refresh {part} for user {user.username}: {str(e)}")
+        finally:
+            cache.delete(lock_key)
+
+    try:
+        call_spotify_in_background(user, _fetcher(part)).add_done_callback(finish)
+    except Exception as e:
+        cache.delete(lock_key)
+        logger.warning(f"Could not start refreshing {part} for user {user.username}: {str(e)}")
+
+
+def get_parts(user, parts, priority=ratelimit.NORMAL):
+    """
+    Return {part: data} for the requested parts.
+
+    Cached parts are returned as they are, with a background refresh started
+    for stale ones. Missing parts are fetched from Spotify concurrently.
+    """
+    keys = {part: _key(user, part) for part in parts}
+    entries = get_cache().get_many(keys.values())
+
+    results = {}
+    missing = []
+    now = time.time()
+    for part, key in keys.items():
+        entry = entries.get(key)
+        if entry is None:
+            missing.append(part)
+            continue
+        results[part] = entry['data']
+        if now - entry['fetched_at'] > _fresh_ttl(part):
+            revalidate(user, part)
+
+    if missing:
+        fetched = call_spotify_concurrently(user, [_fetcher(part) for part in missing], priority)
+        for part, data in zip(missing, fetched):
+            store(user, part, data)
+            results[part] = data
+    return results
+
+
+def get_current_user(user, priority=ratelimit.NORMAL):
+    """The user's Spotify account, as returned by current_user()"""
+    return get_parts(user, ['current_user'], priority)['current_user']
+
+
+def get_profile_data(user, time_range):
+    """The user's Spotify account plus their top artists and tracks for a time range"""
+    if time_range not in TIME_RANGES:
+        time_range = 'medium_term'
+    parts = get_parts(user, ['current_user', f'top_artists:{time_range}', f'top_tracks:{time_range}'])
+    return {
+        'current_user': parts['current_user'],
+        'top_artists': parts[f'top_artists:{time_range}'],
+        'top_tracks': parts[f'top_tracks:{time_range}'],
+    }
+
+
+def forget(user):
+    """Drop everything cached for a user, e.g. when they disconnect Spotify"""
+    parts = ['current_user']
+    for time_range in TIME_RANGES:
+        parts += [f'top_artists:{time_range}', f'top_tracks:{time_range}']
+    get_cache().delete_many([_key(user, part) for part in parts])
+
+
+def _serialize_playing(item):
+    album = item.get('album') or {}
+    images = album.get('images') or []
+    return {
+        'id': item['id'],
+        'name': item['name'],
+        'artist_name': ', '.join(artist['name'] for artist in item.get('artists', [])),
+        'album_name': album.get('name', ''),
+        'image_url': images[0]['url'] if images else '',
+        'preview_url': item.get('preview_url') or '',
+        'spotify_url': item.get('external_urls', {}).get('spotify', ''),
+    }
+
+
+def get_currently_playing(user):
+    """
+    The track the user is playing right now, or None.
+
+    Every open profile tab polls this, so answers are shared for
+    SPOTIFY_CURRENTLY_PLAYING_TTL seconds.
+    """
+    def fetch():
+        current = call_spotify(user, lambda sp: sp.currently_playing())
+        if not current or not current.get('is_playing') or not current.get('item'):
+            return {'item': None}
+        return {'item': _serialize_playing(current['item'])}
+
+    key = make_key('currently_playing', user.pk)
+    return get_or_fetch(key, fetch, settings.SPOTIFY_CURRENTLY_PLAYING_TTL)['item']
@@ -0,0 +1,220 @@
+"""
+Rate limiting for outbound Spotify calls.
+
+Every request a spotipy client from spotify.client makes goes through
+acquire() first, so all views and jobs share one budget:
+
+- A token bucket for the whole app and one per user. A call needs a token
+  from both. Buckets live in this process, so size SPOTIFY_RATE_LIMIT_* for
+  one worker process, not the whole deployment.
+- When Spotify answers 429 its Retry-After is stored in the 'spotify' cache,
+  and nothing is sent until it has passed. With the default local memory
+  cache that pause only holds in the process that was throttled; point the
+  cache at a shared store for every process to honour it.
+- NORMAL calls wait up to SPOTIFY_RATE_LIMIT_MAX_WAIT seconds for a token or
+  for Retry-After. LOW calls (nice-to-have data, background jobs) never wait,
+  and are also refused once the app bucket drops to
+  SPOTIFY_RATE_LIMIT_LOW_RESERVE of its capacity, which leaves the rest to
+  calls somebody is waiting on.
+
+Refused calls raise SpotifyRateLimited, a SpotifyException with status 429
+and the number of seconds to wait in retry_after. metrics() reports current
+budget usage.
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from spotipy.exceptions import SpotifyException
+
+from .cache import get_cache
+
+logger = logging.getLogger(__name__)
+
+NORMAL = 'normal'
+LOW = 'low'
+
+RETRY_AFTER_KEY = 'spotify:ratelimit:retry_after'
+# Used when a 429 comes without a usable Retry-After header
+DEFAULT_RETRY_AFTER = 1
+# User buckets kept per process, least recently used are dropped first
+MAX_USER_BUCKETS = 10000
+
+_lock = threading.Lock()
+_app_bucket = None
+_user_buckets = OrderedDict()
+_counters = {'requests': 0, 'waited': 0, 'shed': 0, 'throttled': 0}
+
+
+class SpotifyRateLimited(SpotifyException):
+    """Raised instead of calling Spotify when the rate limit budget is used up"""
+
+    def __init__(self, retry_after, reason):
+        super().__init__(
+            429,
+            -1,
+            f"Spotify call not sent: {reason}, retry in {retry_after:.1f}s",
+            reason=reason,
+            headers={'Retry-After': str(math.ceil(retry_after))}
+        )
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Holds up to capacity tokens and refills at rate tokens per second"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, reserve=0):
+        """Seconds until a token can be taken without going below reserve"""
+        missing = reserve + 1 - self.tokens
+        return max(missing, 0) / self.rate
+
+
+def _get_app_bucket():
+    global _app_bucket
+    if _app_bucket is None:
+        _app_bucket = TokenBucket(settings.SPOTIFY_RATE_LIMIT_APP_RATE, settings.SPOTIFY_RATE_LIMIT_APP_BURST)
+    return _app_bucket
+
+
+def _get_user_bucket(user_id):
+    bucket = _user_buckets.get(user_id)
+    if bucket is None:
+        bucket = TokenBucket(settings.SPOTIFY_RATE_LIMIT_USER_RATE, settings.SPOTIFY_RATE_LIMIT_USER_BURST)
+        _user_buckets[user_id] = bucket
+        if len(_user_buckets) > MAX_USER_BUCKETS:
+            _user_buckets.popitem(last=False)
+    else:
+        _user_buckets.move_to_end(user_id)
+    return bucket
+
+
+def _take_tokens(user_id, priority):
+    """Take a token from the app and user buckets; returns 0, or the seconds to wait for one"""
+    with _lock:
+        buckets = [_get_app_bucket()]
+        if user_id is not None:
+            buckets.append(_get_user_bucket(user_id))
+        reserve = 0
+        if priority == LOW:
+            reserve = buckets[0].capacity * settings.SPOTIFY_RATE_LIMIT_LOW_RESERVE
+
+        wait = 0
+        for index, bucket in enumerate(buckets):
+            bucket.refill()
+            wait = max(wait, bucket.wait_time(reserve if index == 0 else 0))
+        if wait:
+            return wait
+        for bucket in buckets:
+            bucket.tokens -= 1
+        _counters['requests'] += 1
+        return 0
+
+
+def retry_after_remaining():
+    """Seconds left before Spotify accepts calls again after a 429, or 0"""
+    until = get_cache().get(RETRY_AFTER_KEY)
+    if until is None:
+        return 0
+    return max(until - time.time(), 0)
+
+
+def _count(name):
+    with _lock:
+        _counters[name] += 1
+
+
+def acquire(user_id=None, priority=NORMAL):
+    """
+    Block until a call for user_id may be sent.
+
+    Raises SpotifyRateLimited if that would take longer than the priority
+    allows to wait.
+    """
+    max_wait = 0 if priority == LOW else settings.SPOTIFY_RATE_LIMIT_MAX_WAIT
+    deadline = time.monotonic() + max_wait
+    while True:
+        wait = retry_after_remaining()
+        reason = 'Spotify asked us to slow down'
+        if not wait:
+            wait = _take_tokens(user_id, priority)
+            reason = 'request budget used up'
+            if not wait:
+                return
+
+        if time.monotonic() + wait > deadline:
+            _count('shed')
+            logger.info(f"Shed {priority} priority Spotify call for user {user_id}: {reason}")
+            raise SpotifyRateLimited(wait, reason)
+        _count('waited')
+        time.sleep(wait)
+
+
+def record_throttled(headers):
+    """Remember Spotify's Retry-After from a 429 response, for every process sharing the 'spotify' cache"""
+    try:
+        retry_after = float((headers or {}).get('Retry-After'))
+    except (TypeError, ValueError):
+        retry_after = DEFAULT_RETRY_AFTER
+    _count('throttled')
+    logger.warning(f"Spotify rate limit hit, pausing calls for {retry_after}s")
+
+    until = time.time() + retry_after
+    cache = get_cache()
+    # Never shorten a pause another process already recorded
+    if until > (cache.get(RETRY_AFTER_KEY) or 0):
+        cache.set(RETRY_AFTER_KEY, until, math.ceil(retry_after) + 1)
+    return retry_after
+
+
+def metrics():
+    """Current budget usage and counters for this process"""
+    with _lock:
+        app_bucket = _get_app_bucket()
+        app_bucket.refill()
+        user_buckets = list(_user_buckets.values())
+        for bucket in user_buckets:
+            bucket.refill()
+        counters = dict(_counters)
+
+    return {
+        'app': {
+            'tokens': round(app_bucket.tokens, 2),
+            'capacity': app_bucket.capacity,
+            'rate': app_bucket.rate,
+            'used': round(1 - app_bucket.tokens / app_bucket.capacity, 3),
+        },
+        'users': {
+            'tracked': len(user_buckets),
+            'exhausted': sum(1 for bucket in user_buckets if bucket.tokens < 1),
+            'rate': settings.SPOTIFY_RATE_LIMIT_USER_RATE,
+            'capacity': settings.SPOTIFY_RATE_LIMIT_USER_BURST,
+        },
+        'retry_after': round(retry_after_remaining(), 2),
+        'counters': counters,
+    }
+
+
+def reset():
+    """Forget all buckets and counters (settings changes, tests)"""
+    global _app_bucket
+    with _lock:
+        _app_bucket = None
+        _user_buckets.clear()
+        for name in _counters:
+            _counters[name] = 0
+    get_cache().delete(RETRY_AFTER_KEY)
@@ -0,0 +1,107 @@
+"""
+Spotify catalog search.
+
+Spotify's search endpoint accepts several item types at once, so a search
+for tracks, albums and artists costs a single round trip. Catalog results
+are the same for every user and are cached by casefolded query and types;
+per-user rating overlays are applied on top after the cache lookup.
+
+On a cache miss the local catalog (spotify.catalog) is tried before Spotify,
+and every Spotify response is written back to it.
+"""
+
+import logging
+
+from django.conf import settings
+
+from . import catalog
+from .cache import get_or_fetch, make_key
+from .client import call_spotify
+from .models import TrackRating
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TYPES = ('track', 'album', 'artist')
+
+# Spotify only treats these as operators in upper case
+QUERY_OPERATORS = {'AND', 'OR', 'NOT'}
+
+
+def normalize_query(query):
+    """Collapse whitespace; this is what is sent to Spotify"""
+    return ' '.join(query.split())
+
+
+def query_cache_key(query):
+    """Casefold a normalized query so trivially different spellings share a cache entry"""
+    return ' '.join(word if word in QUERY_OPERATORS else word.casefold() for word in query.split())
+
+
+def search_catalog(sp, query, types=SEARCH_TYPES, limit=10):
+    """Search Spotify for several item types in one request, keyed by 'tracks', 'albums', ..."""
+    response = sp.search(q=query, type=','.join(types), limit=limit)
+
+    results = {}
+    for search_type in types:
+        key = f'{search_type}s'
+        # Spotify occasionally pads result pages with nulls
+        items = [item for item in response.get(key, {}).get('items', []) if item]
+        for item in items:
+            item['spotify_url'] = item['external_urls']['spotify']
+        results[key] = items
+    return results
+
+
+def local_first_search(user, query, types=SEARCH_TYPES, limit=10):
+    """Answer from the local catalog if it has enough matches, otherwise ask Spotify"""
+    if settings.SPOTIFY_SEARCH_LOCAL_FIRST:
+        results = catalog.search_local(query, types, limit)
+        if results is not None:
+            return results
+
+    results = call_spotify(user, lambda sp: search_catalog(sp, query, types, limit))
+    try:
+        catalog.remember_search_results(results)
+    except Exception as e:
+        # The catalog is a by-product, a failed write must not fail the search
+        logger.warning(f"Could not add search results for '{query}' to the catalog: {str(e)}")
+    return results
+
+
+def cached_search(user, query, types=SEARCH_TYPES, limit=10):
+    """
+    Search the catalog through the shared cache.
+
+    Concurrent identical searches result in one lookup, and at most one
+    upstream call, made with the token of whichever user missed the cache first.
+    """
+    query = normalize_query(query)
+    types = tuple(sorted(types))
+    key = make_key('search', query_cache_key(query), ','.join(types), limit)
+    return get_or_fetch(
+        key,
+        lambda: local_first_search(user, query, types, limit),
+        settings.SPOTIFY_SEARCH_CACHE_TTL
+    )
+
+
+def add_rating_overlay(tracks, user):
+    """Add the user's own rating and the average rating to each track"""
+    # Get user ratings for tracks
+    track_ids = [track['id'] for track in tracks]
+    user_ratings = {
+        rating.track_id: rating.rating
+        for rating in TrackRating.objects.filter(
+            user=user,
+            track_id__in=track_ids
+        )
+    }
+
+    # Get average ratings for all tracks in one query
+    avg_ratings = TrackRating.get_average_ratings(track_ids)
+
+    # Add ratings to track data
+    for track in tracks:
+        track['user_rating'] = user_ratings.get(track['id'])
+        track['avg_rating'] = avg_ratings.get(track['id'], {'average': None, 'count': 0})
+    return tracks
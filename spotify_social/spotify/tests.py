@@ -1,3 +1,756 @@
-from django.test import TestCase
+import threading
+import time
+from concurrent.futures import Future
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Avg, Count
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from spotipy.exceptions import SpotifyException
+
+from core import jobs as core_jobs
+from core.models import Job, User
+from social.models import Post
+from . import breaker, catalog, client, jobs, listen_later, playback, profile, ratelimit, search, tokens
+from .cache import get_cache
+from .models import Album, Artist, ListenLaterItem, Track, TrackRating, TrackRatingStats
+
+TRACK = {
+    'id': '4iV5W9uYEdYUVa79Axb7Rh',
+    'uri': 'spotify:track:4iV5W9uYEdYUVa79Axb7Rh',
+    'type': 'track',
+    'name': 'As It Was',
+    'artists': [{'name': 'Harry Styles'}],
+    'album': {'id': '5r36AJ6VOJtp00oxSkBZ5h', 'name': "Harry's House", 'artists': [{'name': 'Harry Styles'}], 'images': []},
+    'external_urls': {'spotify': 'https://open.spotify.com/track/4iV5W9uYEdYUVa79Axb7Rh'},
+}
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plan assertions are written for SQLite')
+class TrackRatingIndexTests(TestCase):
+    def test_ratings_by_track_use_covering_index(self):
+        queryset = TrackRating.objects.filter(track_id='4iV5W9uYEdYUVa79Axb7Rh').order_by().values('track_id').annotate(
+            avg_rating=Avg('rating'),
+            rating_count=Count('rating')
+        )
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = '\n'.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('COVERING INDEX trackrating_track_rating_idx', plan)
+
+
+class RatingStatsTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f'rater{n}') for n in range(3)]
+        self.track_id = TRACK['id']
+
+    def rate(self, user, rating, track_id=None):
+        return TrackRating.set_rating(user, track_id or self.track_id, 'As It Was', 'Harry Styles', rating)
+
+    def stats(self, track_id=None):
+        return TrackRatingStats.objects.get(track_id=track_id or self.track_id)
+
+    def test_adding_ratings_fills_buckets(self):
+        self.rate(self.users[0], 7.25)
+        self.rate(self.users[1], 7.9)
+        self.rate(self.users[2], 10)
+
+        stats = self.stats()
+        self.assertEqual((stats.rating_sum, stats.rating_count), (Decimal('25.2'), 3))
+        self.assertEqual(stats.get_histogram(), [0, 0, 0, 0, 0, 0, 2, 0, 0, 1])
+        self.assertEqual(stats.average, Decimal('8.4'))
+
+    def test_updating_a_rating_moves_it_between_buckets(self):
+        self.rate(self.users[0], 3)
+        self.rate(self.users[1], 3.5)
+        self.rate(self.users[0], 8.1)
+
+        stats = self.stats()
+        self.assertEqual((stats.rating_sum, stats.rating_count), (Decimal('11.6'), 2))
+        self.assertEqual(stats.get_histogram(), [0, 0, 1, 0, 0, 0, 0, 1, 0, 0])
+
+        # Re-rating within the same bucket only changes the sum
+        self.rate(self.users[1], 3.9)
+        stats = self.stats()
+        self.assertEqual((stats.rating_sum, stats.rating_count), (Decimal('12.0'), 2))
+        self.assertEqual(stats.get_histogram(), [0, 0, 1, 0, 0, 0, 0, 1, 0, 0])
+
+    def test_deleting_a_rating_empties_its_bucket(self):
+        rating, _ = self.rate(self.users[0], 1)
+        self.rate(self.users[1], 6)
+        rating.delete()
+
+        stats = self.stats()
+        self.assertEqual((stats.rating_sum, stats.rating_count), (Decimal('6.0'), 1))
+        self.assertEqual(stats.get_histogram(), [0, 0, 0, 0, 0, 1, 0, 0, 0, 0])
+
+    def test_stats_match_a_fresh_aggregate(self):
+        for user, rating in zip(self.users, [1.5, 9.95, 5]):
+            self.rate(user, rating)
+        self.rate(self.users[2], 2)
+
+        expected = TrackRatingStats.compute_from_ratings()[self.track_id]
+        stats = self.stats()
+        for field in ['rating_sum', 'rating_count'] + [f'bucket_{i}' for i in range(1, 11)]:
+            self.assertEqual(getattr(stats, field), getattr(expected, field), field)
+
+    def test_rebuild_reports_and_repairs_drift(self):
+        other_id = '0VjIjW4GlUZAMYd2vXMi3b'
+        self.rate(self.users[0], 4)
+        self.rate(self.users[1], 5)
+        self.rate(self.users[0], 8, track_id=other_id)
+        Track.objects.create(id='1BxfuPKGuaTgP7aM0Bbdwr', name='Cruel Summer', artist_name='Taylor Swift')
+        # One track's stats drift, one track has leftovers without ratings
+        TrackRatingStats.objects.filter(track_id=self.track_id).update(rating_count=5, bucket_4=0)
+        TrackRatingStats.objects.create(track_id='1BxfuPKGuaTgP7aM0Bbdwr', rating_count=1, bucket_2=1)
+
+        out = StringIO()
+        call_command('rebuild_rating_stats', '--verify', stdout=out)
+        self.assertIn(f'Drift for track {self.track_id}', out.getvalue())
+        self.assertIn('Drift for track 1BxfuPKGuaTgP7aM0Bbdwr', out.getvalue())
+        self.assertNotIn(other_id, out.getvalue())
+        self.assertIn('2 of 2 rated tracks have drifted.', out.getvalue())
+        self.assertEqual(self.stats().rating_count, 5)
+
+        out = StringIO()
+        call_command('rebuild_rating_stats', stdout=out)
+        self.assertIn('Rebuilt rating stats for 2 tracks.', out.getvalue())
+        stats = self.stats()
+        self.assertEqual((stats.rating_sum, stats.rating_count), (Decimal('9.0'), 2))
+        self.assertEqual(stats.get_histogram(), [0, 0, 0, 1, 1, 0, 0, 0, 0, 0])
+        self.assertFalse(TrackRatingStats.objects.filter(track_id='1BxfuPKGuaTgP7aM0Bbdwr').exists())
+
+        out = StringIO()
+        call_command('rebuild_rating_stats', '--verify', stdout=out)
+        self.assertIn('No drift found across 2 rated tracks.', out.getvalue())
+
+
+class CatalogTests(TestCase):
+    def test_partial_and_null_search_items(self):
+        catalog.remember_search_results({
+            'tracks': [
+                None,
+                {'id': None, 'uri': 'spotify:local:::Demo:200', 'name': 'Demo', 'is_local': True},
+                {'id': TRACK['id'], 'artists': [None, {'id': 'x'}], 'album': {'id': TRACK['album']['id']}},
+            ],
+            'albums': [None, {'name': 'No id'}, {'id': '1DFixLWuPkv3KT3TnV35m3', 'images': [None], 'external_urls': None}],
+            'artists': [None, {'id': '6KImCVD70vtIoJWnq6nGn3'}],
+        })
+        track = Track.objects.get()
+        self.assertEqual((track.id, track.name, track.artist_name, track.album_id), (TRACK['id'], '', '', TRACK['album']['id']))
+        self.assertEqual(set(Album.objects.values_list('id', flat=True)), {TRACK['album']['id'], '1DFixLWuPkv3KT3TnV35m3'})
+        self.assertEqual(list(Artist.objects.values_list('id', 'name')), [('6KImCVD70vtIoJWnq6nGn3', '')])
+
+    def post_item(self, track_id, name, **links):
+        return catalog.remember_item('track', track_id, name, 'Mallory', **links)
+
+    @override_settings(SPOTIFY_SEARCH_LOCAL_MIN_RESULTS=1)
+    def test_local_search_only_uses_spotify_rows(self):
+        self.post_item(f'{1:022d}', 'Harry Styles Cover', spotify_url='https://evil.example/')
+        TrackRating.set_rating(User.objects.create_user(username='rater'), f'{2:022d}', 'Harry Styles Demo', 'Band', 7)
+        self.assertIsNone(catalog.search_local('harry styles', ['track']))
+
+        catalog.remember_search_results({'tracks': [TRACK]})
+        results = catalog.search_local('harry styles', ['track'])
+        self.assertEqual([track['id'] for track in results['tracks']], [TRACK['id']])
+
+    def test_posted_links_are_checked(self):
+        track = self.post_item(
+            f'{1:022d}', 'Song',
+            spotify_url='javascript:alert(1)', image_url='http://i.scdn.co/image/1', preview_url='data:audio/mp3,x'
+        )
+        self.assertEqual((track.spotify_url, track.image_url, track.preview_url, track.verified), ('', '', None, False))
+
+        track = self.post_item(f'{2:022d}', 'Song', spotify_url='https://evil.example/track/2')
+        self.assertEqual(track.spotify_url, '')
+        track = self.post_item(
+            f'{3:022d}', 'Song', spotify_url='https://open.spotify.com/track/3', image_url='https://i.scdn.co/image/3'
+        )
+        self.assertEqual((track.spotify_url, track.image_url), ('https://open.spotify.com/track/3', 'https://i.scdn.co/image/3'))
+
+    def test_posts_do_not_change_spotify_rows(self):
+        catalog.remember_search_results({'tracks': [dict(TRACK, album=dict(TRACK['album'], images=[]))]})
+        track = self.post_item(TRACK['id'], 'Renamed', image_url='https://evil.example/cover.png')
+        self.assertEqual((track.name, track.image_url, track.verified), (TRACK['name'], '', True))
+
+        # Unverified rows still get blanks filled in by later posts
+        self.post_item(f'{1:022d}', 'Song')
+        track = self.post_item(f'{1:022d}', 'Other name', image_url='https://i.scdn.co/image/1')
+        self.assertEqual((track.name, track.image_url), ('Song', 'https://i.scdn.co/image/1'))
+
+        # A search response takes over a posted row
+        catalog.remember_search_results({'tracks': [dict(TRACK, id=f'{1:022d}')]})
+        self.assertTrue(Track.objects.get(pk=f'{1:022d}').verified)
+
+
+@mock.patch.object(jobs, 'call_spotify', return_value=TRACK)
+class PostRatingJobTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='rater', spotify_access_token='token')
+
+    def run_rating_job(self):
+        job = core_jobs.enqueue('spotify.post_rating', {'track_id': TRACK['id'], 'rating': 4}, user=self.user)
+        core_jobs.run_pending('worker')
+        job.refresh_from_db()
+        return job
+
+    def test_other_post_about_track_does_not_suppress_rating_post(self, call_spotify):
+        Post.objects.create(user=self.user, post_type='track', content='Now playing', spotify_id=TRACK['id'])
+        job = self.run_rating_job()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertTrue(Post.objects.filter(pk=job.result['post_id'], content='Rated this song 4/5 stars!').exists())
+        self.assertEqual(Post.objects.filter(user=self.user).count(), 2)
+
+    def test_retry_after_fan_out_failure_posts_once(self, call_spotify):
+        with mock.patch('social.timeline.fan_out_post', side_effect=[RuntimeError('database is locked'), 0]) as fan_out:
+            job = self.run_rating_job()
+            self.assertEqual(job.status, Job.QUEUED)
+            Job.objects.filter(pk=job.pk).update(run_at=job.created_at)
+            core_jobs.run_pending('worker')
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(Post.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(fan_out.call_count, 2)
+        self.assertEqual(call_spotify.call_count, 1)
+
+
+def make_track(n):
+    track_id = f'{n:022d}'
+    return dict(TRACK, id=track_id, uri=f'spotify:track:{track_id}', name=f'Track {n}')
+
+
+class FakePlaylist:
+    """Stands in for the Spotify client: one playlist, and a catalog of every make_track() id"""
+
+    def __init__(self, tracks, fail_on_write=None):
+        self.entries = [{'added_at': '2024-01-01T00:00:00Z', 'track': track} for track in tracks]
+        self.version = 1
+        self.calls = []
+        # Raise on this call to playlist_add_items (1-based)
+        self.fail_on_write = fail_on_write
+        self.writes = 0
+
+    @property
+    def snapshot_id(self):
+        return f'snapshot-{self.version}'
+
+    def playlist(self, playlist_id, fields):
+        self.calls.append('playlist')
+        return {'snapshot_id': self.snapshot_id}
+
+    def playlist_items(self, playlist_id, fields, limit, offset):
+        self.calls.append(f'playlist_items:{offset}')
+        return {'total': len(self.entries), 'items': self.entries[offset:offset + limit]}
+
+    def tracks(self, track_ids):
+        self.calls.append('tracks')
+        return {'tracks': [make_track(int(track_id)) for track_id in track_ids]}
+
+    def playlist_add_items(self, playlist_id, items):
+        self.writes += 1
+        if self.writes == self.fail_on_write:
+            raise SpotifyException(502, -1, 'Bad gateway')
+        assert len(items) <= listen_later.PLAYLIST_WRITE_LIMIT
+        self.entries += [{'added_at': None, 'track': make_track(int(uri.split(':')[-1]))} for uri in items]
+        self.version += 1
+        return {'snapshot_id': self.snapshot_id}
+
+    def playlist_remove_all_occurrences_of_items(self, playlist_id, items):
+        self.entries = [entry for entry in self.entries if not entry['track'] or entry['track']['uri'] not in items]
+        self.version += 1
+        return {'snapshot_id': self.snapshot_id}
+
+
+class FakePlaylistMixin:
+    def use_playlist(self, playlist):
+        # The real helpers only add token handling and the thread pool around func(sp)
+        def call(user, func, priority=None):
+            return func(playlist)
+
+        def call_concurrently(user, funcs, priority=None):
+            return [func(playlist) for func in funcs]
+
+        for name, replacement in (('call_spotify', call), ('call_spotify_concurrently', call_concurrently)):
+            patcher = mock.patch.object(listen_later, name, side_effect=replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return playlist
+
+
+class ListenLaterTests(FakePlaylistMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='saver', spotify_access_token='token', listen_later='playlist')
+
+    def mirrored_uris(self):
+        return list(ListenLaterItem.objects.filter(user=self.user).values_list('track_uri', flat=True))
+
+    def test_unchanged_snapshot_costs_one_call(self):
+        playlist = self.use_playlist(FakePlaylist([make_track(1)]))
+        self.assertTrue(listen_later.reconcile(self.user))
+        playlist.calls.clear()
+
+        self.assertFalse(listen_later.reconcile(self.user))
+        self.assertEqual(playlist.calls, ['playlist'])
+        self.assertEqual(self.mirrored_uris(), [make_track(1)['uri']])
+
+    def test_changed_snapshot_reads_every_page(self):
+        playlist = self.use_playlist(FakePlaylist([make_track(n) for n in range(3)]))
+        listen_later.reconcile(self.user)
+
+        playlist.entries = [{'added_at': None, 'track': make_track(n)} for n in range(250)]
+        playlist.version += 1
+        playlist.calls.clear()
+        self.assertTrue(listen_later.reconcile(self.user))
+
+        self.assertEqual(playlist.calls, ['playlist', 'playlist_items:0', 'playlist_items:100', 'playlist_items:200'])
+        self.assertEqual(self.mirrored_uris(), [make_track(n)['uri'] for n in range(250)])
+        self.assertEqual(User.objects.get(pk=self.user.pk).listen_later_snapshot_id, 'snapshot-2')
+        self.assertEqual(Track.objects.count(), 250)
+
+    def test_null_and_local_tracks(self):
+        local = {'id': None, 'uri': 'spotify:local:Artist:Album:Demo:200', 'type': 'track', 'is_local': True,
+                 'name': 'Demo', 'artists': [{'name': 'Artist'}], 'album': {'id': None, 'name': 'Album'}}
+        self.use_playlist(FakePlaylist([make_track(1), None, local, make_track(1), make_track(2)]))
+        listen_later.reconcile(self.user)
+
+        items = list(ListenLaterItem.objects.filter(user=self.user).values_list('track_uri', 'track_id', 'position'))
+        self.assertEqual(items, [
+            (make_track(1)['uri'], make_track(1)['id'], 0),
+            (local['uri'], None, 2),
+            (make_track(2)['uri'], make_track(2)['id'], 4),
+        ])
+        self.assertEqual(set(Track.objects.values_list('id', flat=True)), {make_track(1)['id'], make_track(2)['id']})
+
+    def test_add_and_remove_in_batches(self):
+        playlist = self.use_playlist(FakePlaylist([make_track(0)]))
+        uris = [make_track(n)['uri'] for n in range(151)] + ['spotify:album:nope']
+        results = listen_later.add_tracks(self.user, uris)
+
+        self.assertEqual(results[make_track(0)['uri']], listen_later.DUPLICATE)
+        self.assertEqual(results['spotify:album:nope'], listen_later.INVALID)
+        self.assertEqual(list(results.values()).count(listen_later.ADDED), 150)
+        self.assertEqual(playlist.writes, 2)
+        self.assertEqual(self.mirrored_uris(), uris[:151])
+
+        results = listen_later.remove_tracks(self.user, [make_track(5)['uri'], make_track(999)['uri']])
+        self.assertEqual(list(results.values()), [listen_later.REMOVED, listen_later.NOT_IN_PLAYLIST])
+        self.assertNotIn(make_track(5)['uri'], self.mirrored_uris())
+        self.assertEqual(User.objects.get(pk=self.user.pk).listen_later_snapshot_id, playlist.snapshot_id)
+
+    def test_partial_batch_failure_keeps_mirror_in_step(self):
+        playlist = self.use_playlist(FakePlaylist([], fail_on_write=2))
+        uris = [make_track(n)['uri'] for n in range(150)]
+        with self.assertRaises(SpotifyException):
+            listen_later.add_tracks(self.user, uris)
+
+        # The first batch reached Spotify and the mirror, the second neither
+        self.assertEqual(self.mirrored_uris(), uris[:100])
+        self.assertEqual(User.objects.get(pk=self.user.pk).listen_later_snapshot_id, playlist.snapshot_id)
+
+        # Retrying adds only what is missing, without re-reading the playlist
+        playlist.calls.clear()
+        results = listen_later.add_tracks(User.objects.get(pk=self.user.pk), uris)
+        self.assertNotIn('playlist_items:0', playlist.calls)
+        self.assertEqual(list(results.values()).count(listen_later.DUPLICATE), 100)
+        self.assertEqual(self.mirrored_uris(), uris)
+
+
+class TokenRefreshTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='listener', spotify_access_token='old', spotify_refresh_token='refresh',
+            spotify_token_expires_at=timezone.now()
+        )
+        self.expires_at = int(timezone.now().timestamp()) + 3600
+
+    def refresh_with(self, side_effect):
+        with mock.patch.object(tokens, 'get_oauth') as get_oauth:
+            get_oauth.return_value.refresh_access_token.side_effect = side_effect
+            return tokens.refresh_access_token(self.user)
+
+    def test_refresh_writes_back_token(self):
+        token = self.refresh_with(lambda refresh_token: {'access_token': 'new', 'expires_at': self.expires_at})
+        self.assertEqual(token, 'new')
+        stored = User.objects.get(pk=self.user.pk)
+        self.assertEqual((stored.spotify_access_token, stored.spotify_refresh_token), ('new', 'refresh'))
+        self.assertTrue(tokens.token_is_fresh(stored))
+
+    def test_token_stored_elsewhere_during_refresh_wins(self):
+        def refresh_elsewhere_first(refresh_token):
+            # Another process finished its refresh while ours was in flight
+            User.objects.filter(pk=self.user.pk).update(
+                spotify_access_token='theirs', spotify_refresh_token='rotated',
+                spotify_token_expires_at=timezone.now() + timedelta(hours=1)
+            )
+            return {'access_token': 'ours', 'refresh_token': 'also-rotated', 'expires_at': self.expires_at}
+
+        self.assertEqual(self.refresh_with(refresh_elsewhere_first), 'theirs')
+        stored = User.objects.get(pk=self.user.pk)
+        self.assertEqual((stored.spotify_access_token, stored.spotify_refresh_token), ('theirs', 'rotated'))
+        self.assertEqual(self.user.spotify_refresh_token, 'rotated')
+
+
+@override_settings(SPOTIFY_SEARCH_LOCAL_FIRST=False)
+class SearchTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user(username='searcher', spotify_access_token='token')
+        self.sp = mock.Mock()
+        self.sp.search.side_effect = lambda **kwargs: {'tracks': {'items': [dict(TRACK)]}}
+        patcher = mock.patch.object(search, 'call_spotify', side_effect=lambda user, func: func(self.sp))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_operators_reach_spotify_unchanged(self):
+        search.cached_search(self.user, '  Radiohead   NOT live ', types=('track',))
+        self.assertEqual(self.sp.search.call_args.kwargs['q'], 'Radiohead NOT live')
+
+    def test_case_only_shares_cache_entry_without_merging_operators(self):
+        search.cached_search(self.user, 'Radiohead NOT live', types=('track',))
+        search.cached_search(self.user, 'radiohead  NOT Live', types=('track',))
+        self.assertEqual(self.sp.search.call_count, 1)
+
+        search.cached_search(self.user, 'radiohead not live', types=('track',))
+        self.assertEqual(self.sp.search.call_count, 2)
+        self.assertEqual(self.sp.search.call_args.kwargs['q'], 'radiohead not live')
+
+
+class AlwaysThrottled(BaseHTTPRequestHandler):
+    requests = 0
+
+    def do_GET(self):
+        AlwaysThrottled.requests += 1
+        self.send_response(429)
+        self.send_header('Retry-After', '5')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ClientRetryTests(TestCase):
+    def setUp(self):
+        AlwaysThrottled.requests = 0
+        server = HTTPServer(('127.0.0.1', 0), AlwaysThrottled)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(ratelimit.reset)
+        self.prefix = f'http://127.0.0.1:{server.server_port}/v1/'
+
+    def test_429_is_not_retried_inside_the_session(self):
+        sp = client.PooledSpotify(
+            auth='token', requests_session=client._build_session(), priority=ratelimit.LOW
+        )
+        sp.prefix = self.prefix
+        started = time.monotonic()
+        with self.assertRaises(SpotifyException) as raised:
+            sp.current_user()
+        self.assertEqual(raised.exception.http_status, 429)
+        self.assertEqual(AlwaysThrottled.requests, 1)
+        self.assertLess(time.monotonic() - started, 1)
+        # Retry-After went to the rate limiter instead
+        self.assertGreater(ratelimit.retry_after_remaining(), 4)
+
+
+class DeferredExecutor:
+    """Stands in for the shared executor; submitted calls run when the test says so"""
+
+    def __init__(self):
+        self.pending = []
+
+    def submit(self, fn):
+        future = Future()
+        self.pending.append((fn, future))
+        return future
+
+    def run_all(self):
+        while self.pending:
+            fn, future = self.pending.pop(0)
+            try:
+                future.set_result(fn())
+            except Exception as e:
+                future.set_exception(e)
+
+
+@override_settings(SPOTIFY_PROFILE_FRESH_TTL=300)
+class ProfileRevalidateTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user(
+            username='profiled', spotify_access_token='token',
+            spotify_token_expires_at=timezone.now() + timedelta(hours=1)
+        )
+        self.executor = DeferredExecutor()
+        self.sp = mock.Mock()
+        self.sp.current_user.return_value = {'id': 'new'}
+        for name, value in (('_get_executor', self.executor), ('spotify_client', self.sp)):
+            patcher = mock.patch.object(client, name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def cache_part(self, data, age):
+        profile.store(self.user, 'current_user', data)
+        key = profile._key(self.user, 'current_user')
+        entry = get_cache().get(key)
+        entry['fetched_at'] -= age
+        get_cache().set(key, entry)
+
+    def test_fresh_part_is_not_refetched(self):
+        self.cache_part({'id': 'cached'}, age=10)
+        self.assertEqual(profile.get_current_user(self.user), {'id': 'cached'})
+        self.assertEqual(self.executor.pending, [])
+
+    def test_stale_part_is_served_and_refreshed_in_this_process(self):
+        self.cache_part({'id': 'old'}, age=301)
+        self.assertEqual(profile.get_current_user(self.user), {'id': 'old'})
+        # Other views while the refresh is in flight don't start another
+        self.assertEqual(profile.get_current_user(self.user), {'id': 'old'})
+        self.assertEqual(len(self.executor.pending), 1)
+
+        self.executor.run_all()
+        self.assertEqual(profile.get_current_user(self.user), {'id': 'new'})
+        self.assertEqual(self.executor.pending, [])
+        self.assertFalse(Job.objects.exists())
+
+    def test_failed_refresh_keeps_stale_copy_and_tries_again(self):
+        self.cache_part({'id': 'old'}, age=301)
+        self.sp.current_user.side_effect = SpotifyException(502, -1, 'Bad gateway')
+        profile.get_current_user(self.user)
+        self.executor.run_all()
+
+        self.assertEqual(profile.get_current_user(self.user), {'id': 'old'})
+        self.assertEqual(len(self.executor.pending), 1)
+
+
+@override_settings(SPOTIFY_BREAKER_FAILURE_THRESHOLD=3, SPOTIFY_BREAKER_COOLDOWN=30)
+class BreakerTests(TestCase):
+    def setUp(self):
+        breaker.reset()
+        self.addCleanup(breaker.reset)
+        self.now = 1000.0
+        patcher = mock.patch.object(breaker.time, 'monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fail(self, times=1):
+        for _ in range(times):
+            breaker.before_call()
+            breaker.record_result(False)
+
+    def open_breaker(self):
+        self.fail(3)
+        self.assertEqual(breaker.metrics()['state'], breaker.OPEN)
+
+    def test_opens_after_consecutive_failures(self):
+        self.fail(2)
+        breaker.before_call()
+        breaker.record_result(True)
+        self.fail(2)
+        self.assertEqual(breaker.metrics()['state'], breaker.CLOSED)
+        self.fail()
+        self.assertEqual(breaker.metrics(), {'state': breaker.OPEN, 'failures': 3, 'retry_after': 30})
+        with self.assertRaises(breaker.SpotifyUnavailable):
+            breaker.check()
+        with self.assertRaises(breaker.SpotifyUnavailable):
+            breaker.before_call()
+
+    def test_single_trial_after_cooldown_closes(self):
+        self.open_breaker()
+        self.now += 30
+        breaker.check()
+        breaker.before_call()
+        self.assertEqual(breaker.metrics()['state'], breaker.HALF_OPEN)
+        # Only the trial call goes out
+        with self.assertRaises(breaker.SpotifyUnavailable):
+            breaker.before_call()
+
+        breaker.record_result(True)
+        self.assertEqual(breaker.metrics(), {'state': breaker.CLOSED, 'failures': 0, 'retry_after': 0})
+        breaker.before_call()
+
+    def test_failed_trial_opens_for_another_cooldown(self):
+        self.open_breaker()
+        self.now += 31
+        self.fail()
+        self.assertEqual(breaker.metrics()['state'], breaker.OPEN)
+        self.assertEqual(breaker.metrics()['retry_after'], 30)
+        self.now += 29
+        with self.assertRaises(breaker.SpotifyUnavailable):
+            breaker.before_call()
+
+    def test_client_errors_are_not_outages(self):
+        self.assertFalse(breaker.is_outage(SpotifyException(404, -1, 'Not found')))
+        self.assertFalse(breaker.is_outage(ratelimit.SpotifyRateLimited(5, 'budget')))
+        self.assertTrue(breaker.is_outage(SpotifyException(503, -1, 'Unavailable')))
+        self.assertFalse(breaker.is_outage(SpotifyException(429, -1, 'Too many', headers={'Retry-After': '1'})))
+        # What spotipy raises once the session's 5xx retries run out
+        self.assertTrue(breaker.is_outage(SpotifyException(429, -1, 'Max Retries', reason='too many 502 error responses')))
+
+
+class FakePlayer:
+    """Stands in for the Spotify client when queueing: one device, playing"""
+
+    def __init__(self, devices=('phone',), rejected=()):
+        self.device_list = [{'id': device, 'is_active': True} for device in devices]
+        self.rejected = set(rejected)
+        self.queued = []
+        self.lookups = 0
+
+    def devices(self):
+        self.lookups += 1
+        return {'devices': self.device_list}
+
+    def current_playback(self):
+        return {'is_playing': bool(self.device_list)}
+
+    def add_to_queue(self, uri, device_id):
+        if device_id not in [device['id'] for device in self.device_list]:
+            raise SpotifyException(404, -1, 'Device not found')
+        if uri in self.rejected:
+            raise SpotifyException(400, -1, 'Invalid track uri')
+        self.queued.append((uri, device_id))
+
+
+class BulkViewTests(FakePlaylistMixin, TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user(username='bulk', spotify_access_token='token', listen_later='playlist')
+        self.client.force_login(self.user)
+        self.uris = [make_track(n)['uri'] for n in range(3)]
+
+    def post(self, name, uris):
+        return self.client.post(reverse(f'spotify:{name}'), {'spotify_uris': uris})
+
+    def results(self, response):
+        return [(item['uri'], item['result']) for item in response.json()['results']]
+
+    def use_player(self, player):
+        patcher = mock.patch.object(playback, 'get_client', return_value=player)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return player
+
+    def test_uris_are_required_and_capped(self):
+        for name in ('bulk_add_to_listen_later', 'bulk_remove_from_playlist', 'bulk_add_to_queue'):
+            with self.subTest(name=name):
+                self.assertEqual(self.post(name, []).status_code, 400)
+                self.assertEqual(self.post(name, ['']).status_code, 400)
+                with override_settings(SPOTIFY_BULK_MAX_TRACKS=2):
+                    response = self.post(name, self.uris)
+                    self.assertEqual((response.status_code, response.json()['success']), (400, False))
+
+    def test_add_answers_from_mirror_and_queues_the_rest(self):
+        playlist = self.use_playlist(FakePlaylist([make_track(0)]))
+        listen_later.reconcile(self.user)
+
+        uris = self.uris + [self.uris[1], 'spotify:track:short']
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post('bulk_add_to_listen_later', uris)
+        data = response.json()
+        self.assertTrue(data['success'])
+        self.assertEqual(self.results(response), [
+            (self.uris[0], listen_later.DUPLICATE),
+            (self.uris[1], 'pending'),
+            (self.uris[2], 'pending'),
+            ('spotify:track:short', listen_later.INVALID),
+        ])
+
+        # No worker is running, so the job ran once the request committed
+        job = Job.objects.get(pk=data['job_id'])
+        self.assertEqual(data['job_status_url'], reverse('job_status', args=[job.pk]))
+        self.assertEqual((job.status, job.payload['spotify_uris']), (Job.SUCCEEDED, self.uris[1:]))
+        self.assertEqual(job.result['results'], [
+            {'uri': self.uris[1], 'result': listen_later.ADDED},
+            {'uri': self.uris[2], 'result': listen_later.ADDED},
+        ])
+        self.assertEqual(playlist.writes, 1)
+
+    def test_add_with_nothing_new_queues_no_job(self):
+        self.use_playlist(FakePlaylist([make_track(0)]))
+        listen_later.reconcile(self.user)
+        response = self.post('bulk_add_to_listen_later', [self.uris[0]])
+        self.assertEqual(self.results(response), [(self.uris[0], listen_later.DUPLICATE)])
+        self.assertNotIn('job_id', response.json())
+        self.assertFalse(Job.objects.exists())
+
+    def test_remove(self):
+        playlist = self.use_playlist(FakePlaylist([make_track(0), make_track(1)]))
+        response = self.post('bulk_remove_from_playlist', [self.uris[1], self.uris[2], self.uris[1]])
+        self.assertEqual(self.results(response), [
+            (self.uris[1], listen_later.REMOVED),
+            (self.uris[2], listen_later.NOT_IN_PLAYLIST),
+        ])
+        self.assertEqual([entry['track']['uri'] for entry in playlist.entries], [self.uris[0]])
+
+    def test_queue_reports_each_track(self):
+        player = self.use_player(FakePlayer(rejected=[self.uris[1]]))
+        response = self.post('bulk_add_to_queue', self.uris + [self.uris[0]])
+        self.assertTrue(response.json()['success'])
+        self.assertEqual(self.results(response), [
+            (self.uris[0], playback.QUEUED),
+            (self.uris[1], playback.INVALID),
+            (self.uris[2], playback.QUEUED),
+        ])
+        self.assertEqual(player.queued, [(self.uris[0], 'phone'), (self.uris[2], 'phone')])
+
+    def test_queue_without_active_device(self):
+        player = self.use_player(FakePlayer(devices=()))
+        response = self.post('bulk_add_to_queue', self.uris)
+        self.assertEqual(response.json(), {'success': False, 'message': response.json()['message']})
+        self.assertIn('No active Spotify device', response.json()['message'])
+        self.assertEqual(player.queued, [])
+
+
+class ActiveDeviceTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user(username='player', spotify_access_token='token')
+        self.player = FakePlayer()
+        patcher = mock.patch.object(playback, 'get_client', return_value=self.player)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_device_is_cached(self):
+        playback.queue_track(self.user, 'spotify:track:1')
+        playback.queue_track(self.user, 'spotify:track:2')
+        self.assertEqual(self.player.lookups, 1)
+
+    def test_moved_playback_is_looked_up_again_once(self):
+        playback.queue_track(self.user, 'spotify:track:1')
+        self.player.device_list = [{'id': 'laptop', 'is_active': True}]
+
+        playback.queue_track(self.user, 'spotify:track:2')
+        self.assertEqual(self.player.lookups, 2)
+        self.assertEqual(self.player.queued[-1], ('spotify:track:2', 'laptop'))
+
+        playback.queue_track(self.user, 'spotify:track:3')
+        self.assertEqual(self.player.lookups, 2)
+
+    def test_second_device_error_is_raised_and_forgotten(self):
+        playback.queue_track(self.user, 'spotify:track:1')
+        self.player.add_to_queue = mock.Mock(side_effect=SpotifyException(404, -1, 'Device not found'))
+
+        with self.assertRaises(SpotifyException):
+            playback.queue_track(self.user, 'spotify:track:2')
+        self.assertEqual(self.player.lookups, 2)
+        self.assertEqual(self.player.add_to_queue.call_count, 2)
+        self.assertIsNone(get_cache().get(playback._device_key(self.user)))
+
+    def test_stopped_playback_raises_no_active_device(self):
+        playback.queue_track(self.user, 'spotify:track:1')
+        self.player.device_list = []
+        with self.assertRaises(playback.NoActiveDevice):
+            playback.queue_track(self.user, 'spotify:track:2')
+        self.assertEqual(self.player.lookups, 2)
@@ -0,0 +1,154 @@
+"""
+Spotify access token management.
+
+Every view that talks to Spotify gets its access token from here instead of
+refreshing it on every request. The token and its expiry are stored on the
+User row; a refresh only happens when the token is (nearly) expired, runs at
+most once per user at a time, and writes back just the token columns.
+"""
+
+import logging
+import threading
+import weakref
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+from spotipy.cache_handler import MemoryCacheHandler
+
+from core.models import User
+from .client import PooledSpotifyOAuth, get_session
+
+logger = logging.getLogger(__name__)
+
+# Columns written back after a refresh - never the whole User row
+TOKEN_FIELDS = ['spotify_access_token', 'spotify_refresh_token', 'spotify_token_expires_at']
+
+# Treat tokens this close to expiry as expired so they don't die mid-request
+EXPIRY_MARGIN = timedelta(seconds=getattr(settings, 'SPOTIFY_TOKEN_EXPIRY_MARGIN', 60))
+
+# One lock per user id, dropped automatically once nobody holds it
+_user_locks = weakref.WeakValueDictionary()
+_user_locks_guard = threading.Lock()
+
+
+class SpotifyTokenError(Exception):
+    """Raised when a user has no usable Spotify token"""
+
+
+def get_oauth(scope=None):
+    """Create a SpotifyOAuth manager configured from settings"""
+    return PooledSpotifyOAuth(
+        client_id=settings.SPOTIFY_CLIENT_ID,
+        client_secret=settings.SPOTIFY_CLIENT_SECRET,
+        redirect_uri=settings.SPOTIFY_REDIRECT_URI,
+        scope=scope or settings.SPOTIFY_SCOPES,
+        # Tokens live on the User model, not in spotipy's .cache file
+        cache_handler=MemoryCacheHandler(),
+        requests_session=get_session(),
+        requests_timeout=settings.SPOTIFY_HTTP_TIMEOUT
+    )
+
+
+def _get_user_lock(user_id):
+    with _user_locks_guard:
+        lock = _user_locks.get(user_id)
+        if lock is None:
+            lock = threading.Lock()
+            _user_locks[user_id] = lock
+        return lock
+
+
+def token_is_fresh(user):
+    """Check if the user's stored access token is still usable"""
+    expires_at = user.spotify_token_expires_at
+    if not user.spotify_access_token or expires_at is None:
+        return False
+    return expires_at - EXPIRY_MARGIN > timezone.now()
+
+
+def token_expiry(token_info):
+    """Return the expiry of a spotipy token_info dict as an aware datetime"""
+    if not token_info.get('expires_at'):
+        return None
+    return datetime.fromtimestamp(token_info['expires_at'], tz=dt_timezone.utc)
+
+
+def apply_token_info(user, token_info):
+    """Copy a spotipy token_info dict onto the user without saving"""
+    user.spotify_access_token = token_info['access_token']
+    if token_info.get('refresh_token'):
+        user.spotify_refresh_token = token_info['refresh_token']
+    user.spotify_token_expires_at = token_expiry(token_info)
+
+
+def store_token_info(user, token_info):
+    """Save a spotipy token_info dict on the user, touching only the token columns"""
+    apply_token_info(user, token_info)
+    user.save(update_fields=TOKEN_FIELDS)
+
+
+def _load_token(user):
+    current = User.objects.only(*TOKEN_FIELDS).get(pk=user.pk)
+    for field in TOKEN_FIELDS:
+        setattr(user, field, getattr(current, field))
+
+
+def refresh_access_token(user, force=False):
+    """
+    Refresh the user's access token and return the new one.
+
+    Concurrent callers for the same user in this process wait on a per-user
+    lock; whoever gets it second picks up the token the first one stored
+    instead of refreshing again. The HTTP call runs outside any transaction,
+    so no row lock is held while Spotify answers. The new token is written
+    only if the row still has the token that was refreshed; if another
+    process got there first, its token is used instead. ``force`` refreshes
+    even when the stored token looks fresh, e.g. after Spotify rejected it.
+    """
+    if not user.spotify_refresh_token:
+        raise SpotifyTokenError(f"No Spotify refresh token for user {user.username}")
+
+    rejected_token = user.spotify_access_token if force else None
+
+    with _get_user_lock(user.pk):
+        _load_token(user)
+
+        # Another request refreshed while we were waiting
+        if token_is_fresh(user) and user.spotify_access_token != rejected_token:
+            return user.spotify_access_token
+
+        old_token = user.spotify_access_token
+        try:
+            token_info = get_oauth().refresh_access_token(user.spotify_refresh_token)
+        except Exception as e:
+            raise SpotifyTokenError(f"Token refresh failed for user {user.username}: {str(e)}") from e
+
+        if not token_info:
+            raise SpotifyTokenError(f"Token refresh returned nothing for user {user.username}")
+
+        apply_token_info(user, token_info)
+        updated = User.objects.filter(pk=user.pk, spotify_access_token=old_token).update(
+            **{field: getattr(user, field) for field in TOKEN_FIELDS}
+        )
+        if updated:
+            logger.info(f"Refreshed access token for user {user.username}")
+        else:
+            # Another process stored a token while we were refreshing, keep
+            # the one in the database (it may carry a rotated refresh token)
+            _load_token(user)
+            logger.info(f"Access token for user {user.username} was refreshed elsewhere")
+
+    return user.spotify_access_token
+
+
+def get_access_token(user):
+    """Return a usable access token for the user, refreshing only if it is about to expire"""
+    if token_is_fresh(user):
+        return user.spotify_access_token
+    if not user.spotify_refresh_token:
+        if user.spotify_access_token:
+            # Nothing to refresh with, the stored token is all we have
+            return user.spotify_access_token
+        raise SpotifyTokenError(f"User {user.username} has not connected Spotify")
+    return refresh_access_token(user)
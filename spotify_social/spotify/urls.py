@@ -14,5 +14,11 @@ urlpatterns = [
     path('get-top-albums/', views.get_top_albums, name='get_top_albums'),
     path('get-top-artists/', views.get_top_artists, name='get_top_artists'),
     path('remove-from-playlist/', views.remove_from_playlist, name='remove_from_playlist'),
+    path('bulk/add-to-listen-later/', views.bulk_add_to_listen_later, name='bulk_add_to_listen_later'),
+    path('bulk/remove-from-playlist/', views.bulk_remove_from_playlist, name='bulk_remove_from_playlist'),
+    path('bulk/add-to-queue/', views.bulk_add_to_queue, name='bulk_add_to_queue'),
     path('get-album-tracks/<str:album_id>/', views.get_album_tracks, name='get_album_tracks'),
+    path('listen-later/items/', views.listen_later_items, name='listen_later_items'),
+    path('currently-playing/', views.currently_playing, name='currently_playing'),
+    path('rate-limit/', views.rate_limit_metrics, name='rate_limit_metrics'),
 ] 
\ No newline at end of file
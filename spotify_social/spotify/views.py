@@ -1,16 +1,22 @@
 from django.shortcuts import render, redirect
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
 from django.conf import settings
 from django.shortcuts import redirect
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
+from core import jobs
 from core.models import User
+from social.pagination import get_page_size
+from . import albums, breaker, listen_later, playback, profile, ratelimit
+from .client import get_client, spotify_client
 from .models import TrackRating
-from social.models import Post
+from .search import add_rating_overlay, cached_search
+from .tokens import TOKEN_FIELDS, SpotifyTokenError, apply_token_info, get_access_token, get_oauth, token_expiry
+import hashlib
 import logging
 from django.http import JsonResponse
+from django.urls import reverse
 from django.views.decorators.http import require_POST
 
 logger = logging.getLogger(__name__)
@@ -25,12 +31,7 @@ def spotify_login(request):
     logger.debug(f"Scopes: {settings.SPOTIFY_SCOPES}")
     
     try:
-        sp_oauth = SpotifyOAuth(
-            client_id=settings.SPOTIFY_CLIENT_ID,
-            client_secret=settings.SPOTIFY_CLIENT_SECRET,
-            redirect_uri=settings.SPOTIFY_REDIRECT_URI,
-            scope=settings.SPOTIFY_SCOPES
-        )
+        sp_oauth = get_oauth()
         auth_url = sp_oauth.get_authorize_url()
         logger.debug(f"Generated auth URL: {auth_url}")
         return redirect(auth_url)
@@ -39,20 +40,23 @@ def spotify_login(request):
         messages.error(request, 'Error connecting to Spotify. Please try again.')
         return redirect('home')
 
+def enqueue_listen_later_playlist(user):
+    """Queue creation of the user's "listen later" playlist (at most one job per user)"""
+    return jobs.enqueue(
+        'spotify.create_listen_later_playlist',
+        user=user,
+        idempotency_key=f'listen-later-playlist:{user.pk}'
+    )
+
 def spotify_callback(request):
     """Handle Spotify OAuth callback"""
-    sp_oauth = SpotifyOAuth(
-        client_id=settings.SPOTIFY_CLIENT_ID,
-        client_secret=settings.SPOTIFY_CLIENT_SECRET,
-        redirect_uri=settings.SPOTIFY_REDIRECT_URI,
-        scope=settings.SPOTIFY_SCOPES
-    )
+    sp_oauth = get_oauth()
     
     try:
         token_info = sp_oauth.get_access_token(request.GET.get('code'))
         if token_info:
             # Get Spotify user data
-            sp = spotipy.Spotify(auth=token_info['access_token'])
+            sp = spotify_client(token_info['access_token'])
             spotify_user = sp.current_user()
             
             # Debug log the Spotify user data
@@ -62,10 +66,15 @@ def spotify_callback(request):
             try:
                 user = User.objects.get(email=spotify_user['email'])
                 # Update their Spotify token and ID
-                user.spotify_access_token = token_info['access_token']
-                user.spotify_refresh_token = token_info.get('refresh_token')
+                apply_token_info(user, token_info)
                 user.spotify_id = spotify_user['id']  # Save the Spotify ID
-                user.save()
+                user.save(update_fields=TOKEN_FIELDS + ['spotify_id'])
+                # They may have connected a different account, and the
+                # profile page we redirect to can use what we just fetched
+                profile.forget(user)
+                profile.store(user, 'current_user', spotify_user)
+                if not user.listen_later:
+                    enqueue_listen_later_playlist(user)
                 login(request, user)
                 messages.success(request, 'Successfully logged in with Spotify!')
             except User.DoesNotExist:
@@ -78,21 +87,17 @@ def spotify_callback(request):
                     username = f"{base_username}_{counter}"
                     counter += 1
                 
-                listen_later = sp.user_playlist_create(
-                    user=spotify_user['id'],
-                    name="listen later",
-                    public=True,
-                    description="made for pmo"
-                )               
-                
                 user = User.objects.create_user(
                     username=username,
                     email=spotify_user['email'],
                     spotify_access_token=token_info['access_token'],
                     spotify_refresh_token=token_info.get('refresh_token'),
-                    spotify_id=spotify_user['id'],
-                    listen_later = listen_later['id']
+                    spotify_token_expires_at=token_expiry(token_info),
+                    spotify_id=spotify_user['id']
                 )
+                # The "listen later" playlist is created in the background
+                enqueue_listen_later_playlist(user)
+                profile.store(user, 'current_user', spotify_user)
                 login(request, user)
                 messages.success(request, 'Account created successfully! You can update your username in your profile.')
             
@@ -108,43 +113,14 @@ def spotify_disconnect(request):
     """Disconnect Spotify account"""
     request.user.spotify_access_token = None
     request.user.spotify_refresh_token = None
-    request.user.save()
+    request.user.spotify_token_expires_at = None
+    request.user.save(update_fields=['spotify_access_token', 'spotify_refresh_token', 'spotify_token_expires_at'])
+    profile.forget(request.user)
+    playback.forget_active_device(request.user)
     
     messages.success(request, 'Successfully disconnected from Spotify.')
     return redirect('profile')
 
-def refresh_spotify_token(user):
-    """Refresh Spotify access token using refresh token"""
-    try:
-        sp_oauth = SpotifyOAuth(
-            client_id=settings.SPOTIFY_CLIENT_ID,
-            client_secret=settings.SPOTIFY_CLIENT_SECRET,
-            redirect_uri=settings.SPOTIFY_REDIRECT_URI,
-            scope=settings.SPOTIFY_SCOPES
-        )
-        
-        # Create a token info dictionary with the refresh token
-        token_info = {
-            'access_token': user.spotify_access_token,
-            'refresh_token': user.spotify_refresh_token,
-            'expires_at': 0  # Force refresh
-        }
-        
-        # Get new token info
-        new_token_info = sp_oauth.refresh_access_token(token_info['refresh_token'])
-        
-        if new_token_info:
-            # Update user's tokens
-            user.spotify_access_token = new_token_info['access_token']
-            if 'refresh_token' in new_token_info:
-                user.spotify_refresh_token = new_token_info['refresh_token']
-            user.save()
-            return True
-        return False
-    except Exception as e:
-        logger.error(f"Error refreshing Spotify token: {str(e)}")
-        return False
-
 @login_required
 def spotify_search(request):
     """Search for tracks and albums on Spotify"""
@@ -154,7 +130,6 @@ def spotify_search(request):
         }, status=401)
     
     query = request.GET.get('q', '')
-    results = {'tracks': [], 'albums': [], 'artists': []}
     
     if not query:
         return JsonResponse({
@@ -162,71 +137,25 @@ def spotify_search(request):
         }, status=400)
     
     try:
-        # Try to create Spotify client with current token
+        # Catalog results are shared between users, ratings are added per user
         try:
-            sp = spotipy.Spotify(auth=request.user.spotify_access_token)
-            # Test the token by making a simple request
-            sp.current_user()
-        except Exception as e:
+            results = cached_search(request.user, query)
+        except SpotifyTokenError as e:
             logger.warning(f"Spotify token expired or invalid: {str(e)}")
-            # Try to refresh the token
-            if refresh_spotify_token(request.user):
-                sp = spotipy.Spotify(auth=request.user.spotify_access_token)
-            else:
-                return JsonResponse({
-                    'error': 'Error fetching Spotify data. Please reconnect your Spotify account.'
-                }, status=401)
-        
-        # Search for tracks
-        track_results = sp.search(q=query, type='track', limit=10)
-        tracks = track_results['tracks']['items']
-        
-        # Get user ratings for tracks
-        track_ids = [track['id'] for track in tracks]
-        user_ratings = {
-            rating.track_id: rating.rating 
-            for rating in TrackRating.objects.filter(
-                user=request.user, 
-                track_id__in=track_ids
-            )
-        }
-        
-        # Get average ratings for tracks
-        avg_ratings = {
-            track_id: TrackRating.get_average_rating(track_id)
-            for track_id in track_ids
-        }
-        
-        # Add ratings to track data
-        for track in tracks:
-            track['user_rating'] = user_ratings.get(track['id'])
-            track['spotify_url'] = track['external_urls']['spotify']
-            track['avg_rating'] = avg_ratings.get(track['id'], {'average': None, 'count': 0})
-        
-        results['tracks'] = tracks
-        
-        # Search for albums
-        album_results = sp.search(q=query, type='album', limit=10)
-        albums = album_results['albums']['items']
-        
-        # Add Spotify URLs to albums
-        for album in albums:
-            album['spotify_url'] = album['external_urls']['spotify']
-        
-        results['albums'] = albums
-        
-        # Search for artists
-        artist_results = sp.search(q=query, type='artist', limit=10)
-        artists = artist_results['artists']['items']
-        
-        # Add Spotify URLs to artists
-        for artist in artists:
-            artist['spotify_url'] = artist['external_urls']['spotify']
+            return JsonResponse({
+                'error': 'Error fetching Spotify data. Please reconnect your Spotify account.'
+            }, status=401)
         
-        results['artists'] = artists
+        results['tracks'] = add_rating_overlay(results['tracks'], request.user)
         
         return JsonResponse(results)
         
+    except ratelimit.SpotifyRateLimited as e:
+        response = JsonResponse({
+            'error': 'Spotify is busy right now. Please try again in a moment.'
+        }, status=429)
+        response['Retry-After'] = e.headers['Retry-After']
+        return response
     except Exception as e:
         logger.error(f"Spotify search error: {str(e)}")
         return JsonResponse({
@@ -245,36 +174,29 @@ def rate_track(request):
         
         try:
             # Update or create rating
-            rating_obj, created = TrackRating.objects.update_or_create(
-                user=request.user,
-                track_id=track_id,
-                defaults={
-                    'track_name': track_name,
-                    'artist_name': artist_name,
-                    'rating': rating
-                }
+            rating_obj, created = TrackRating.set_rating(
+                request.user,
+                track_id,
+                track_name,
+                artist_name,
+                rating
             )
             
-            # Create a post about the rating
-            sp = spotipy.Spotify(auth=request.user.spotify_access_token)
-            track = sp.track(track_id)
-            
-            Post.objects.create(
+            # The post about the rating needs the track from Spotify, so it is
+            # created in the background
+            job = jobs.enqueue(
+                'spotify.post_rating',
+                {'track_id': track_id, 'rating': rating},
                 user=request.user,
-                post_type='track',  # Changed from 'rating' to 'track' to enable queue functionality
-                content=f"Rated this song {rating}/5 stars!",
-                spotify_id=track_id,
-                spotify_name=track_name,
-                spotify_artist=artist_name,
-                spotify_image_url=track['album']['images'][0]['url'] if track['album']['images'] else '',
-                spotify_preview_url=track['preview_url'],  # This is needed for the queue button
-                spotify_url=track['external_urls']['spotify']
+                idempotency_key=jobs.request_idempotency_key(request)
             )
             
             return JsonResponse({
                 'success': True,
                 'rating': rating,
-                'message': 'Rating saved successfully'
+                'message': 'Rating saved successfully',
+                'job_id': job.id,
+                'job_status_url': reverse('job_status', args=[job.id])
             })
             
         except Exception as e:
@@ -296,22 +218,12 @@ def get_spotify_token(request):
         return JsonResponse({'error': 'Spotify account not connected'}, status=401)
     
     try:
-        # Create SpotifyOAuth instance
-        sp_oauth = SpotifyOAuth(
-            client_id=settings.SPOTIFY_CLIENT_ID,
-            client_secret=settings.SPOTIFY_CLIENT_SECRET,
-            redirect_uri=settings.SPOTIFY_REDIRECT_URI,
-            scope=settings.SPOTIFY_SCOPES
-        )
-        
-        # Try to refresh the token
-        token_info = sp_oauth.refresh_access_token(request.user.spotify_refresh_token)
-        if token_info:
-            request.user.spotify_access_token = token_info['access_token']
-            request.user.save()
-            return JsonResponse({'access_token': token_info['access_token']})
-        
-        return JsonResponse({'access_token': request.user.spotify_access_token})
+        # Hands out the stored token until it is about to expire
+        access_token = get_access_token(request.user)
+        return JsonResponse({
+            'access_token': access_token,
+            'expires_at': request.user.spotify_token_expires_at.isoformat() if request.user.spotify_token_expires_at else None
+        })
     except Exception as e:
         logger.error(f"Error getting Spotify token: {str(e)}")
         return JsonResponse({'error': str(e)}, status=500)
@@ -330,58 +242,20 @@ def search_page(request):
         })
     
     try:
-        # Try to create Spotify client with current token
+        # Catalog results are shared between users, ratings are added per user
         try:
-            sp = spotipy.Spotify(auth=request.user.spotify_access_token)
-            # Test the token by making a simple request
-            sp.current_user()
-        except Exception as e:
+            results = cached_search(request.user, query, types=('track', 'album'))
+        except SpotifyTokenError as e:
             logger.warning(f"Spotify token expired or invalid: {str(e)}")
-            # Try to refresh the token
-            if refresh_spotify_token(request.user):
-                sp = spotipy.Spotify(auth=request.user.spotify_access_token)
-            else:
-                messages.error(request, 'Error fetching Spotify data. Please reconnect your Spotify account.')
-                return redirect('profile')
-        
-        # Search for tracks
-        track_results = sp.search(q=query, type='track', limit=10)
-        tracks = track_results['tracks']['items']
-        
-        # Get user ratings for tracks
-        track_ids = [track['id'] for track in tracks]
-        user_ratings = {
-            rating.track_id: rating.rating 
-            for rating in TrackRating.objects.filter(
-                user=request.user, 
-                track_id__in=track_ids
-            )
-        }
-        
-        # Get average ratings for tracks
-        avg_ratings = {
-            track_id: TrackRating.get_average_rating(track_id)
-            for track_id in track_ids
-        }
-        
-        # Add ratings to track data
-        for track in tracks:
-            track['user_rating'] = user_ratings.get(track['id'])
-            track['spotify_url'] = track['external_urls']['spotify']
-            track['avg_rating'] = avg_ratings.get(track['id'], {'average': None, 'count': 0})
-        
-        # Search for albums
-        album_results = sp.search(q=query, type='album', limit=10)
-        albums = album_results['albums']['items']
+            messages.error(request, 'Error fetching Spotify data. Please reconnect your Spotify account.')
+            return redirect('profile')
         
-        # Add Spotify URLs to albums
-        for album in albums:
-            album['spotify_url'] = album['external_urls']['spotify']
+        tracks = add_rating_overlay(results['tracks'], request.user)
         
         context = {
             'query': query,
             'tracks': tracks,
-            'albums': albums,
+            'albums': results['albums'],
         }
         
         return render(request, 'spotify/search.html', context)
@@ -397,7 +271,7 @@ def get_top_albums(request):
         return JsonResponse({'error': 'Spotify not connected'}, status=400)
         
     try:
-        sp = spotipy.Spotify(auth=request.user.spotify_access_token)
+        sp = get_client(request.user)
         
         # Get user's top tracks
         top_tracks = sp.current_user_top_tracks(limit=50, time_range='medium_term')
@@ -437,7 +311,7 @@ def get_top_artists(request):
         return JsonResponse({'error': 'Spotify not connected'}, status=400)
         
     try:
-        sp = spotipy.Spotify(auth=request.user.spotify_access_token)
+        sp = get_client(request.user)
         
         # Get user's top artists directly
         top_artists = sp.current_user_top_artists(limit=3, time_range='medium_term')
@@ -469,13 +343,8 @@ def remove_from_playlist(request):
         return JsonResponse({'success': False, 'message': 'No track URI provided'})
     
     try:
-        sp = spotipy.Spotify(auth=request.user.spotify_access_token)
-        
-        # Remove the track from the playlist
-        sp.playlist_remove_all_occurrences_of_items(
-            request.user.listen_later,
-            [track_uri]
-        )
+        # Remove the track from the playlist and the local mirror
+        listen_later.remove_tracks(request.user, [track_uri])
         
         return JsonResponse({
             'success': True,
@@ -488,6 +357,115 @@ def remove_from_playlist(request):
             'message': 'Error removing track from playlist'
         })
 
+def _get_track_uris(request):
+    """
+    Return (uris, error_response) for the spotify_uris list in a bulk request.
+
+    URIs are de-duplicated, keeping their order.
+    """
+    uris = list(dict.fromkeys(uri for uri in request.POST.getlist('spotify_uris') if uri))
+    if not uris:
+        return None, JsonResponse({'success': False, 'message': 'No track URIs provided'}, status=400)
+    if len(uris) > settings.SPOTIFY_BULK_MAX_TRACKS:
+        return None, JsonResponse({
+            'success': False,
+            'message': f'At most {settings.SPOTIFY_BULK_MAX_TRACKS} tracks can be sent at once'
+        }, status=400)
+    return uris, None
+
+def _serialize_results(results):
+    return [{'uri': uri, 'result': result} for uri, result in results.items()]
+
+@login_required
+@require_POST
+def bulk_add_to_listen_later(request):
+    """Add a list of tracks to the Listen Later playlist"""
+    if not request.user.spotify_access_token:
+        return JsonResponse({'success': False, 'message': 'Spotify account not connected'})
+    
+    uris, error = _get_track_uris(request)
+    if error:
+        return error
+    
+    # Invalid URIs and duplicates are answered from the local mirror, the
+    # rest are added by one job: a lookup per 50 unknown tracks and an add
+    # per 100
+    results = listen_later.check_tracks(request.user, uris)
+    pending = [uri for uri, result in results.items() if result is None]
+    if not pending:
+        return JsonResponse({
+            'success': True,
+            'message': 'No tracks to add',
+            'results': _serialize_results(results)
+        })
+    
+    digest = hashlib.sha1('\n'.join(pending).encode()).hexdigest()
+    job = jobs.enqueue(
+        'spotify.add_many_to_listen_later',
+        {'spotify_uris': pending},
+        user=request.user,
+        idempotency_key=jobs.request_idempotency_key(request, f'listen-later-many:{request.user.pk}:{digest}')
+    )
+    for uri in pending:
+        results[uri] = 'pending'
+    
+    return JsonResponse({
+        'success': True,
+        'message': f'Adding {len(pending)} tracks to your Listen Later playlist...',
+        'results': _serialize_results(results),
+        'job_id': job.id,
+        'job_status_url': reverse('job_status', args=[job.id])
+    })
+
+@login_required
+@require_POST
+def bulk_remove_from_playlist(request):
+    """Remove a list of tracks from the listen later playlist"""
+    if not request.user.spotify_access_token:
+        return JsonResponse({'success': False, 'message': 'Spotify account not connected'})
+    
+    uris, error = _get_track_uris(request)
+    if error:
+        return error
+    
+    try:
+        results = listen_later.remove_tracks(request.user, uris)
+        return JsonResponse({
+            'success': True,
+            'message': 'Tracks removed from playlist',
+            'results': _serialize_results(results)
+        })
+    except Exception as e:
+        logger.error(f"Error removing tracks from playlist: {str(e)}")
+        return JsonResponse({
+            'success': False,
+            'message': 'Error removing tracks from playlist'
+        })
+
+@login_required
+@require_POST
+def bulk_add_to_queue(request):
+    """Add a list of tracks to the user's Spotify queue, in order"""
+    if not request.user.spotify_access_token:
+        return JsonResponse({'success': False, 'message': 'Spotify account not connected'})
+    
+    uris, error = _get_track_uris(request)
+    if error:
+        return error
+    
+    try:
+        results = playback.queue_tracks(request.user, uris)
+    except playback.NoActiveDevice as e:
+        return JsonResponse({'success': False, 'message': str(e)})
+    except Exception as e:
+        logger.error(f"Error adding tracks to queue: {str(e)}")
+        return JsonResponse({'success': False, 'message': 'Error adding tracks to queue'})
+    
+    return JsonResponse({
+        'success': playback.QUEUED in results.values(),
+        'results': _serialize_results(results)
+    })
+
 @login_required
 def get_album_tracks(request, album_id):
     """Get all tracks from an album"""
@@ -497,35 +475,88 @@ def get_album_tracks(request, album_id):
         }, status=401)
     
     try:
-        # Try to create Spotify client with current token
+        # Shared between users; a rejected token is refreshed by call_spotify
         try:
-            sp = spotipy.Spotify(auth=request.user.spotify_access_token)
-            # Test the token by making a simple request
-            sp.current_user()
-        except Exception as e:
+            tracks = albums.get_album_tracks(request.user, album_id)
+        except SpotifyTokenError as e:
             logger.warning(f"Spotify token expired or invalid: {str(e)}")
-            # Try to refresh the token
-            if refresh_spotify_token(request.user):
-                sp = spotipy.Spotify(auth=request.user.spotify_access_token)
-            else:
-                return JsonResponse({
-                    'error': 'Error fetching Spotify data. Please reconnect your Spotify account.'
-                }, status=401)
-        
-        # Get album tracks
-        album_tracks = sp.album_tracks(album_id)
-        tracks = album_tracks['items']
-        
-        # Add Spotify URLs to tracks
-        for track in tracks:
-            track['spotify_url'] = track['external_urls']['spotify']
+            return JsonResponse({
+                'error': 'Error fetching Spotify data. Please reconnect your Spotify account.'
+            }, status=401)
         
         return JsonResponse({
             'tracks': tracks
         })
         
+    except ratelimit.SpotifyRateLimited as e:
+        response = JsonResponse({
+            'error': 'Spotify is busy right now. Please try again in a moment.'
+        }, status=429)
+        response['Retry-After'] = e.headers['Retry-After']
+        return response
     except Exception as e:
         logger.error(f"Error fetching album tracks: {str(e)}")
         return JsonResponse({
             'error': 'Error fetching album tracks. Please try again.'
         }, status=500)
+
+def serialize_listen_later_item(item):
+    """JSON representation of a mirrored listen later item"""
+    track = item.track
+    return {
+        'track_uri': item.track_uri,
+        'position': item.position,
+        'name': track.name if track else item.track_uri,
+        'artist_name': track.artist_name if track else '',
+        'image_url': track.image_url if track else '',
+        'spotify_url': track.spotify_url if track else '',
+    }
+
+@login_required
+def listen_later_items(request):
+    """Get the next page of the user's listen later playlist, from the local mirror"""
+    after = request.GET.get('cursor')
+    try:
+        after = int(after) if after else None
+    except ValueError:
+        return JsonResponse({
+            'success': False,
+            'message': 'Invalid cursor'
+        }, status=400)
+    
+    items, next_cursor = listen_later.get_page(
+        request.user,
+        after,
+        get_page_size(request, settings.SPOTIFY_LISTEN_LATER_PAGE_SIZE)
+    )
+    return JsonResponse({
+        'success': True,
+        'items': [serialize_listen_later_item(item) for item in items],
+        'next_cursor': next_cursor
+    })
+
+@login_required
+def currently_playing(request):
+    """The track the user is playing right now, polled by the profile page"""
+    if not request.user.spotify_access_token:
+        return JsonResponse({
+            'success': False,
+            'message': 'Please connect your Spotify account first.'
+        }, status=401)
+
+    try:
+        return JsonResponse({
+            'success': True,
+            'currently_playing': profile.get_currently_playing(request.user)
+        })
+    except Exception as e:
+        logger.warning(f"Error fetching currently playing track: {str(e)}")
+        return JsonResponse({
+            'success': False,
+            'message': 'Error fetching currently playing track'
+        })
+
+@staff_member_required
+def rate_limit_metrics(request):
+    """Current Spotify rate limit budget usage and circuit breaker state for this process"""
+    return JsonResponse({**ratelimit.metrics(), 'breaker': breaker.metrics()})